@@ -32,7 +32,8 @@ logging.basicConfig(
 
 class ASRSReportClassificationPredictor:
 
-    def __init__(self, model=None, vectorizer=None, normalized: bool = True, deviation_rate: float = 0.0, parameters=None):
+    def __init__(self, model=None, vectorizer=None, normalized: bool = True, deviation_rate: float = 0.0, parameters=None,
+                 csv_cache: bool = False):
 
         if parameters is None:
             parameters = dict()
@@ -43,7 +44,7 @@ class ASRSReportClassificationPredictor:
                 setattr(self._model, param, value)
 
         self._normalize = normalized
-        self._preprocessor = ASRSReportDataPreprocessor(vectorizer)
+        self._preprocessor = ASRSReportDataPreprocessor(vectorizer, csv_cache=csv_cache)
         self._vectorizer = vectorizer
         self._deviation_rate = deviation_rate
 
@@ -256,7 +257,8 @@ class ASRSReportClassificationEvaluator:
 
 class ASRSReportClassificationTrainer:
 
-    def __init__(self, model=None, parameters: dict = None, algorithm=None, normalized: bool = True, vectorizer=None, deviation_rate: float = 0.0):
+    def __init__(self, model=None, parameters: dict = None, algorithm=None, normalized: bool = True, vectorizer=None, deviation_rate: float = 0.0,
+                 csv_cache: bool = False):
 
         # TODO: Initialize an empty model for each field classifier
         def set_classification_algorithm(classification_algorithm: str):
@@ -301,7 +303,7 @@ class ASRSReportClassificationTrainer:
             parameters = dict()
 
         self._normalize = normalized
-        self._preprocessor = ASRSReportDataPreprocessor(vectorizer)
+        self._preprocessor = ASRSReportDataPreprocessor(vectorizer, csv_cache=csv_cache)
 
         if model is None:
             self._model = set_classification_algorithm(algorithm)
@@ -434,7 +436,8 @@ class ASRSReportClassificationTrainer:
             json.dump(self._params, params_file, indent=4)
 
 
-def launch_classification(models_dir_paths: list, texts_paths: list, label: str, label_filter: list, algorithm: str, normalize: bool, mode: str, plot: bool):
+def launch_classification(models_dir_paths: list, texts_paths: list, label: str, label_filter: list, algorithm: str, normalize: bool, mode: str, plot: bool,
+                          csv_cache: bool = False):
 
     deviation_rate = np.random.uniform(low=0.95, high=1.05, size=None) if normalize else None  # 5% of maximum deviation between classes
     if mode == 'train':
@@ -463,7 +466,8 @@ def launch_classification(models_dir_paths: list, texts_paths: list, label: str,
                 vectorizer=vectorizer,
                 parameters=parameters,
                 normalized=normalize,
-                deviation_rate=deviation_rate
+                deviation_rate=deviation_rate,
+                csv_cache=csv_cache
             )
             classifier.train_report_classification(texts_paths, label, label_filter)
     else:
@@ -487,7 +491,8 @@ def launch_classification(models_dir_paths: list, texts_paths: list, label: str,
                 parameters=parameters,
                 vectorizer=vectorizer,
                 normalized=normalize,
-                deviation_rate=deviation_rate
+                deviation_rate=deviation_rate,
+                csv_cache=csv_cache
             )
 
             if not texts_paths:
@@ -6,17 +6,43 @@ new models using existing examples but also build new and improve existing
 entity recognition models.
 """
 
-import spacy
-import spacy.displacy as displacy
 import sys
+import importlib
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
 from colorama import Style, Fore
+
+
+def _lazy(module_name: str, function_name: str):
+    """Creates a function which imports the module of the real function only
+    when it is called. This way each subcommand loads only its own subsystem
+    (e.g. the NER test does not import sklearn, gensim or matplotlib).
+
+    :type module_name: str
+    :param module_name: The name of the module containing the function.
+    :type function_name: str
+    :param function_name: The name of the function to be called.
+
+    :return: The function forwarding its arguments to the imported function.
+    """
+    def call(*args, **kwargs):
+        module = importlib.import_module(module_name)
+        return getattr(module, function_name)(*args, **kwargs)
+
+    return call
+
+
 # importing own modules
-from avisaf.training.new_entity_trainer import train_spacy_model
-from avisaf.training.training_data_creator import annotate_auto, annotate_man
-from avisaf.classification.classifier import launch_classification
-from avisaf.util.data_extractor import get_entities
+tag_files = _lazy('avisaf.tagging.batch_tagger', 'tag_files')
+serve = _lazy('avisaf.tagging.ner_server', 'serve')
+export_ner_model = _lazy('avisaf.training.model_export', 'export_ner_model')
+prune_model_vectors = _lazy('avisaf.training.vector_pruning', 'prune_model_vectors')
+train_spacy_model = _lazy('avisaf.training.new_entity_trainer', 'train_spacy_model')
+annotate_auto = _lazy('avisaf.training.training_data_creator', 'annotate_auto')
+annotate_man = _lazy('avisaf.training.training_data_creator', 'annotate_man')
+compact_journal = _lazy('avisaf.util.training_data_build', 'compact_journal')
+convert_training_data = _lazy('avisaf.util.training_data_build', 'convert_training_data')
+launch_classification = _lazy('avisaf.classification.classifier', 'launch_classification')
 
 sample_text = ("Flight XXXX at FL340 in cruise flight; cleared direct to ZZZZZ intersection to join the XXXXX arrival "
                "to ZZZ and cleared to cross ZZZZZ1 at FL270. Just after top of descent in VNAV when the throttles "
@@ -69,6 +95,7 @@ def test(model='en_core_web_md',
     :return: The exit code of the function.
     :rtype: int
     """
+    from avisaf.tagging.batch_tagger import load_ner_model
 
     if text_path is None:
         # use sample text
@@ -91,15 +118,7 @@ def test(model='en_core_web_md',
         # create new nlp object
         if model.startswith('en_core_web'):
             print('Using a default english language model!', file=sys.stderr)
-        try:
-            # trying to load either the pre-trained spaCy model or a model in current directory
-            nlp = spacy.load(model)
-        except OSError:
-            model_path = str(Path(model).resolve())
-            nlp = spacy.load(model_path)
-
-        if not nlp.has_pipe(u'ner'):
-            raise OSError
+        nlp = load_ner_model(model)
 
     except OSError as ex:
         print(ex)
@@ -132,6 +151,9 @@ def test(model='en_core_web_md',
         print(result_string)
 
     if html_result_file is not None or visualize:
+        import spacy.displacy as displacy
+        from avisaf.util.data_extractor import get_entities
+
         colors = {
             "AIRPLANE": "#ACECD5",
             "CREW": "#FFF9AA",
@@ -177,7 +199,20 @@ def choose_action(args: Namespace):
             model=args.model,
             new_model_name=args.name,
             tr_data_srcfile=Path(args.data),
-            verbose=args.verbose
+            verbose=args.verbose,
+            use_cache=not args.no_cache,
+            batch_strategy=args.batching,
+            batch_size=args.batch_size,
+            batch_compound=tuple(args.batch_compound) if args.batch_compound is not None else None,
+            dev_data_srcfile=Path(args.dev_data) if args.dev_data is not None else None,
+            checkpoint_every=args.checkpoint_every,
+            resume=args.resume,
+            patience=args.patience,
+            metrics_path=Path(args.metrics) if args.metrics is not None else None,
+            processes=args.processes,
+            sync_every=args.sync_every,
+            shuffle_buffer_size=args.shuffle_buffer,
+            prometheus_path=Path(args.prometheus) if args.prometheus is not None else None
         ),
         'test_ner': lambda: test(
             model=args.model,
@@ -186,15 +221,53 @@ def choose_action(args: Namespace):
             text_path=args.text,
             html_result_file=args.save
         ),
+        'tag_ner': lambda: tag_files(
+            model=args.model,
+            file_paths=args.paths,
+            output_path=args.output,
+            field_name=args.field,
+            batch_size=args.batch_size,
+            include_text=not args.no_text,
+            processes=args.processes,
+            shard_size=args.shard_size,
+            csv_cache=args.csv_cache
+        ),
+        'serve_ner': lambda: serve(
+            model=args.model,
+            host=args.host,
+            port=args.port,
+            cache_size=args.cache_size,
+            max_batch=args.max_batch,
+            max_wait=args.batch_wait / 1000,
+            request_timeout=args.timeout
+        ),
+        'export_ner': lambda: export_ner_model(
+            model=args.model,
+            output_path=Path(args.output),
+            prune_vectors=args.prune_vectors
+        ),
+        'prune_vectors': lambda: prune_model_vectors(
+            model=args.model,
+            output_path=Path(args.output),
+            rows_count=args.rows,
+            corpus_paths=args.corpus,
+            dev_data_path=Path(args.dev_data) if args.dev_data is not None else None,
+            float16=args.float16
+        ),
         'annotate_auto': lambda: annotate_auto(
-            Path(args.keys_file),
+            Path(args.keys_file) if args.keys_file is not None else None,
             args.label,
             model=args.model,
             training_src_file=args.data,
             extract_texts=args.extract,
             use_phrasematcher=args.p,
             save=args.save,
-            verbose=args.verbose
+            verbose=args.verbose,
+            phrase_attr=args.attr,
+            all_pipes=args.all_pipes,
+            n_process=args.processes,
+            manifest_path=Path(args.manifest) if args.manifest is not None else None,
+            use_cache=not args.no_cache
         ),
         'annotate_man': lambda: annotate_man(
             labels_path=Path(args.labels),
@@ -203,6 +276,14 @@ def choose_action(args: Namespace):
             save=args.not_save,
             start_index=args.start_index
         ),
+        'compact': lambda: compact_journal(
+            journal_path=Path(args.journal),
+            training_data_path=Path(args.output)
+        ),
+        'convert': lambda: convert_training_data(
+            source_path=Path(args.source),
+            target_path=Path(args.target)
+        ),
         'classifier': lambda: launch_classification(
             label=args.label,
             texts_paths=args.paths,
@@ -211,7 +292,8 @@ def choose_action(args: Namespace):
             normalize=args.normalize,
             mode=args.mode,
             models_dir_paths=args.model,
-            plot=args.plot
+            plot=args.plot,
+            csv_cache=args.csv_cache
         )
     }
 
@@ -251,7 +333,8 @@ def main():
     arg_train.add_argument(
         '-d', '--data',
         metavar='PATH',
-        help='File path to the file with annotated training data.',
+        help='File path to the file with annotated training data or to the directory of training data shards '
+             '(JSON, JSONL or msgpack files) to be streamed.',
         default=Path('data_files', 'training_data', 'annotated_data_part_01.json'),
         required=True
     )
@@ -279,6 +362,96 @@ def main():
         action='store_true',
         help='Flag for verbose printing.'
     )
+    arg_train.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Flag indicating that the pre-tokenized training examples cache should not be used.'
+    )
+    arg_train.add_argument(
+        '--batching',
+        choices=['fixed', 'compounding', 'bucketed'],
+        default='fixed',
+        help='The strategy of dividing the training examples into batches: batches of fixed size, batches of '
+             'compounding size or batches of texts of similar length.'
+    )
+    arg_train.add_argument(
+        '-b', '--batch-size',
+        metavar='INT',
+        type=int,
+        default=3,
+        help='The size of the batches of fixed (and bucketed) batching.'
+    )
+    arg_train.add_argument(
+        '--batch-compound',
+        metavar=('START', 'STOP', 'FACTOR'),
+        type=float,
+        nargs=3,
+        default=None,
+        help='Compounding batch sizes growing from START to STOP by FACTOR (used by compounding and bucketed '
+             'batching, default for compounding: 4 32 1.001).'
+    )
+    arg_train.add_argument(
+        '--dev-data',
+        metavar='PATH',
+        help='File path to the held-out annotated data the model is evaluated on after each iteration. The best '
+             'scoring model is kept.',
+        default=None
+    )
+    arg_train.add_argument(
+        '--checkpoint-every',
+        metavar='INT',
+        type=int,
+        default=1,
+        help='Save a checkpoint allowing to resume the training every INT iterations (0 means never).'
+    )
+    arg_train.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume the training of the model given by --name from its last checkpoint.'
+    )
+    arg_train.add_argument(
+        '--patience',
+        metavar='INT',
+        type=int,
+        default=None,
+        help='Stop the training when the held-out F-score has not improved for INT iterations (requires --dev-data).'
+    )
+    arg_train.add_argument(
+        '--metrics',
+        metavar='PATH',
+        help='File path to the JSONL file the metrics of each iteration will be appended to.',
+        default=None
+    )
+    arg_train.add_argument(
+        '--prometheus',
+        metavar='PATH',
+        help='File path to the Prometheus text file (.prom) rewritten with the latest training metrics.',
+        default=None
+    )
+    arg_train.add_argument(
+        '-j', '--processes',
+        metavar='INT',
+        type=int,
+        default=1,
+        help='The number of worker processes training replicas of the model in parallel (experimental, '
+             'not shown to be faster than a single process).'
+    )
+    arg_train.add_argument(
+        '--sync-every',
+        metavar='INT',
+        type=int,
+        default=1000,
+        help='The number of training examples (of all the replicas together) after which the weights of the '
+             'replicas are averaged.'
+    )
+    arg_train.add_argument(
+        '--shuffle-buffer',
+        metavar='INT',
+        type=int,
+        default=10000,
+        help='The number of examples held by the shuffle buffer when the training data are streamed from a '
+             'directory of shards.'
+    )
 
     # test subcommand and its arguments
     # ========================================================================================
@@ -318,6 +491,196 @@ def main():
         help='File path to the text which will have entities extracted. If None, sample text is used.'
     )
 
+    # batch tagging subcommand and its arguments
+    # ========================================================================================
+    arg_tag = subparser.add_parser(
+        'tag_ner',
+        help='Recognize entities in all texts of given files.',
+        description='Command used for batch entity recognition of CSV/JSON/JSONL texts with JSONL output.'
+    )
+    arg_tag.set_defaults(action='tag_ner')
+    arg_tag.add_argument(
+        'paths',
+        nargs='+',
+        help='Paths to the CSV, JSON or JSONL files containing the texts to be tagged.'
+    )
+    arg_tag.add_argument(
+        '-m', '--model',
+        metavar='PATH/MODEL',
+        default='en_core_web_md',
+        help='File path to an existing spaCy model or existing spaCy model name for NER.'
+    )
+    arg_tag.add_argument(
+        '-o', '--output',
+        metavar='PATH',
+        default=None,
+        help='The JSONL file the entities will be written to. If None, stdout is used.'
+    )
+    arg_tag.add_argument(
+        '-f', '--field',
+        default=None,
+        help='CSV column to be tagged (in format FirstLineLabel_SecondLineLabel). Narratives are used by default.'
+    )
+    arg_tag.add_argument(
+        '-b', '--batch-size',
+        metavar='INT',
+        type=int,
+        default=256,
+        help='The number of texts buffered by spaCy during processing.'
+    )
+    arg_tag.add_argument(
+        '-j', '--processes',
+        metavar='INT',
+        type=int,
+        default=1,
+        help='The number of worker processes, each of them loading its own copy of the model.'
+    )
+    arg_tag.add_argument(
+        '--shard-size',
+        metavar='INT',
+        type=int,
+        default=1000,
+        help='The number of texts sent to a worker process at once.'
+    )
+    arg_tag.add_argument(
+        '--no-text',
+        action='store_true',
+        help='Flag indicating that the texts should not be included in the output.'
+    )
+    arg_tag.add_argument(
+        '--csv-cache',
+        action='store_true',
+        help='Flag indicating that CSV files should be read through their columnar cache (built on the first read).'
+    )
+
+    # NER-only model export subcommand and its arguments
+    # ========================================================================================
+    arg_export = subparser.add_parser(
+        'export_ner',
+        help='Export a slim, NER-only version of a model.',
+        description='Saves the model without the pipes other than NER, without lemmatization tables and without the '
+                    'word vectors unless the NER uses them. Such model loads faster and needs less memory.'
+    )
+    arg_export.set_defaults(action='export_ner')
+    arg_export.add_argument(
+        'model',
+        metavar='PATH/NAME',
+        help='File path to an existing spaCy model or existing spaCy model name to be exported.'
+    )
+    arg_export.add_argument(
+        'output',
+        metavar='PATH',
+        help='The directory the exported model will be saved to.'
+    )
+    arg_export.add_argument(
+        '--prune-vectors',
+        metavar='INT',
+        type=int,
+        default=None,
+        help='Keep only INT rows of the word vectors used by the NER, the other words are mapped to the nearest '
+             'remaining vectors.'
+    )
+
+    # word vectors pruning subcommand and its arguments
+    # ========================================================================================
+    arg_prune = subparser.add_parser(
+        'prune_vectors',
+        help='Prune the word vectors of a model to the vocabulary of a corpus.',
+        description='Keeps the vectors of the words most frequent in the given corpus, the other words are mapped to '
+                    'the nearest kept vectors. The saved model contains only the NER pipe.'
+    )
+    arg_prune.set_defaults(action='prune_vectors')
+    arg_prune.add_argument(
+        'model',
+        metavar='PATH/NAME',
+        help='File path to an existing spaCy model or existing spaCy model name.'
+    )
+    arg_prune.add_argument(
+        'output',
+        metavar='PATH',
+        help='The directory the model with pruned vectors will be saved to.'
+    )
+    arg_prune.add_argument(
+        '-n', '--rows',
+        metavar='INT',
+        type=int,
+        required=True,
+        help='The number of vectors to be kept.'
+    )
+    arg_prune.add_argument(
+        '-c', '--corpus',
+        metavar='PATH',
+        nargs='+',
+        required=True,
+        help='Training data (JSON, JSONL, msgpack) or ASRS CSV files the word frequencies are counted in.'
+    )
+    arg_prune.add_argument(
+        '--dev-data',
+        metavar='PATH',
+        default=None,
+        help='File path to the held-out annotated data used to compare the F-score before and after pruning.'
+    )
+    arg_prune.add_argument(
+        '--float16',
+        action='store_true',
+        help='Store the vectors as float16 (they are cast back to float32 when the model is loaded).'
+    )
+
+    # NER server subcommand and its arguments
+    # ========================================================================================
+    arg_serve = subparser.add_parser(
+        'serve_ner',
+        help='Start a local HTTP server for entity recognition.',
+        description='Long-running HTTP service keeping the NER models loaded. POST {"text": ...} to /ner.'
+    )
+    arg_serve.set_defaults(action='serve_ner')
+    arg_serve.add_argument(
+        '-m', '--model',
+        metavar='PATH/MODEL',
+        default='en_core_web_md',
+        help='The model used when a request does not specify one. Loaded at startup.'
+    )
+    arg_serve.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='The address the server listens on.'
+    )
+    arg_serve.add_argument(
+        '--port',
+        metavar='INT',
+        type=int,
+        default=8000,
+        help='The port the server listens on.'
+    )
+    arg_serve.add_argument(
+        '--cache-size',
+        metavar='INT',
+        type=int,
+        default=2,
+        help='The maximal number of models kept loaded at the same time.'
+    )
+    arg_serve.add_argument(
+        '--max-batch',
+        metavar='INT',
+        type=int,
+        default=32,
+        help='The maximal number of texts processed together by one nlp.pipe call.'
+    )
+    arg_serve.add_argument(
+        '--batch-wait',
+        metavar='MS',
+        type=float,
+        default=5.0,
+        help='The number of milliseconds waited for other requests to join the current batch.'
+    )
+    arg_serve.add_argument(
+        '--timeout',
+        metavar='SECONDS',
+        type=float,
+        default=60.0,
+        help='The number of seconds a request waits for its texts to be processed before it fails.'
+    )
+
     # automatic training data builder and its arguments
     # ========================================================================================
     arg_autobuild = subparser.add_parser(
@@ -328,13 +691,23 @@ def main():
     arg_autobuild.set_defaults(action='annotate_auto')
     arg_autobuild.add_argument(
         'keys_file',
+        nargs='?',
+        default=None,
         help='Path to file with words to be matched.'
     )
     arg_autobuild.add_argument(
         'label',
+        nargs='?',
         type=str,
+        default=None,
         help='The text of the label of an entity.'
     )
+    arg_autobuild.add_argument(
+        '--manifest',
+        metavar='PATH',
+        default=None,
+        help='JSON file mapping labels to their pattern files. All the labels are annotated in a single pass.'
+    )
     arg_autobuild.add_argument(
         '-d', '--data',
         type=str,
@@ -357,6 +730,28 @@ def main():
         action='store_true',
         help='Flag indicating that spaCy\'s PhraseMatcher object should be used.'
     )
+    arg_autobuild.add_argument(
+        '--attr',
+        default='ORTH',
+        help='The token attribute used by the PhraseMatcher (e.g. ORTH or LOWER).'
+    )
+    arg_autobuild.add_argument(
+        '--all-pipes',
+        action='store_true',
+        help='Flag indicating that all the model pipes should be run, not only those needed by the patterns.'
+    )
+    arg_autobuild.add_argument(
+        '-j', '--processes',
+        metavar='INT',
+        type=int,
+        default=1,
+        help='The number of processes used for text processing.'
+    )
+    arg_autobuild.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Flag indicating that the compiled patterns cache should not be used.'
+    )
     arg_autobuild.add_argument(
         '-s', '--save',
         action='store_true',
@@ -404,6 +799,45 @@ def main():
         help='Flag indicating whether the result of the annotation should NOT be saved.',
     )
 
+    # manual annotation journal compaction and its arguments
+    # ========================================================================================
+    arg_compact = subparser.add_parser(
+        'compact',
+        help='Merge the manual annotation journal into the training data file.',
+        description='Moves the entries of the JSONL journal written by build into the JSON training data file.'
+    )
+    arg_compact.set_defaults(action='compact')
+    arg_compact.add_argument(
+        'journal',
+        nargs='?',
+        help='The path to the JSONL journal file.',
+        default=Path('data_files', 'training_data', 'man_annotated_data.jsonl')
+    )
+    arg_compact.add_argument(
+        '-o', '--output',
+        metavar='PATH',
+        help='The JSON training data file the journal will be merged into.',
+        default=Path('data_files', 'training_data', 'man_annotated_data.json')
+    )
+
+    # training data format conversion and its arguments
+    # ========================================================================================
+    arg_convert = subparser.add_parser(
+        'convert',
+        help='Convert the training data between the JSON and msgpack formats.',
+        description='Converts the list of (text, annotations) tuples between JSON and the compact msgpack format. '
+                    'The format of the source is detected automatically, the target format is given by its suffix.'
+    )
+    arg_convert.set_defaults(action='convert')
+    arg_convert.add_argument(
+        'source',
+        help='The path to the JSON or msgpack training data file.'
+    )
+    arg_convert.add_argument(
+        'target',
+        help='The path to the new training data file (.msgpack suffix for msgpack, JSON otherwise).'
+    )
+
     # classification module and its arguments
     # ========================================================================================
     arg_classifier = subparser.add_parser(
@@ -456,6 +890,11 @@ def main():
         nargs='+',
         help='Trained model(s) to use (at least one is required)',
     )
+    arg_classifier.add_argument(
+        '--csv-cache',
+        action='store_true',
+        help='Flag indicating that CSV files should be read through their columnar cache (built on the first read).'
+    )
 
     if len(sys.argv) <= 1:
         args.print_help()
@@ -465,8 +904,14 @@ def main():
         helpers = {
             'test': arg_test.print_help,
             'train': arg_train.print_help,
+            'tag_ner': arg_tag.print_help,
+            'serve_ner': arg_serve.print_help,
+            'export_ner': arg_export.print_help,
+            'prune_vectors': arg_prune.print_help,
             'autobuild': arg_autobuild.print_help,
             'build': arg_manbuild.print_help,
+            'compact': arg_compact.print_help,
+            'convert': arg_convert.print_help,
             'train_classifier': arg_classifier.print_help
         }
 
@@ -482,6 +927,10 @@ def main():
             print("The output will not be visible without one of --print, --render or --save argument.\n", file=sys.stderr)
             arg_test.print_help()
             return 1
+        if parsed.action == 'annotate_auto' and parsed.manifest is None and (parsed.keys_file is None or parsed.label is None):
+            print("Either keys_file and label or the --manifest argument has to be given.\n", file=sys.stderr)
+            arg_autobuild.print_help()
+            return 1
         exit_code = choose_action(parsed)
         return exit_code
 
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Batch tagger is the module responsible for Named Entity Recognition over
+large collections of texts. The model is loaded only once, the texts are read
+from CSV, JSON or JSONL files and streamed through spaCy's nlp.pipe and the
+recognized entities are written incrementally as JSON lines, so that the memory
+usage does not depend on the size of the processed corpus. The texts may be
+also split into shards tagged by a pool of worker processes, each of which
+holds its own copy of the model.
+"""
+
+import os
+import sys
+import json
+import spacy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+# importing own modules
+from avisaf.util.model_loading import load_model
+
+
+def load_ner_model(model: [str, Path]):
+    """Loads a spaCy model which is supposed to contain the 'ner' pipe. The
+    model is first looked up as a pre-downloaded spaCy model and only then as
+    a path to a local directory. The pipes other than 'ner' are not loaded at
+    all (models exported by export_ner command do not contain them).
+
+    :type model: str, Path
+    :param model: The string representation of a spaCy model. Either an existing
+        pre-downloaded spaCy model or a path to a local directory.
+
+    :return: The loaded spaCy Language object.
+    """
+    try:
+        # trying to load either the pre-trained spaCy model or a model in current directory
+        nlp = load_model(model, disable=_unused_pipes(model))
+    except OSError:
+        model_path = str(Path(model).resolve())
+        nlp = load_model(model_path, disable=_unused_pipes(model_path))
+
+    if not nlp.has_pipe(u'ner'):
+        raise OSError(f'The model \'{model}\' does not contain the \'ner\' pipe.')
+
+    return nlp
+
+
+def _unused_pipes(model: [str, Path]):
+    """Reads the names of the model pipes other than 'ner' from the meta.json
+    file of the model, without loading the model.
+
+    :return: The list of pipe names (empty if the meta data cannot be read).
+    """
+    model_path = Path(model)
+    if not model_path.exists() and spacy.util.is_package(str(model)):
+        model_path = spacy.util.get_package_path(str(model))
+
+    try:
+        meta = spacy.util.get_model_meta(model_path)
+    except (OSError, ValueError):
+        return []
+
+    return [pipe for pipe in meta.get('pipeline', []) if isinstance(pipe, str) and pipe != 'ner']
+
+
+def _text_from_item(item):
+    """Gets the text from a JSON item which may be either the text string itself,
+    a (text, annotations) training example or a dictionary with 'text' key.
+    """
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        return item['text']
+    text, _ = item
+    return text
+
+
+def read_texts(file_path: Path, field_name: str = None, csv_cache: bool = False):
+    """Lazily reads the texts to be tagged from the given file. CSV files are
+    expected to be ASRS database exports, JSON files to contain a list of texts
+    or (text, annotations) tuples and JSONL files one such item per line. Any
+    other file is read as plain text with one text per line.
+
+    :type file_path: Path
+    :param file_path: The path to the file containing the texts.
+    :type field_name: str
+    :param field_name: The CSV column (in format FirstLineLabel_SecondLineLabel)
+        to be extracted. If None, the narratives and callbacks are used.
+    :type csv_cache: bool
+    :param csv_cache: A flag indicating that CSV files should be read through
+        their columnar cache (built on the first read).
+
+    :return: Returns a python generator of text strings.
+    """
+    file_path = Path(file_path)
+
+    if file_path.suffix == '.csv':
+        from avisaf.util.data_extractor import DataExtractor, get_narratives
+
+        if field_name is not None:
+            extractor = DataExtractor([str(file_path)], use_cache=csv_cache)
+            texts = extractor.extract_from_csv_columns(field_name)[field_name]
+        else:
+            texts = get_narratives(file_path, use_cache=csv_cache or None)
+        yield from (str(text) for text in texts)
+
+    elif file_path.suffix == '.jsonl':
+        with file_path.open(mode='r') as file:
+            for line in file:
+                if line.strip():
+                    yield _text_from_item(json.loads(line))
+
+    elif file_path.suffix == '.json':
+        with file_path.open(mode='r') as file:
+            items = json.load(file)
+        yield from (_text_from_item(item) for item in items)
+
+    else:
+        with file_path.open(mode='r') as file:
+            yield from (line.rstrip('\n') for line in file if line.strip())
+
+
+def tag_texts(nlp, texts, batch_size: int = 256):
+    """Streams the texts through the nlp.pipe and yields the entities found in
+    each of them. The texts are consumed lazily, so any iterable may be used.
+
+    :type nlp: Language
+    :param nlp: The spaCy model containing the 'ner' pipe.
+    :type texts: iterable
+    :param texts: The (text, context) tuples to have entities recognized. The
+        context object is passed through unchanged.
+    :type batch_size: int
+    :param batch_size: The number of texts buffered by spaCy during processing.
+
+    :return: Returns a python generator of (entities, context) tuples where
+        entities is the list of (start_index, end_index, label) entity
+        descriptors.
+    """
+    for doc, context in nlp.pipe(texts, as_tuples=True, batch_size=batch_size):
+        entities = [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+        yield entities, context
+
+
+# the model loaded once by each of the worker processes
+_worker_nlp = None
+
+
+def _init_worker(model: str):
+    """Process pool initializer which loads the model of the worker process."""
+    global _worker_nlp
+    _worker_nlp = load_ner_model(model)
+
+
+def _tag_shard(texts: list, batch_size: int):
+    """Recognizes the entities of a shard of texts in a worker process."""
+    return [entities for entities, _ in tag_texts(_worker_nlp, ((text, None) for text in texts), batch_size)]
+
+
+def _shards(texts, shard_size: int):
+    """Splits the stream of (text, context) tuples into lists of shard_size items."""
+    shard = []
+    for item in texts:
+        shard.append(item)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def tag_texts_parallel(model: [str, Path], texts, processes: int = None,
+                       shard_size: int = 1000, batch_size: int = 256):
+    """Multi-process variant of tag_texts function. The stream of texts is split
+    into disjoint shards which are tagged by a pool of worker processes. Each
+    worker loads the model only once. The results are yielded in the order of
+    the input texts and at most two shards per worker are being processed at
+    the same time, so the input is still consumed lazily.
+
+    :type model: str, Path
+    :param model: The string representation of a spaCy model. Either an existing
+        pre-downloaded spaCy model or a path to a local directory.
+    :type texts: iterable
+    :param texts: The (text, context) tuples to have entities recognized. The
+        context objects never leave the main process.
+    :type processes: int
+    :param processes: The number of worker processes, defaults to the number
+        of CPUs.
+    :type shard_size: int
+    :param shard_size: The number of texts sent to a worker at once.
+    :type batch_size: int
+    :param batch_size: The number of texts buffered by spaCy during processing.
+
+    :return: Returns a python generator of (entities, context) tuples.
+    """
+    processes = os.cpu_count() if processes is None else processes
+    pending = deque()
+
+    def collect():
+        future, contexts = pending.popleft()
+        yield from zip(future.result(), contexts)
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(str(model),)) as executor:
+        for shard in _shards(texts, shard_size):
+            shard_texts = [text for text, _ in shard]
+            contexts = [context for _, context in shard]
+            pending.append((executor.submit(_tag_shard, shard_texts, batch_size), contexts))
+
+            if len(pending) >= 2 * processes:
+                yield from collect()
+
+        while pending:
+            yield from collect()
+
+
+def read_sources(file_paths: list, field_name: str = None, include_text: bool = True, csv_cache: bool = False):
+    """Reads the texts from all given files and pairs each of them with the
+    record describing its origin.
+
+    :return: Returns a python generator of (text, record) tuples.
+    """
+    for file_path in file_paths:
+        for index, text in enumerate(read_texts(Path(file_path), field_name, csv_cache)):
+            record = {"source": str(file_path), "index": index}
+            if include_text:
+                record["text"] = text
+            yield text, record
+
+
+def write_records(tagged, output_file):
+    """Writes the tagged records as JSON lines into an opened file.
+
+    :type tagged: iterable
+    :param tagged: The (entities, record) tuples in the order of the input texts.
+    :param output_file: Opened text file (or stdout) for the result.
+
+    :return: The number of written records.
+    """
+    count = 0
+    for entities, record in tagged:
+        record["entities"] = entities
+        output_file.write(json.dumps(record) + '\n')
+        count += 1
+
+    output_file.flush()
+    return count
+
+
+def tag_files(model: [str, Path], file_paths: list, output_path: Path = None,
+              field_name: str = None, batch_size: int = 256, include_text: bool = True,
+              processes: int = 1, shard_size: int = 1000, csv_cache: bool = False):
+    """Batch Named Entity Recognition. The function loads the model once and
+    streams all the texts from given files through it. The result is written
+    incrementally into the output file, one JSON object per text, containing
+    the source file, the index of the text in the file, the list of entities
+    and optionally the text itself.
+
+    :type model: str, Path
+    :param model: The string representation of a spaCy model. Either an existing
+        pre-downloaded spaCy model or a path to a local directory.
+    :type file_paths: list
+    :param file_paths: The paths to CSV, JSON, JSONL or plain text files with
+        the texts to be tagged.
+    :type output_path: Path
+    :param output_path: The path to the JSONL result file. If None, the result
+        is printed to the stdout.
+    :type field_name: str
+    :param field_name: The CSV column (in format FirstLineLabel_SecondLineLabel)
+        to be extracted. If None, the narratives and callbacks are used.
+    :type batch_size: int
+    :param batch_size: The number of texts buffered by spaCy during processing.
+    :type include_text: bool
+    :param include_text: A flag indicating whether the text itself should be
+        written along with its entities.
+    :type processes: int
+    :param processes: The number of worker processes. If greater than 1, the
+        texts are tagged by a process pool.
+    :type shard_size: int
+    :param shard_size: The number of texts sent to a worker process at once.
+    :type csv_cache: bool
+    :param csv_cache: A flag indicating that CSV files should be read through
+        their columnar cache (built on the first read).
+
+    :return: The number of tagged texts.
+    """
+    texts = read_sources(file_paths, field_name, include_text, csv_cache)
+    if processes > 1:
+        tagged = tag_texts_parallel(model, texts, processes, shard_size=shard_size, batch_size=batch_size)
+    else:
+        tagged = tag_texts(load_ner_model(model), texts, batch_size=batch_size)
+
+    try:
+        if output_path is None:
+            count = write_records(tagged, sys.stdout)
+        else:
+            with Path(output_path).open(mode='w') as output_file:
+                count = write_records(tagged, output_file)
+    except BrokenProcessPool:
+        raise OSError(f'The model \'{model}\' could not be loaded by the worker processes.')
+
+    print(f'{count} texts tagged using the model: {model}.', file=sys.stderr)
+
+    return count
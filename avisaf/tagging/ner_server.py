@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""NER server is the module providing a long-running local HTTP service for
+Named Entity Recognition. The loaded models are kept in a LRU cache, so that
+the model loading time is paid only once per model, and concurrent requests
+are grouped into micro-batches processed by spaCy's nlp.pipe.
+
+The service accepts POST requests on /ner path with JSON body containing either
+"text" string or "texts" list and optionally the "model" to be used. GET request
+on /health path returns the list of currently loaded models.
+"""
+
+import sys
+import json
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+# importing own modules
+from avisaf.tagging.batch_tagger import load_ner_model
+
+
+class BatcherStoppedError(RuntimeError):
+    """Raised when a text is submitted to a MicroBatcher of an evicted model."""
+
+
+class MicroBatcher:
+    """Collects the texts of concurrent requests for one model and processes
+    them together by a single nlp.pipe call in a dedicated thread, which is
+    also the only thread using the model.
+    """
+
+    def __init__(self, nlp, max_batch: int = 32, max_wait: float = 0.005):
+        self._nlp = nlp
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._stop_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str):
+        """Schedules the text for entity recognition.
+
+        :type text: str
+        :param text: The text to have entities recognized.
+
+        :return: The Future object which will hold the list of
+            (start_index, end_index, label) entity descriptors.
+        """
+        future = Future()
+        with self._stop_lock:
+            if self._stopped:
+                raise BatcherStoppedError('The model was evicted from the cache.')
+            self._queue.put((text, future))
+        return future
+
+    def stop(self):
+        """Lets the worker thread finish after processing already queued texts.
+        The texts submitted afterwards are rejected.
+        """
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(None)
+
+    def _fail_pending(self):
+        """Resolves the futures of the texts left in the queue by an exception."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and not item[1].done():
+                item[1].set_exception(BatcherStoppedError('The model was evicted from the cache.'))
+
+    def _next_batch(self):
+        batch = [self._queue.get()]  # waiting for the first text of the batch
+        while batch[-1] is not None and len(batch) < self._max_batch:
+            try:
+                batch.append(self._queue.get(timeout=self._max_wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        running = True
+        while running:
+            batch = self._next_batch()
+            if batch[-1] is None:
+                running = False
+                batch = batch[:-1]
+            if not batch:
+                continue
+
+            try:
+                docs = self._nlp.pipe([text for text, _ in batch], batch_size=len(batch))
+                for doc, (_, future) in zip(docs, batch):
+                    future.set_result([(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents])
+            except Exception as ex:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(ex)
+
+        self._fail_pending()
+
+
+class ModelCache:
+    """LRU cache of loaded NER models keyed by the model name or path. Each of
+    the cached models has its own MicroBatcher.
+    """
+
+    def __init__(self, max_size: int = 2, max_batch: int = 32, max_wait: float = 0.005):
+        self._max_size = max(max_size, 1)
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._batchers = OrderedDict()
+        self._loading = {}  # the futures of the models being loaded
+        self._lock = threading.Lock()
+
+    def get(self, model: str):
+        """Returns the MicroBatcher of the given model. The model is loaded if
+        it is not present in the cache and the least recently used model is
+        evicted if the cache is full.
+
+        :type model: str
+        :param model: The string representation of a spaCy model. Either an
+            existing pre-downloaded spaCy model or a path to a local directory.
+
+        :return: The MicroBatcher object of the model.
+        """
+        with self._lock:
+            batcher = self._batchers.get(model)
+            if batcher is not None:
+                self._batchers.move_to_end(model)
+                return batcher
+
+            loading = self._loading.get(model)
+            loads_model = loading is None
+            if loads_model:
+                loading = Future()
+                self._loading[model] = loading
+
+        if not loads_model:
+            # the model is being loaded by another request, the cached models are not blocked meanwhile
+            return loading.result()
+
+        try:
+            batcher = MicroBatcher(load_ner_model(model), self._max_batch, self._max_wait)
+        except Exception as ex:
+            with self._lock:
+                del self._loading[model]
+            loading.set_exception(ex)
+            raise
+
+        with self._lock:
+            del self._loading[model]
+            self._batchers[model] = batcher
+            print(f'Model loaded: {model}', file=sys.stderr)
+
+            while len(self._batchers) > self._max_size:
+                evicted_model, evicted = self._batchers.popitem(last=False)
+                evicted.stop()
+                print(f'Model evicted from the cache: {evicted_model}', file=sys.stderr)
+
+        loading.set_result(batcher)
+        return batcher
+
+    def models(self):
+        with self._lock:
+            return list(self._batchers.keys())
+
+
+class NERRequestHandler(BaseHTTPRequestHandler):
+    """HTTP request handler of the NER server."""
+
+    # set by the serve function
+    model_cache = None
+    default_model = None
+    request_timeout = 60.0
+
+    def _send_json(self, status: int, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {"error": f'Unknown path: {self.path}'})
+            return
+        self._send_json(200, {"models": self.model_cache.models()})
+
+    def do_POST(self):
+        if self.path != '/ner':
+            self._send_json(404, {"error": f'Unknown path: {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise TypeError('The request has to be a JSON object.')
+            texts = [request['text']] if 'text' in request else request['texts']
+            if not isinstance(texts, list):
+                raise TypeError('The texts have to be a list.')
+            if not all(isinstance(text, str) for text in texts):
+                raise TypeError('The texts have to be strings.')
+            model = request.get('model', self.default_model)
+            if not isinstance(model, str):
+                raise TypeError('The model has to be a string.')
+        except (ValueError, KeyError, TypeError) as ex:
+            self._send_json(400, {"error": f'Invalid request: {ex}'})
+            return
+
+        try:
+            batcher = self.model_cache.get(model)
+        except OSError as ex:
+            self._send_json(404, {"error": str(ex)})
+            return
+        except Exception as ex:
+            # e.g. a model directory which cannot be loaded
+            self._send_json(500, {"error": f'The model {model} could not be loaded: {ex}'})
+            return
+
+        try:
+            futures = [batcher.submit(text) for text in texts]
+            results = [future.result(timeout=self.request_timeout) for future in futures]
+        except BatcherStoppedError as ex:
+            self._send_json(503, {"error": str(ex)})
+            return
+        except FutureTimeoutError:
+            self._send_json(503, {"error": f'The texts were not processed in {self.request_timeout} seconds.'})
+            return
+        except Exception as ex:
+            self._send_json(500, {"error": str(ex)})
+            return
+
+        if 'text' in request:
+            self._send_json(200, {"model": model, "entities": results[0]})
+        else:
+            self._send_json(200, {"model": model, "results": [{"entities": ents} for ents in results]})
+
+    def log_message(self, format, *args):
+        print(f'{self.address_string()} - {format % args}', file=sys.stderr)
+
+
+def serve(model: str = 'en_core_web_md', host: str = '127.0.0.1', port: int = 8000,
+          cache_size: int = 2, max_batch: int = 32, max_wait: float = 0.005, request_timeout: float = 60.0):
+    """Starts the NER server. The default model is loaded before the server
+    starts accepting requests. The server runs until it is interrupted.
+
+    :type model: str
+    :param model: The model used by the requests which do not specify one.
+    :type host: str
+    :param host: The address the server listens on.
+    :type port: int
+    :param port: The port the server listens on.
+    :type cache_size: int
+    :param cache_size: The maximal number of models kept loaded at once.
+    :type max_batch: int
+    :param max_batch: The maximal number of texts processed by one nlp.pipe call.
+    :type max_wait: float
+    :param max_wait: The number of seconds waited for other texts to be added
+        into the current batch.
+    :type request_timeout: float
+    :param request_timeout: The number of seconds a request waits for its
+        texts to be processed before it fails with 503 status.
+
+    :return: The exit code of the function.
+    :rtype: int
+    """
+    NERRequestHandler.model_cache = ModelCache(cache_size, max_batch, max_wait)
+    NERRequestHandler.default_model = model
+    NERRequestHandler.request_timeout = request_timeout
+    NERRequestHandler.model_cache.get(model)  # warm up the default model
+
+    server = ThreadingHTTPServer((host, port), NERRequestHandler)
+    print(f'Serving NER on http://{host}:{port}/ner', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Batching module contains the strategies used to divide the training
+examples into batches passed to nlp.update. Fixed size batches, batches of
+compounding size (growing from start to stop by given factor) and batches of
+texts of similar length are supported.
+"""
+
+import random
+import itertools
+from spacy.util import compounding, minibatch
+
+BATCH_STRATEGIES = ['fixed', 'compounding', 'bucketed']
+
+
+def batch_sizes(size: int = 3, compound: tuple = None):
+    """Creates the generator of batch sizes.
+
+    :type size: int
+    :param size: The size of all the batches if compound is None.
+    :type compound: tuple
+    :param compound: The (start, stop, factor) triplet. If given, the batch
+        size starts at start value and is multiplied by factor after each
+        batch until it reaches the stop value.
+
+    :return: An infinite generator of batch sizes.
+    """
+    if compound is not None:
+        start, stop, factor = compound
+        return compounding(start, stop, factor)
+
+    return itertools.repeat(size)
+
+
+def bucketed_batches(examples, sizes, pool_size: int = 1000):
+    """Divides the examples into batches of texts of similar length, so that the
+    shorter texts are not padded to the length of the longest one in the batch.
+    The examples are taken in pools of pool_size examples, each pool is sorted
+    by the length of the texts, split into batches and the batches are yielded
+    in random order. The randomness of the example order is therefore kept
+    between the pools.
+
+    :type examples: iterable
+    :param examples: The (Doc, GoldParse) tuples.
+    :param sizes: The generator of batch sizes.
+    :type pool_size: int
+    :param pool_size: The number of examples sorted at once.
+
+    :return: A python generator of the lists of examples.
+    """
+    examples = iter(examples)
+    while True:
+        pool = list(itertools.islice(examples, pool_size))
+        if not pool:
+            break
+
+        pool.sort(key=lambda example: len(example[0]))
+        batches = []
+        while pool:
+            size = max(int(next(sizes)), 1)
+            batches.append(pool[:size])
+            pool = pool[size:]
+
+        random.shuffle(batches)
+        yield from batches
+
+
+def make_batches(examples, strategy: str = 'fixed', size: int = 3, compound: tuple = None):
+    """Divides the training examples into batches using given strategy.
+
+    :type examples: iterable
+    :param examples: The (Doc, GoldParse) tuples.
+    :type strategy: str
+    :param strategy: One of 'fixed' (batches of size examples), 'compounding'
+        (batch sizes given by compound triplet) or 'bucketed' (batches of texts
+        of similar length, sized by compound triplet if given, otherwise by
+        size).
+    :type size: int
+    :param size: The batch size used by fixed strategy.
+    :type compound: tuple
+    :param compound: The (start, stop, factor) triplet of compounding batch
+        sizes.
+
+    :return: A python generator of the lists of examples.
+    """
+    if strategy not in BATCH_STRATEGIES:
+        raise ValueError(f'Unknown batching strategy "{strategy}", use one of {BATCH_STRATEGIES}.')
+
+    if strategy == 'compounding':
+        return minibatch(examples, size=batch_sizes(compound=compound or (4.0, 32.0, 1.001)))
+
+    if strategy == 'bucketed':
+        return bucketed_batches(examples, batch_sizes(size, compound))
+
+    return minibatch(examples, size=size)
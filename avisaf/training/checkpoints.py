@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""Checkpoints module is responsible for saving the state of the NER model
+training, so that the best model can be selected at the end of the training
+and an interrupted training can be resumed.
+
+The full model (including the vectors) is saved only once, before the first
+iteration. Each checkpoint then contains only the weights of the NER pipe,
+the strings added to the vocabulary since the base model was saved and the
+optimizer state (except for the parallel training, which is resumed with a
+fresh optimizer). The weights and the optimizer state are copied in the
+training thread, everything else is serialized and written to the disk by a
+background thread, so the training does not wait for the disk.
+
+The checkpoint directory contains:
+    base/   the full model saved before the training
+    last/   the most recent checkpoint (used to resume the training)
+    best/   the checkpoint with the best held-out score
+"""
+
+import os
+import json
+import queue
+import itertools
+import pickle
+import random
+import time
+import shutil
+import logging
+import threading
+from pathlib import Path
+# importing own modules
+from avisaf.util.model_loading import load_model
+
+
+class BackgroundWriter:
+    """A single background thread writing the checkpoints in the order they
+    were submitted. At most max_pending checkpoints wait for the thread, the
+    training is blocked only when the disk is slower than that.
+    """
+
+    def __init__(self, max_pending: int = 2):
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            try:
+                job()
+            except Exception as ex:
+                logging.error(f'Checkpoint could not be written: {ex}')
+                self._error = ex
+
+    def submit(self, job):
+        """Queues the function which writes a checkpoint.
+
+        :param job: The function without arguments.
+        """
+        self._raise_error()
+        self._jobs.put(job)
+
+    def close(self):
+        """Waits until all the queued checkpoints are written."""
+        self._jobs.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise OSError(f'Checkpoint could not be written: {error}') from error
+
+
+def _layer_ids(nlp):
+    """Returns the ids of the NER model layers in a deterministic order. The ids
+    are used as optimizer state keys and differ between processes, so the
+    optimizer state is stored with the positions of the layers instead.
+    """
+    return [layer.id for layer in nlp.get_pipe('ner').model.walk()]
+
+
+def _remap_keys(state: dict, mapping: dict):
+    """Replaces the layer ids in the optimizer state keys (either an id or an
+    (id, name) tuple) using given mapping. Keys of unknown layers are dropped.
+    """
+    result = {}
+    for key, value in state.items():
+        layer_id = key[0] if isinstance(key, tuple) else key
+        if layer_id in mapping:
+            result[(mapping[layer_id],) + tuple(key[1:]) if isinstance(key, tuple) else mapping[layer_id]] = value
+    return result
+
+
+def optimizer_state(nlp, optimizer):
+    """Copies the state of the optimizer (moments, update counts and averaged
+    weights of the NER model layers).
+
+    :type nlp: Language
+    :param nlp: The trained spaCy model.
+    :param optimizer: The thinc optimizer used for the training.
+
+    :return: The dictionary with the copy of the optimizer state.
+    """
+    positions = {layer_id: position for position, layer_id in enumerate(_layer_ids(nlp))}
+    state = {}
+    for name in ('mom1', 'mom2', 'averages', 'nr_update'):
+        values = getattr(optimizer, name, None)
+        if values is None:
+            continue
+        copied = {key: value.copy() if hasattr(value, 'copy') else value for key, value in values.items()}
+        state[name] = _remap_keys(copied, positions)
+    return state
+
+
+def set_optimizer_state(nlp, optimizer, state: dict):
+    """Restores the optimizer state copied by optimizer_state function.
+
+    :type nlp: Language
+    :param nlp: The trained spaCy model.
+    :param optimizer: The thinc optimizer used for the training.
+    :type state: dict
+    :param state: The state to be restored.
+    """
+    layer_ids = dict(enumerate(_layer_ids(nlp)))
+    for name, values in state.items():
+        current = getattr(optimizer, name, None)
+        if current is None:
+            continue
+        current.clear()
+        current.update(_remap_keys(values, layer_ids))
+
+
+class CheckpointManager:
+    """Decides when a checkpoint is saved and saves/restores the checkpoints
+    of the training.
+
+    :type checkpoint_dir: Path
+    :param checkpoint_dir: The directory of the checkpoints.
+    :type every: int
+    :param every: A checkpoint is saved every given number of iterations
+        (0 means only when the held-out score improves).
+    :type background: bool
+    :param background: A flag indicating whether the checkpoints should be
+        written by a background thread.
+    """
+
+    def __init__(self, checkpoint_dir: Path, every: int = 1, background: bool = True):
+        self.checkpoint_dir = Path(checkpoint_dir).resolve()
+        self.every = every
+        self.best_score = None
+        self.best_iteration = None
+        self.last_write_time = None  # the duration of the most recently written checkpoint
+        self.last_snapshot_time = None  # the time the training thread spent by the most recent checkpoint
+        self._base_strings_count = None  # the number of strings of the base model
+        self._new_strings = (0, [])  # the most recently collected strings added since the base model was saved
+        self._writer = BackgroundWriter() if background else None
+
+    @property
+    def base_path(self):
+        return self.checkpoint_dir.joinpath('base')
+
+    def _checkpoint_path(self, name: str):
+        path = self.checkpoint_dir.joinpath(name)
+        if not path.exists() and path.with_name(f'{name}.old').exists():
+            return path.with_name(f'{name}.old')  # interrupted while being replaced
+        return path
+
+    def save_base(self, nlp):
+        """Saves the full model before the training starts. The checkpoints
+        contain only the parts of the model which change during the training.
+
+        :type nlp: Language
+        :param nlp: The spaCy model to be trained.
+        """
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        if self.base_path.exists():
+            shutil.rmtree(self.base_path)
+        for name in ('last', 'best', 'last.old', 'best.old'):
+            shutil.rmtree(self.checkpoint_dir.joinpath(name), ignore_errors=True)
+        nlp.to_disk(self.base_path)
+        self._set_base_strings(nlp)
+
+    def _set_base_strings(self, nlp):
+        self._base_strings_count = len(nlp.vocab.strings)
+        self._new_strings = (self._base_strings_count, [])
+
+    def _strings_since_base(self, nlp, strings_count: int):
+        """Returns the strings added to the vocabulary since the base model
+        was saved, up to the given number of strings. The strings are stored
+        in the order they were added and never removed, so they are collected
+        again only if their count has changed since the previous checkpoint.
+        """
+        if self._new_strings[0] != strings_count:
+            new_strings = itertools.islice(nlp.vocab.strings, self._base_strings_count, strings_count)
+            self._new_strings = (strings_count, list(new_strings))
+        return self._new_strings[1]
+
+    def step(self, nlp, optimizer, iteration: int, score: float = None, early_stopping=None):
+        """Saves a checkpoint after an iteration if the iteration number is a
+        multiple of every or the score improved.
+
+        :type nlp: Language
+        :param nlp: The trained spaCy model.
+        :param optimizer: The thinc optimizer used for the training or None if
+            its state should not be saved (e.g. the parallel training, where
+            the optimizer of the training process is not used).
+        :type iteration: int
+        :param iteration: The number of the finished iteration.
+        :type score: float
+        :param score: The held-out score of the model (higher is better) or None.
+        :type early_stopping: EarlyStopping
+        :param early_stopping: The early stopping whose state (already updated
+            by the score of the iteration) is stored in the checkpoint, or None.
+
+        :return: The list of saved checkpoint names.
+        """
+        improved = score is not None and (self.best_score is None or score > self.best_score)
+        if improved:
+            self.best_score = score
+            self.best_iteration = iteration
+
+        names = []
+        if self.every and (iteration + 1) % self.every == 0:
+            names.append('last')
+        if improved:
+            names.append('best')
+        if not names:
+            return names
+
+        # copying the state now, the training changes it while the checkpoint is being written
+        snapshot_start = time.time()
+        state = {
+            'iteration': iteration,
+            'score': score,
+            'best_score': self.best_score,
+            'best_iteration': self.best_iteration,
+            'early_stopping': early_stopping.state() if early_stopping is not None else None,
+        }
+        content = {
+            'ner.bin': nlp.get_pipe('ner').to_bytes(exclude=['vocab']),
+            'state.json': json.dumps(state).encode('utf-8'),
+        }
+        # the strings are only added to the vocabulary, their count is enough to find them later
+        strings_count = len(nlp.vocab.strings)
+        if 'last' in names:
+            training_state = {
+                'optimizer': optimizer_state(nlp, optimizer) if optimizer is not None else None,
+                'random': random.getstate()
+            }
+        else:
+            training_state = None
+        self.last_snapshot_time = time.time() - snapshot_start
+
+        def write():
+            write_start = time.time()
+            content['strings.json'] = json.dumps(self._strings_since_base(nlp, strings_count)).encode('utf-8')
+            files = dict(content)
+            if training_state is not None:
+                files['training_state.pkl'] = pickle.dumps(training_state, protocol=pickle.HIGHEST_PROTOCOL)
+            for name in names:
+                self._write_checkpoint(name, files if name == 'last' else content)
+            self.last_write_time = time.time() - write_start
+
+        if self._writer is not None:
+            self._writer.submit(write)
+        else:
+            write()
+
+        return names
+
+    def _write_checkpoint(self, name: str, files: dict):
+        path = self.checkpoint_dir.joinpath(name)
+        tmp_path = path.with_name(f'{name}.{os.getpid()}.tmp')
+        old_path = path.with_name(f'{name}.old')
+
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        for file_name, data in files.items():
+            with tmp_path.joinpath(file_name).open(mode='wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+        # a directory cannot replace another one atomically, the old one is kept until the new one is in place
+        shutil.rmtree(old_path, ignore_errors=True)
+        if path.exists():
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def close(self):
+        """Waits until all the checkpoints are written."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def last_state(self):
+        """Reads the state of the most recent checkpoint.
+
+        :return: The dictionary with 'iteration', 'score', 'best_score',
+            'best_iteration' and 'early_stopping' keys or None if there is no
+            checkpoint to resume.
+        """
+        state_path = self._checkpoint_path('last').joinpath('state.json')
+        if not self.base_path.exists() or not state_path.exists():
+            return None
+
+        with state_path.open(mode='r') as state_file:
+            return json.load(state_file)
+
+    def _apply(self, nlp, name: str):
+        path = self._checkpoint_path(name)
+        with path.joinpath('strings.json').open(mode='r') as strings_file:
+            for string in json.load(strings_file):
+                nlp.vocab.strings.add(string)
+        nlp.get_pipe('ner').from_bytes(path.joinpath('ner.bin').read_bytes(), exclude=['vocab'])
+
+    def resume(self, optimizer_factory, early_stopping=None):
+        """Loads the model from the most recent checkpoint along with the
+        optimizer, random generator and early stopping state.
+
+        :param optimizer_factory: The function creating the optimizer for the
+            loaded model (e.g. Language.resume_training).
+        :type early_stopping: EarlyStopping
+        :param early_stopping: The early stopping whose state is restored from
+            the checkpoint, or None.
+
+        :return: The (nlp, optimizer, state) triplet, where state is the
+            dictionary returned by last_state function.
+        """
+        state = self.last_state()
+        if state is None:
+            raise OSError(f'There is no checkpoint to resume in {self.checkpoint_dir}.')
+
+        nlp = load_model(self.base_path)
+        self._set_base_strings(nlp)
+        self._apply(nlp, 'last')
+        optimizer = optimizer_factory(nlp)
+
+        training_state_path = self._checkpoint_path('last').joinpath('training_state.pkl')
+        with training_state_path.open(mode='rb') as state_file:
+            training_state = pickle.load(state_file)
+        if training_state['optimizer'] is not None:
+            set_optimizer_state(nlp, optimizer, training_state['optimizer'])
+        else:
+            print('The checkpoint does not contain the optimizer state (parallel training), '
+                  'the training is resumed with a fresh optimizer.')
+        random.setstate(training_state['random'])
+
+        self.best_score = state.get('best_score')
+        self.best_iteration = state.get('best_iteration')
+        if early_stopping is not None and state.get('early_stopping') is not None:
+            early_stopping.set_state(state['early_stopping'])
+
+        return nlp, optimizer, state
+
+    def restore_best(self, nlp):
+        """Replaces the NER weights of the model by the weights of the best
+        checkpoint, if there is one.
+
+        :type nlp: Language
+        :param nlp: The trained spaCy model.
+
+        :return: The iteration of the best checkpoint or None.
+        """
+        self.close()
+        if self.best_iteration is None or not self._checkpoint_path('best').joinpath('ner.bin').exists():
+            return None
+
+        self._apply(nlp, 'best')
+        return self.best_iteration
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Evaluation module is responsible for measuring the entity recognition
+quality of a trained model on held-out data and for deciding when the
+training should stop because the quality does not improve anymore.
+"""
+
+import time
+
+
+def _prf(true_positives: int, predicted: int, expected: int):
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / expected if expected else 0.0
+    f_score = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'p': precision, 'r': recall, 'f': f_score}
+
+
+def evaluate_ner(nlp, dev_data: list, labels: list, batch_size: int = 256):
+    """Evaluates the entity recognition of the model on the held-out data. The
+    texts are processed in batches by nlp.pipe and a predicted entity is
+    correct only if both its boundaries and its label match an annotated one.
+
+    :type nlp: Language
+    :param nlp: The evaluated spaCy model (the pipes not needed for the entity
+        recognition should be disabled).
+    :type dev_data: list
+    :param dev_data: The list of held-out (text, annotations) tuples.
+    :type labels: list
+    :param labels: The entity labels to be evaluated.
+    :type batch_size: int
+    :param batch_size: The number of texts processed by nlp.pipe at once.
+
+    :return: The dictionary with overall precision, recall and F-score under
+        'ents_p', 'ents_r' and 'ents_f' keys, the {label: {'p', 'r', 'f'}}
+        dictionary under 'ents_per_type' key and the evaluation time in
+        seconds under 'eval_time' key.
+    """
+    start_time = time.time()
+    labels = set(labels)
+    true_positives = dict.fromkeys(labels, 0)
+    predicted = dict.fromkeys(labels, 0)
+    expected = dict.fromkeys(labels, 0)
+
+    texts = (text for text, annotations in dev_data)
+    for doc, (text, annotations) in zip(nlp.pipe(texts, batch_size=batch_size), dev_data):
+        gold_entities = {tuple(entity) for entity in annotations.get('entities', []) if entity[2] in labels}
+        predicted_entities = {(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents if ent.label_ in labels}
+
+        for _, _, label in gold_entities:
+            expected[label] += 1
+        for entity in predicted_entities:
+            predicted[entity[2]] += 1
+            if entity in gold_entities:
+                true_positives[entity[2]] += 1
+
+    scores = _prf(sum(true_positives.values()), sum(predicted.values()), sum(expected.values()))
+    return {
+        'ents_p': scores['p'],
+        'ents_r': scores['r'],
+        'ents_f': scores['f'],
+        'ents_per_type': {
+            label: _prf(true_positives[label], predicted[label], expected[label]) for label in sorted(labels)
+        },
+        'eval_time': time.time() - start_time
+    }
+
+
+class EarlyStopping:
+    """Stops the training when the held-out score has not improved by more than
+    min_delta for patience successive iterations.
+
+    :type patience: int
+    :param patience: The number of iterations without improvement after which
+        the training stops.
+    :type min_delta: float
+    :param min_delta: The score has to increase by more than min_delta to be
+        considered an improvement.
+    """
+
+    def __init__(self, patience: int, min_delta: float = 0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_score = None
+        self.stale_iterations = 0
+
+    def update(self, score: float):
+        """Records the score of an iteration.
+
+        :type score: float
+        :param score: The held-out score (higher is better).
+
+        :return: True if the training should stop.
+        """
+        if self.best_score is None or score > self.best_score + self.min_delta:
+            self.best_score = score
+            self.stale_iterations = 0
+        else:
+            self.stale_iterations += 1
+
+        return self.stale_iterations >= self.patience
+
+    def state(self):
+        """Returns the dictionary with the best score and the number of
+        iterations without improvement, to be stored in a checkpoint.
+        """
+        return {'best_score': self.best_score, 'stale_iterations': self.stale_iterations}
+
+    def set_state(self, state: dict):
+        """Restores the state returned by the state method.
+
+        :type state: dict
+        :param state: The stored state.
+        """
+        self.best_score = state.get('best_score')
+        self.stale_iterations = state.get('stale_iterations', 0)
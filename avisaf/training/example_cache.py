@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Example cache is the module responsible for converting the training data
+into pre-tokenized training examples. Each text is tokenized and its entity
+character offsets are aligned into BILUO tags only once. The result is stored
+in the on-disk cache, so that neither the training iterations nor the
+following training runs on the same data need to repeat the work.
+"""
+
+import logging
+import spacy
+from pathlib import Path
+from spacy.gold import GoldParse, biluo_tags_from_offsets
+from spacy.tokens import DocBin
+# importing own modules
+from avisaf.util.cache import cache_key, file_digest, model_fingerprint, read_cached, write_cached
+from avisaf.util.data_extractor import get_training_data
+
+# the version of the cached content format
+CACHE_FORMAT = 1
+
+
+def examples_cache_key(nlp, training_data_path: Path):
+    """Computes the cache key of the training examples created from the given
+    file by the given model's tokenizer.
+
+    :type nlp: Language
+    :param nlp: The spaCy model whose tokenizer and vocabulary are used.
+    :type training_data_path: Path
+    :param training_data_path: The path to the training data file.
+
+    :return: The cache key string.
+    """
+    return cache_key(
+        'examples',
+        CACHE_FORMAT,
+        file_digest(training_data_path),
+        model_fingerprint(nlp),
+        spacy.__version__
+    )
+
+
+def tokenize_examples(nlp, training_data):
+    """Tokenizes the texts of the (text, annotations) tuples and converts their
+    entity offsets into BILUO tags. The tokens of the entities which are not
+    aligned with the token boundaries are tagged '-' (missing), the same way
+    spaCy does it when the raw texts are given to nlp.update.
+
+    :type nlp: Language
+    :param nlp: The spaCy model whose tokenizer is used.
+    :type training_data: iterable
+    :param training_data: The (text, annotations) tuples.
+
+    :return: The list of Doc objects and the list of their BILUO tags lists.
+    """
+    docs = []
+    tags = []
+    misaligned = 0
+    for text, annotations in training_data:
+        doc = nlp.make_doc(text)
+        doc_tags = biluo_tags_from_offsets(doc, [tuple(entity) for entity in annotations.get('entities', [])])
+        misaligned += doc_tags.count('-')
+        docs.append(doc)
+        tags.append(doc_tags)
+
+    if misaligned:
+        logging.warning(f'{misaligned} tokens are not aligned with the entity boundaries and will be ignored.')
+
+    return docs, tags
+
+
+def load_examples(nlp, training_data_path: Path, use_cache: bool = True, verbose: bool = True):
+    """Loads the training examples in the form of (Doc, GoldParse) tuples ready
+    to be passed to nlp.update. The tokenized examples are read from the cache
+    if the same training data have already been tokenized by the same model,
+    otherwise they are created and stored in the cache.
+
+    :type nlp: Language
+    :param nlp: The spaCy model to be trained.
+    :type training_data_path: Path
+    :param training_data_path: The path to the JSON, JSONL or msgpack training
+        data file.
+    :type use_cache: bool
+    :param use_cache: A flag indicating whether the cache should be used.
+    :type verbose: bool
+    :param verbose: A flag indicating that the use of the cache is reported.
+
+    :return: The list of (Doc, GoldParse) tuples.
+    """
+    training_data_path = Path(training_data_path).resolve()
+    key = examples_cache_key(nlp, training_data_path) if use_cache else None
+    cached = read_cached('examples', key) if use_cache else None
+
+    if cached is not None and cached.get('format') == CACHE_FORMAT:
+        docs = list(DocBin().from_bytes(cached['docs']).get_docs(nlp.vocab))
+        tags = cached['tags']
+        if verbose:
+            print(f'Using {len(docs)} pre-tokenized training examples from the cache.')
+    else:
+        docs, tags = tokenize_examples(nlp, get_training_data(training_data_path))
+        if use_cache:
+            doc_bin = DocBin(attrs=['ORTH', 'NORM'])
+            for doc in docs:
+                doc_bin.add(doc)
+            write_cached('examples', key, {'format': CACHE_FORMAT, 'docs': doc_bin.to_bytes(), 'tags': tags})
+
+    return [(doc, GoldParse(doc, entities=doc_tags)) for doc, doc_tags in zip(docs, tags)]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Metrics module is responsible for logging structured training metrics.
+Each record (e.g. the timings and scores of one training iteration) is
+written as a single JSON object line, so the metrics of a running training
+can be followed and processed by other tools. The latest numeric values of
+each kind of record can also be exposed in a Prometheus text format file (e.g.
+for the node exporter textfile collector).
+"""
+
+import os
+import sys
+import json
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # the resource module is not available on Windows
+    resource = None
+
+
+def peak_rss_mb(children: bool = False):
+    """Returns the peak resident set size of the current process in MiB.
+
+    :type children: bool
+    :param children: Whether the peak resident set size of the largest
+        terminated (and waited for) child process should be returned instead.
+
+    :return: The peak resident set size in MiB or None if it cannot be
+        measured on the platform.
+    """
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # the value is in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / (1 << 20) if sys.platform == 'darwin' else peak_rss / (1 << 10)
+
+
+class UpdateStats:
+    """Collects the durations and sizes of the model updates of an iteration."""
+
+    def __init__(self):
+        self.updates = 0
+        self.update_time = 0.0
+        self.max_update_time = 0.0
+        self.words = 0
+        self.examples = 0
+
+    def add(self, seconds: float, words: int, examples: int):
+        """Records a single update.
+
+        :type seconds: float
+        :param seconds: The duration of the update.
+        :type words: int
+        :param words: The number of words (tokens) of the update batch.
+        :type examples: int
+        :param examples: The number of examples of the update batch.
+        """
+        self.updates += 1
+        self.update_time += seconds
+        self.max_update_time = max(self.max_update_time, seconds)
+        self.words += words
+        self.examples += examples
+
+    def summary(self):
+        """Returns the dictionary of throughput and update time metrics."""
+        update_time = max(self.update_time, 1e-9)
+        return {
+            'updates': self.updates,
+            'update_time': self.update_time,
+            'update_time_mean': self.update_time / self.updates if self.updates else 0.0,
+            'update_time_max': self.max_update_time,
+            'words': self.words,
+            'examples': self.examples,
+            'words_per_sec': self.words / update_time,
+            'examples_per_sec': self.examples / update_time,
+        }
+
+
+def write_prometheus(prometheus_path: Path, metrics: dict, prefix: str = 'avisaf_training_'):
+    """Writes the numeric metrics in Prometheus text format. Nested dictionaries
+    are written as labelled samples (e.g. losses as avisaf_training_losses with
+    a name label, per-label scores as avisaf_training_ents_per_type_f with a
+    name label). The file is replaced atomically, so the collector never reads
+    it incomplete.
+
+    :type prometheus_path: Path
+    :param prometheus_path: The path to the .prom file.
+    :type metrics: dict
+    :param metrics: The metrics record.
+    :type prefix: str
+    :param prefix: The prefix of the metric names.
+    """
+    lines = []
+    for key, value in metrics.items():
+        if isinstance(value, bool) or key == 'time':
+            continue
+        if isinstance(value, (int, float)):
+            lines.append(f'{prefix}{key} {value}')
+        elif isinstance(value, dict):
+            for name, inner in value.items():
+                if isinstance(inner, (int, float)) and not isinstance(inner, bool):
+                    lines.append(f'{prefix}{key}{{name="{name}"}} {inner}')
+                elif isinstance(inner, dict):
+                    for inner_key, inner_value in inner.items():
+                        if isinstance(inner_value, (int, float)) and not isinstance(inner_value, bool):
+                            lines.append(f'{prefix}{key}_{inner_key}{{name="{name}"}} {inner_value}')
+
+    prometheus_path = Path(prometheus_path).resolve()
+    tmp_path = prometheus_path.with_name(f'.{prometheus_path.name}.{os.getpid()}.tmp')
+    with tmp_path.open(mode='w') as prometheus_file:
+        prometheus_file.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, prometheus_path)
+
+
+class MetricsLogger:
+    """Appends the metrics records into a JSONL file. The records are flushed
+    immediately. If no file is given, the records are discarded.
+
+    :type metrics_path: Path
+    :param metrics_path: The path to the JSONL file or None.
+    :type prometheus_path: Path
+    :param prometheus_path: The path to the Prometheus text file rewritten with
+        the latest values of each kind of record, or None.
+    """
+
+    def __init__(self, metrics_path: Path = None, prometheus_path: Path = None):
+        self._prometheus_path = prometheus_path
+        self._latest = {}   # the latest values of all the records, prefixed by the event name
+        self._file = None
+        if metrics_path is not None:
+            metrics_path = Path(metrics_path).resolve()
+            metrics_path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = metrics_path.open(mode='a')
+
+    def log(self, event: str, **metrics):
+        """Writes a single metrics record.
+
+        :type event: str
+        :param event: The kind of the record (e.g. 'iteration').
+        :param metrics: The JSON serializable values of the record.
+        """
+        record = {'event': event, 'time': time.time()}
+        record.update(metrics)
+
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+        if self._prometheus_path is not None:
+            self._latest.update({f'{event}_{key}': value for key, value in metrics.items()})
+            write_prometheus(self._prometheus_path, self._latest)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Model export is the module responsible for creating slim, NER-only
+inference models from the trained ones. All the pipes except 'ner' are
+removed, the lemmatization tables are dropped and the static word vectors are
+kept only if the entity recognizer uses them as features (optionally pruned
+to a given number of rows). Such models load faster and need less memory
+when only the named entities are needed (test_ner, tag_ner, serve_ner).
+"""
+
+import time
+from pathlib import Path
+from spacy.vectors import Vectors
+
+
+def directory_size(path: Path):
+    """Returns the total size of the files in the directory in bytes."""
+    return sum(file.stat().st_size for file in Path(path).rglob('*') if file.is_file())
+
+
+def uses_vectors(nlp):
+    """Decides whether the entity recognizer of the model uses the static word
+    vectors as features.
+
+    :type nlp: Language
+    :param nlp: The spaCy model containing the 'ner' pipe.
+
+    :return: True if the vectors are needed by the entity recognizer.
+    """
+    return bool(nlp.get_pipe('ner').cfg.get('pretrained_vectors'))
+
+
+def export_ner_model(model: [str, Path], output_path: Path, prune_vectors: int = None):
+    """Exports the NER-only version of the model.
+
+    :type model: str, Path
+    :param model: The spaCy model to be exported. Either an existing
+        pre-downloaded spaCy model or a path to a local directory.
+    :type output_path: Path
+    :param output_path: The directory the exported model will be saved to.
+    :type prune_vectors: int
+    :param prune_vectors: The number of vectors to be kept if the vectors are
+        needed by the entity recognizer. The words of the removed vectors are
+        mapped to their nearest remaining neighbours. None keeps all of them.
+
+    :return: The exported spaCy model.
+    """
+    # importing own modules
+    from avisaf.tagging.batch_tagger import load_ner_model
+
+    output_path = Path(output_path).resolve()
+    nlp = load_ner_model(model)
+
+    for pipe_name in list(nlp.pipe_names):
+        if pipe_name != 'ner':
+            nlp.remove_pipe(pipe_name)
+
+    # the lemmatizer tables are used only by the tagger/lemmatizer, the norms are needed by the NER features
+    for table_name in list(nlp.vocab.lookups.tables):
+        if table_name.startswith('lemma'):
+            nlp.vocab.lookups.remove_table(table_name)
+
+    vectors_count = nlp.vocab.vectors.n_keys
+    if not uses_vectors(nlp):
+        nlp.vocab.vectors = Vectors()
+        print(f'The entity recognizer does not use the word vectors, all {vectors_count} of them were removed.')
+    elif prune_vectors is not None and prune_vectors < nlp.vocab.vectors.shape[0]:
+        nlp.vocab.prune_vectors(prune_vectors)
+        print(f'The vectors were pruned to {prune_vectors} rows ({vectors_count} words are kept mapped to them).')
+
+    nlp.meta['name'] = f'{nlp.meta.get("name", "model")}_ner'
+    nlp.meta['avisaf_export'] = {'source': str(model), 'prune_vectors': prune_vectors}
+    nlp.to_disk(output_path)
+
+    source_path = Path(model) if Path(model).exists() else getattr(nlp, 'path', None)
+    if source_path is not None and Path(source_path).exists():
+        print(f'Model size: {directory_size(source_path) / (1 << 20):.1f} MiB -> '
+              f'{directory_size(output_path) / (1 << 20):.1f} MiB')
+    else:
+        print(f'Exported model size: {directory_size(output_path) / (1 << 20):.1f} MiB')
+
+    load_start = time.time()
+    load_ner_model(output_path)
+    print(f'The exported model was saved to {output_path} and loads in {time.time() - load_start:.2f} s.')
+
+    return nlp
@@ -11,23 +11,57 @@ from datetime import datetime
 import time
 from pathlib import Path
 # importing own modules
+from avisaf.training.batching import make_batches
+from avisaf.training.checkpoints import CheckpointManager
+from avisaf.training.evaluation import EarlyStopping, evaluate_ner
+from avisaf.training.example_cache import load_examples
+from avisaf.training.metrics import MetricsLogger, UpdateStats, peak_rss_mb
+from avisaf.training.parallel_trainer import ParallelTrainer
+from avisaf.training.streaming_loader import StreamingExamples
 from avisaf.util.data_extractor import get_entities, get_training_data
+from avisaf.util.model_loading import load_model
 
 
 def train_spacy_model(iter_number: int = 20,
                       model=None,
                       new_model_name: str = None,
                       tr_data_srcfile: Path = Path('data_files', 'training_data', 'annotated_data_part_01.json').resolve(),
-                      verbose: bool = False):
+                      verbose: bool = False,
+                      use_cache: bool = True,
+                      batch_strategy: str = 'fixed',
+                      batch_size: int = 3,
+                      batch_compound: tuple = None,
+                      dev_data_srcfile: Path = None,
+                      checkpoint_every: int = 1,
+                      resume: bool = False,
+                      patience: int = None,
+                      metrics_path: Path = None,
+                      processes: int = 1,
+                      sync_every: int = 1000,
+                      shuffle_buffer_size: int = 10000,
+                      prometheus_path: Path = None):
     """SpaCy NER model training function. The function iterates given number of
     times over the given data in order to create an appropriate statistical
     entity prediction model.
 
     :type verbose: bool
     :param verbose: A flag indicating verbose stdout printing.
+    :type use_cache: bool
+    :param use_cache: A flag indicating whether the pre-tokenized training
+        examples should be read from (and stored in) the cache.
+    :type batch_strategy: str
+    :param batch_strategy: The strategy of dividing the examples into batches,
+        one of 'fixed', 'compounding' or 'bucketed'.
+    :type batch_size: int
+    :param batch_size: The size of the batches of fixed (and bucketed) strategy.
+    :type batch_compound: tuple
+    :param batch_compound: The (start, stop, factor) triplet of compounding
+        batch sizes used by compounding (and bucketed) strategy.
     :type tr_data_srcfile: Path
     :param tr_data_srcfile: A path to the file containing training data based
-        based on which the spaCy model will be updated.
+        based on which the spaCy model will be updated. If the path is a
+        directory, the training data are streamed from the shard files it
+        contains instead of being loaded into the memory at once.
     :type iter_number: int
     :param iter_number: Number of iterations for NER model updating.
     :type model: str, Path
@@ -46,13 +80,40 @@ def train_spacy_model(iter_number: int = 20,
     if verbose:
         print(f'Start time: {datetime.now().strftime("%H:%M:%S")}')
     start_time = time.time()
-    try:
-        nlp = spacy.load(model)
-        print(f'An already existing spaCy model was successfully loaded: {model}.', flush=verbose)
-    except OSError:
-        # using a blank English language spaCy model
-        nlp = spacy.blank('en')
-        print('A new blank model has been created.', flush=verbose)
+
+    streaming = tr_data_srcfile.is_dir()
+    if streaming and processes > 1:
+        raise OSError('Parallel training requires the training data to be loaded in the memory, not streamed.')
+
+    if new_model_name is None:
+        if resume:
+            raise OSError('The name of the model whose training should be resumed has to be given.')
+        new_model_name = f"model_{datetime.today().strftime('%Y%m%d%H%M%S')}"
+
+    model_path = str(Path('models', new_model_name).resolve())
+    checkpoints = CheckpointManager(Path('models', f'{new_model_name}.checkpoints'), every=checkpoint_every)
+
+    metrics = MetricsLogger(metrics_path, prometheus_path)
+    early_stopping = EarlyStopping(patience) if patience and dev_data_srcfile is not None else None
+
+    first_iteration = 0
+    if resume:
+        nlp, optimizer, state = checkpoints.resume(
+            lambda loaded_nlp: loaded_nlp.resume_training(), early_stopping=early_stopping
+        )
+        first_iteration = state['iteration'] + 1
+        print(f'Resuming the training from the checkpoint of iteration {state["iteration"]}.', flush=verbose)
+        if early_stopping is not None and early_stopping.stale_iterations >= early_stopping.patience:
+            print('The training had already been stopped early, nothing to resume.', flush=verbose)
+            first_iteration = iter_number
+    else:
+        try:
+            nlp = load_model(model)
+            print(f'An already existing spaCy model was successfully loaded: {model}.', flush=verbose)
+        except OSError:
+            # using a blank English language spaCy model
+            nlp = spacy.blank('en')
+            print('A new blank model has been created.', flush=verbose)
 
     print(f'Using training dataset: {given_data_src}', flush=verbose)
 
@@ -70,54 +131,134 @@ def train_spacy_model(iter_number: int = 20,
     for label in entity_labels:
         ner.add_label(label)
 
-    training_data = get_training_data(tr_data_srcfile)
+    # the texts are tokenized and their entities aligned only once, not in every iteration
+    if streaming:
+        training_data = StreamingExamples(nlp, tr_data_srcfile, shuffle_buffer_size, use_cache=use_cache)
+        print(f'Streaming the training data from {len(training_data.shards)} shards.', flush=verbose)
+    else:
+        training_data = load_examples(nlp, tr_data_srcfile, use_cache=use_cache)
+    dev_data = get_training_data(Path(dev_data_srcfile).resolve()) if dev_data_srcfile is not None else None
+
+    if not resume:
+        # Start the training
+        optimizer = nlp.begin_training() if model is None else nlp.resume_training()
+        save_start = time.time()
+        checkpoints.save_base(nlp)
+        metrics.log('save', target='checkpoint_base', to_disk_time=time.time() - save_start)
 
-    # Start the training
-    optimizer = nlp.begin_training() if model is None else nlp.resume_training()
+    parallel_trainer = None
+    if processes > 1:
+        print(f'Starting {processes} training worker processes.', flush=verbose)
+        parallel_trainer = ParallelTrainer(checkpoints.base_path, training_data, processes, sync_every)
 
     # Iterate iter_number times
-    for itn in range(iter_number):
+    for itn in range(first_iteration, iter_number):
         print(f'Iteration: {itn}.')
+        iteration_start = time.time()
 
-        random.shuffle(training_data)
+        if streaming:
+            examples = training_data.epoch()
+        else:
+            random.shuffle(training_data)
+            examples = training_data
         losses = {}
         start = time.time()
+        stats = UpdateStats()
 
-        if new_model_name is None:
-            new_model_name = f"model_{datetime.today().strftime('%Y%m%d%H%M%S')}"
+        batches = make_batches(examples, batch_strategy, batch_size, batch_compound)
+        with nlp.disable_pipes(*other_pipe_names):
+            if parallel_trainer is not None:
+                losses = parallel_trainer.train_epoch(nlp, batches, stats)
+            else:
+                for batch in batches:
+                    # Get all the tokenized texts from the batch
+                    docs = [doc for doc, gold in batch]
+                    # Get all the entity annotations from the batch
+                    golds = [gold for doc, gold in batch]
 
-        model_path = str(Path('models', new_model_name).resolve())
+                    try:
+                        update_start = time.time()
+                        # Update the current model
+                        nlp.update(
+                            docs,
+                            golds,
+                            sgd=optimizer,
+                            losses=losses
+                        )
+
+                        new_time = time.time()
+                        stats.add(new_time - update_start, sum(len(doc) for doc in docs), len(docs))
+                        if new_time - start > 60:
+                            print(datetime.now().strftime("%H:%M:%S"), flush=verbose)
+                            start = new_time
+
+                    except ValueError as e:
+                        print(e)
+                        print(f"Exception occurred at: {datetime.now().strftime('%H:%M:%S')}")
+                        print(f"for file: {given_data_src}.", file=sys.stderr)
+                        sys.exit(1)
+
+            evaluation = evaluate_ner(nlp, dev_data, entity_labels) if dev_data is not None else None
+            score = evaluation['ents_f'] if evaluation is not None else None
 
-        with nlp.disable_pipes(*other_pipe_names):
-            for batch in spacy.util.minibatch(training_data, size=3):
-                # Get all the texts from the batch
-                texts = [text for text, entities in batch]
-                # Get all entity annotations from the batch
-                entity_offsets = [entities for text, entities in batch]
-
-                try:
-                    # Update the current model
-                    nlp.update(
-                        texts,
-                        entity_offsets,
-                        sgd=optimizer,
-                        losses=losses
-                    )
-
-                    new_time = time.time()
-                    if new_time - start > 60:
-                        print(datetime.now().strftime("%H:%M:%S"), flush=verbose)
-                        start = new_time
-
-                except ValueError as e:
-                    print(e)
-                    print(f"Exception occurred at: {datetime.now().strftime('%H:%M:%S')}")
-                    print(f"for file: {given_data_src}.", file=sys.stderr)
-                    sys.exit(1)
-
-        nlp.to_disk(model_path)
-        print(f'Model saved successfully to {model_path}')
         print(f'Iteration {itn} losses: {losses}.', flush=verbose)
+        summary = stats.summary()
+        print(f'Iteration {itn} throughput: {summary["words_per_sec"]:.0f} words/sec, '
+              f'{summary["examples_per_sec"]:.1f} examples/sec ({batch_strategy} batching).', flush=verbose)
+        if evaluation is not None:
+            print(f'Iteration {itn} held-out P/R/F: {evaluation["ents_p"]:.3f}/{evaluation["ents_r"]:.3f}/'
+                  f'{score:.3f} (evaluated in {evaluation["eval_time"]:.1f} s).', flush=verbose)
+            if verbose:
+                for label, label_scores in evaluation['ents_per_type'].items():
+                    print(f'    {label}: {label_scores["p"]:.3f}/{label_scores["r"]:.3f}/{label_scores["f"]:.3f}')
+
+        # the early stopping state of the iteration is stored along with its checkpoint
+        stop = early_stopping is not None and early_stopping.update(score)
+        checkpoint_start = time.time()
+        # the optimizer of this process is not updated by the parallel training, its state is not saved
+        saved = checkpoints.step(
+            nlp, optimizer if parallel_trainer is None else None, itn, score, early_stopping=early_stopping
+        )
+        if saved:
+            print(f'Checkpoint ({", ".join(saved)}) of iteration {itn} saved to {checkpoints.checkpoint_dir}.', flush=verbose)
+
+        metrics.log(
+            'iteration',
+            iteration=itn,
+            iteration_time=time.time() - iteration_start,
+            checkpoint_time=time.time() - checkpoint_start,
+            checkpoint_snapshot_time=checkpoints.last_snapshot_time if saved else None,
+            checkpoint_write_time=checkpoints.last_write_time,
+            peak_rss_mb=peak_rss_mb(),
+            **({'workers_peak_rss_mb': dict(parallel_trainer.workers_peak_rss_mb)} if parallel_trainer is not None else {}),
+            losses=losses,
+            **summary,
+            **(evaluation or {})
+        )
+
+        if stop:
+            print(f'The held-out F-score has not improved for {patience} iterations, stopping the training.')
+            break
+
+    if parallel_trainer is not None:
+        parallel_trainer.close()
+
+    best_iteration = checkpoints.restore_best(nlp)
+    if best_iteration is not None:
+        print(f'Using the best model from iteration {best_iteration} (held-out F-score {checkpoints.best_score:.3f}).')
+
+    save_start = time.time()
+    nlp.to_disk(model_path)
+    # the finished worker processes are counted by the children peak memory usage
+    metrics.log(
+        'save',
+        target='model',
+        to_disk_time=time.time() - save_start,
+        peak_rss_mb=peak_rss_mb(),
+        **({'children_peak_rss_mb': peak_rss_mb(children=True)} if processes > 1 else {})
+    )
+    metrics.close()
+    print(f'Model saved successfully to {model_path}')
 
     if verbose:
         print('Model saved')
@@ -125,3 +266,4 @@ def train_spacy_model(iter_number: int = 20,
         print(f'Finished at: {datetime.now().strftime("%H:%M:%S")}')
 
     return nlp
+
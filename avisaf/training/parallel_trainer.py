@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""Parallel trainer is the module responsible for data-parallel training of
+the NER model. Each worker process holds a replica of the model and all the
+training examples. The batches of an iteration are divided into rounds of
+sync_every examples, in each round every worker starts from the same weights,
+updates its replica by its share of the round batches and the resulting
+weights of the replicas are averaged (weighted by the number of words each
+replica was trained on).
+
+The weights are exchanged through a shared memory array with one row for the
+weights the round starts from and one row for the result of each worker, so
+only the example indexes and the losses are sent through the pipes. The
+optimizer state (e.g. Adam moments) of each replica stays local to its worker.
+
+The parallel training has not been shown to be faster than the single process
+training (see benchmarks/parallel_training.py), the weights exchange and the
+averaging cost is paid every round.
+"""
+
+import time
+import ctypes
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from spacy.gold import GoldParse
+from spacy.tokens import DocBin
+# importing own modules
+from avisaf.training.metrics import peak_rss_mb
+from avisaf.util.model_loading import load_model
+
+
+def _weight_layers(nlp):
+    """Returns the NER model layers which own trainable weights in a
+    deterministic order, so that the weights of the replicas can be matched.
+    The weights of a thinc 7 layer are stored in a single flat array of its
+    memory, the layers without one do not have any weights of their own.
+    """
+    layers = []
+    for layer in nlp.get_pipe('ner').model.walk():
+        memory = getattr(layer, '_mem', None)
+        if memory is not None and getattr(memory, 'weights', None) is not None and memory.weights.size:
+            layers.append(layer)
+    return layers
+
+
+def initialize_weights(nlp):
+    """Makes the NER model allocate the weights of all its layers. thinc 7
+    allocates the weights of most layers lazily, on their first use, so a
+    freshly created or loaded model holds only some of them.
+
+    :type nlp: Language
+    :param nlp: The spaCy model.
+    """
+    nlp.get_pipe('ner')(nlp.make_doc('.'))
+
+
+def weights_layout(nlp):
+    """Describes the weights of the NER model layers.
+
+    :type nlp: Language
+    :param nlp: The spaCy model.
+
+    :return: The list of (layer name, weights shape) tuples.
+    """
+    return [(layer.name, tuple(layer._mem.weights.shape)) for layer in _weight_layers(nlp)]
+
+
+def weights_size(layout: list):
+    """Returns the total number of the weights described by the layout."""
+    return sum(int(np.prod(shape)) for name, shape in layout)
+
+
+def read_weights(nlp, target):
+    """Copies the weights of the NER model layers into a flat array.
+
+    :type nlp: Language
+    :param nlp: The spaCy model.
+    :type target: numpy.ndarray
+    :param target: The flat array of the size given by weights_size function.
+    """
+    offset = 0
+    for layer in _weight_layers(nlp):
+        weights = layer._mem.weights
+        target[offset:offset + weights.size] = weights.ravel()
+        offset += weights.size
+    if offset != target.size:
+        raise ValueError(f'The model has {offset} weights, the array has {target.size} of them.')
+
+
+def write_weights(nlp, source):
+    """Overwrites the weights of the NER model layers in place by the values
+    of a flat array.
+
+    :type nlp: Language
+    :param nlp: The spaCy model.
+    :type source: numpy.ndarray
+    :param source: The flat array written by read_weights function.
+    """
+    offset = 0
+    layers = _weight_layers(nlp)
+    if sum(layer._mem.weights.size for layer in layers) != source.size:
+        raise ValueError(f'The model weights do not match the array of {source.size} weights.')
+    for layer in layers:
+        weights = layer._mem.weights
+        weights[...] = source[offset:offset + weights.size].reshape(weights.shape)
+        offset += weights.size
+
+
+def _shared_rows(shared_array, rows: int):
+    """Views the shared memory array as a (rows, weights) float32 matrix."""
+    return np.frombuffer(shared_array, dtype=np.float32).reshape(rows, -1)
+
+
+def _worker(connection, worker_index: int, shared_array, rows: int, base_path: str, doc_bin_bytes: bytes,
+            tags: list):
+    """The main loop of a worker process. The worker receives the lists of
+    example indexes of its batches, trains its replica starting from the
+    weights in the first row of the shared array and writes the result into
+    its own row. The losses, the number of words and the peak memory usage of
+    the worker are sent back. The loop ends when None is received.
+    """
+    try:
+        nlp = load_model(base_path)
+        nlp.disable_pipes(*[pipe for pipe in nlp.pipe_names if pipe != 'ner'])
+        optimizer = nlp.resume_training()
+
+        docs = list(DocBin().from_bytes(doc_bin_bytes).get_docs(nlp.vocab))
+        examples = [(doc, GoldParse(doc, entities=doc_tags)) for doc, doc_tags in zip(docs, tags)]
+        initialize_weights(nlp)
+        weights = _shared_rows(shared_array, rows)
+        connection.send(('ready', weights_layout(nlp)))
+    except Exception as ex:
+        connection.send(('error', repr(ex)))
+        return
+
+    while True:
+        batches = connection.recv()
+        if batches is None:
+            break
+
+        try:
+            write_weights(nlp, weights[0])
+            losses = {}
+            words_count = 0
+            for batch in batches:
+                docs = [examples[index][0] for index in batch]
+                golds = [examples[index][1] for index in batch]
+                nlp.update(docs, golds, sgd=optimizer, losses=losses)
+                words_count += sum(len(doc) for doc in docs)
+            read_weights(nlp, weights[worker_index + 1])
+            connection.send(('done', (losses, words_count, peak_rss_mb())))
+        except Exception as ex:
+            connection.send(('error', repr(ex)))
+
+
+class ParallelTrainer:
+    """Trains the NER model by worker processes holding its replicas.
+
+    :type base_path: Path
+    :param base_path: The path to the saved model the replicas are loaded
+        from (the checkpoint base). Only the NER weights are synchronized, so
+        the other parts of the model have to be the same as in the trained one.
+    :type training_data: list
+    :param training_data: The (Doc, GoldParse) training examples.
+    :type processes: int
+    :param processes: The number of worker processes.
+    :type sync_every: int
+    :param sync_every: The number of training examples (of all the workers
+        together) after which the weights of the replicas are averaged.
+    """
+
+    def __init__(self, base_path: Path, training_data: list, processes: int, sync_every: int = 1000):
+        self.sync_every = max(sync_every, 1)
+        self._positions = {id(doc): index for index, (doc, gold) in enumerate(training_data)}
+
+        doc_bin = DocBin(attrs=['ORTH', 'NORM'])
+        for doc, gold in training_data:
+            doc_bin.add(doc)
+        doc_bin_bytes = doc_bin.to_bytes()
+        tags = [list(gold.ner) for doc, gold in training_data]
+
+        # the size of the weights is known only after the base model is loaded and initialized
+        nlp = load_model(base_path)
+        initialize_weights(nlp)
+        self._layout = weights_layout(nlp)
+        del nlp
+
+        # spawned workers do not inherit the threads and the state of the training process
+        context = multiprocessing.get_context('spawn')
+        self._rows = processes + 1
+        self._shared_array = context.RawArray(ctypes.c_float, self._rows * weights_size(self._layout))
+        self._weights = _shared_rows(self._shared_array, self._rows)
+        self._connections = []
+        self._processes = []
+        for worker_index in range(processes):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(worker_connection, worker_index, self._shared_array, self._rows, str(base_path),
+                      doc_bin_bytes, tags),
+                daemon=True
+            )
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        # the replicas have to hold the same weights as the trained model
+        for connection in self._connections:
+            if self._receive(connection) != self._layout:
+                self.close()
+                raise OSError('The weights of the training worker replicas differ.')
+        self._layout_checked = False
+        # the peak memory usage of each worker reported by its latest reply
+        self.workers_peak_rss_mb = {}
+
+    def _receive(self, connection):
+        try:
+            status, content = connection.recv()
+        except EOFError:
+            self.close()
+            raise OSError('A training worker process terminated unexpectedly.')
+
+        if status == 'error':
+            self.close()
+            raise OSError(f'A training worker process failed: {content}')
+        return content
+
+    def train_epoch(self, nlp, batches, stats=None):
+        """Trains the model by one pass over the given batches. The batches
+        are consumed lazily, a round at a time. The weights of the model are
+        replaced by the averaged weights of the replicas after each round.
+
+        :type nlp: Language
+        :param nlp: The trained spaCy model.
+        :type batches: iterable
+        :param batches: The lists of (Doc, GoldParse) examples.
+        :type stats: UpdateStats
+        :param stats: The statistics each round (including the weights
+            exchange) is recorded into as a single update, or None.
+
+        :return: The losses dictionary.
+        """
+        if not self._layout_checked:
+            initialize_weights(nlp)
+            if weights_layout(nlp) != self._layout:
+                raise OSError('The weights of the trained model differ from the weights of the worker replicas.')
+            self._layout_checked = True
+
+        losses = {}
+        round_batches = []
+        round_examples = 0
+        for batch in batches:
+            round_batches.append([self._positions[id(doc)] for doc, gold in batch])
+            round_examples += len(batch)
+            if round_examples >= self.sync_every:
+                self._train_round(nlp, round_batches, losses, stats)
+                round_batches = []
+                round_examples = 0
+
+        if round_batches:
+            self._train_round(nlp, round_batches, losses, stats)
+
+        return losses
+
+    def _train_round(self, nlp, round_batches: list, losses: dict, stats):
+        round_time = time.time()
+        read_weights(nlp, self._weights[0])
+
+        # the batches are assigned to the least loaded workers, idle workers are not used
+        shares = [[] for _ in self._connections]
+        loads = [0] * len(self._connections)
+        for batch in round_batches:
+            worker_index = loads.index(min(loads))
+            shares[worker_index].append(batch)
+            loads[worker_index] += len(batch)
+
+        busy = [worker_index for worker_index, share in enumerate(shares) if share]
+        for worker_index in busy:
+            self._connections[worker_index].send(shares[worker_index])
+
+        replicas_words = []
+        for worker_index in busy:
+            replica_losses, replica_words, replica_rss = self._receive(self._connections[worker_index])
+            self.workers_peak_rss_mb[str(worker_index)] = replica_rss
+            replicas_words.append(max(replica_words, 1))
+            for name, loss in replica_losses.items():
+                losses[name] = losses.get(name, 0.0) + loss
+
+        words = np.asarray(replicas_words, dtype=np.float32)
+        averaged = (words / words.sum()) @ self._weights[[worker_index + 1 for worker_index in busy]]
+        write_weights(nlp, averaged)
+
+        if stats is not None:
+            stats.add(time.time() - round_time, sum(replicas_words), sum(len(batch) for batch in round_batches))
+
+    def close(self):
+        """Stops the worker processes."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._connections = []
+        self._processes = []
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Streaming loader is the module responsible for reading the training
+examples of corpora which do not fit in the memory. The corpus is split into
+shards (JSON, JSONL or msgpack training data files in one directory). Each
+epoch, the shards are read in random order one at a time and their examples
+pass through a bounded shuffle buffer, so only a single shard and the buffer
+are held in the memory.
+"""
+
+import random
+from pathlib import Path
+# importing own modules
+from avisaf.training.example_cache import load_examples
+
+SHARD_SUFFIXES = ('.json', '.jsonl', '.msgpack')
+
+
+def find_shards(shards_dir: Path):
+    """Finds the training data shards in the given directory.
+
+    :type shards_dir: Path
+    :param shards_dir: The directory containing the shard files.
+
+    :return: The sorted list of paths to the shards.
+    """
+    shards_dir = Path(shards_dir).resolve()
+    shards = sorted(path for path in shards_dir.iterdir() if path.is_file() and path.suffix in SHARD_SUFFIXES)
+    if not shards:
+        raise OSError(f'No training data shards ({", ".join(SHARD_SUFFIXES)} files) found in {shards_dir}.')
+    return shards
+
+
+def shuffle_buffer(items, buffer_size: int):
+    """Approximately shuffles the stream of items while holding at most
+    buffer_size of them in the memory. Each incoming item replaces a random
+    one from the full buffer, which is yielded instead.
+
+    :param items: An iterable of items.
+    :type buffer_size: int
+    :param buffer_size: The maximal number of held items.
+
+    :return: A python generator of the shuffled items.
+    """
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        index = random.randrange(buffer_size)
+        yield buffer[index]
+        buffer[index] = item
+
+    random.shuffle(buffer)
+    yield from buffer
+
+
+class StreamingExamples:
+    """The training examples read from the shards in every epoch. The shards
+    are tokenized through the example cache (see load_examples function), so
+    each shard is tokenized only once as well.
+
+    :type nlp: Language
+    :param nlp: The trained spaCy model.
+    :type shards_dir: Path
+    :param shards_dir: The directory containing the training data shards.
+    :type buffer_size: int
+    :param buffer_size: The size of the shuffle buffer.
+    :type use_cache: bool
+    :param use_cache: A flag indicating whether the example cache should be used.
+    """
+
+    def __init__(self, nlp, shards_dir: Path, buffer_size: int = 10000, use_cache: bool = True):
+        self.nlp = nlp
+        self.shards = find_shards(shards_dir)
+        self.buffer_size = buffer_size
+        self.use_cache = use_cache
+
+    def _read_shards(self, shards: list):
+        for shard in shards:
+            yield from load_examples(self.nlp, shard, use_cache=self.use_cache, verbose=False)
+
+    def epoch(self):
+        """Reads the examples of a single epoch. The order of the shards is
+        randomized and the examples are shuffled by the shuffle buffer.
+
+        :return: A python generator of (Doc, GoldParse) tuples.
+        """
+        shards = list(self.shards)
+        random.shuffle(shards)
+        return shuffle_buffer(self._read_shards(shards), self.buffer_size)
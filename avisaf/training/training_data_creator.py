@@ -8,17 +8,18 @@ as well as the entity labels used for the chosen phrases.
 """
 
 import sys
-import os
 import json
 import spacy
 import logging
 from pathlib import Path
 from spacy.matcher import PhraseMatcher, Matcher
+from spacy.tokens import DocBin
 # importing own modules used in this module
-from avisaf.util.indexing import get_spans_indexes, entity_trimmer
+from avisaf.util.indexing import get_spans_indexes
 import avisaf.util.training_data_build as train
 from avisaf.util.data_extractor import DataExtractor
-import avisaf.classification.vectorizers as vectorizers
+from avisaf.util.cache import cache_key, file_digest, model_fingerprint, read_cached, write_cached
+from avisaf.util.model_loading import load_model
 import numpy as np
 
 
@@ -31,15 +32,229 @@ SOURCES_ROOT_PATH = Path(path).resolve()
 if str(SOURCES_ROOT_PATH) not in sys.path:
     sys.path.append(str(SOURCES_ROOT_PATH))
 
+# token attributes which are not set by the tokenizer, but by one of the pipes
+ATTRIBUTE_PIPES = {
+    'POS': 'tagger',
+    'TAG': 'tagger',
+    'LEMMA': 'tagger',
+    'DEP': 'parser',
+    'SENT_START': 'parser',
+    'IS_SENT_START': 'parser',
+    'ENT_TYPE': 'ner',
+    'ENT_IOB': 'ner',
+    'ENT_ID': 'ner',
+    'ENT_KB_ID': 'ner',
+}
+# token attributes which are set by the tokenizer or taken from the vocabulary
+LEXICAL_ATTRIBUTES = {
+    'ORTH', 'TEXT', 'LOWER', 'NORM', 'SHAPE', 'PREFIX', 'SUFFIX', 'LENGTH', 'IS_ALPHA',
+    'IS_ASCII', 'IS_DIGIT', 'IS_LOWER', 'IS_UPPER', 'IS_TITLE', 'IS_PUNCT', 'IS_SPACE',
+    'IS_STOP', 'IS_OOV', 'IS_BRACKET', 'IS_QUOTE', 'IS_LEFT_PUNCT', 'IS_RIGHT_PUNCT',
+    'IS_CURRENCY', 'LIKE_NUM', 'LIKE_URL', 'LIKE_EMAIL', 'OP',
+}
+
+
+def required_pipes(patterns: list, use_phrasematcher: bool = False, phrase_attr: str = 'ORTH'):
+    """Finds out which pipes have to be run so that the token attributes used by
+    the patterns are available.
+
+    :type patterns: list
+    :param patterns: The list of Matcher patterns or PhraseMatcher phrases.
+    :type use_phrasematcher: bool
+    :param use_phrasematcher: A flag indicating whether the patterns are used by
+        PhraseMatcher object.
+    :type phrase_attr: str
+    :param phrase_attr: The token attribute PhraseMatcher matches on.
+
+    :return: The set of required pipe names or None if the patterns use an
+        unknown attribute and therefore all the pipes are needed.
+    """
+    attributes = {phrase_attr.upper()} if use_phrasematcher else {
+        attribute.upper() for pattern in patterns for token in pattern for attribute in token.keys()
+    }
+
+    pipes = set()
+    for attribute in attributes:
+        if attribute in ATTRIBUTE_PIPES:
+            pipes.add(ATTRIBUTE_PIPES[attribute])
+        elif attribute not in LEXICAL_ATTRIBUTES:
+            return None  # e.g. custom extension attributes
+
+    return pipes
+
+
+def load_patterns_manifest(manifest_path: Path):
+    """Reads the JSON manifest mapping entity labels to pattern files. The value
+    of each label is either the path to its pattern file or a dictionary with
+    'patterns' path and optional 'phrasematcher' flag and 'attr' token attribute
+    used by PhraseMatcher. Relative paths are resolved against the directory of
+    the manifest.
+
+    Example: {"AIRPLANE": "airplanes.json",
+              "CREW": {"patterns": "crew.json", "phrasematcher": true, "attr": "LOWER"}}
+
+    :type manifest_path: Path
+    :param manifest_path: The path to the JSON manifest file.
+
+    :return: The list of (label, patterns_file_path, use_phrasematcher,
+        phrase_attr) tuples.
+    """
+    manifest_path = Path(manifest_path).resolve()
+    with manifest_path.open(mode='r') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    pattern_sources = []
+    for label, source in manifest.items():
+        if isinstance(source, str):
+            source = {"patterns": source}
+        patterns_file_path = manifest_path.parent.joinpath(source["patterns"]).resolve()
+        pattern_sources.append(
+            (label, patterns_file_path, source.get("phrasematcher", False), source.get("attr", 'ORTH').upper())
+        )
+
+    return pattern_sources
+
+
+def compile_patterns(nlp, patterns_file_path: Path, use_phrasematcher: bool = False,
+                     phrase_attr: str = 'ORTH', all_pipes: bool = False, use_cache: bool = True):
+    """Loads the patterns of one label and prepares them for being added to a
+    matcher. PhraseMatcher phrases are converted into keyword Docs. The result
+    is stored in the cache under the key computed from the content of the
+    patterns file and the model, so that warm runs skip pattern compilation
+    entirely.
+
+    :type nlp: Language
+    :param nlp: The spaCy model used for text processing.
+    :type patterns_file_path: Path
+    :param patterns_file_path: The path to the JSON file with the patterns.
+    :type use_phrasematcher: bool
+    :param use_phrasematcher: A flag indicating whether the patterns are used by
+        PhraseMatcher object.
+    :type phrase_attr: str
+    :param phrase_attr: The token attribute PhraseMatcher matches on.
+    :type all_pipes: bool
+    :param all_pipes: A flag indicating that all the pipes of the model should
+        be run, so the PhraseMatcher phrases are processed by all of them too.
+    :type use_cache: bool
+    :param use_cache: A flag indicating whether the compiled patterns cache
+        should be used.
+
+    :return: The (patterns, pipes, validated) tuple, where patterns are either
+        keyword Docs or Matcher rules, pipes is the set of pipes required by the
+        patterns (or None if all of them are needed) and validated flag says
+        whether the rules have already been validated in a previous run.
+    """
+    key = cache_key(
+        file_digest(patterns_file_path), model_fingerprint(nlp), spacy.__version__, use_phrasematcher, phrase_attr,
+        all_pipes
+    )
+    cached = read_cached('matchers', key) if use_cache else None
+    if cached is not None:
+        logging.info(f'Using cached patterns of {patterns_file_path}')
+        pipes = None if cached['pipes'] is None else set(cached['pipes'])
+        if use_phrasematcher:
+            patterns = list(DocBin().from_bytes(cached['docs']).get_docs(nlp.vocab))
+        else:
+            patterns = cached['patterns']
+        return patterns, pipes, True
+
+    with patterns_file_path.open(mode='r') as pttrns_file:
+        patterns = json.load(pttrns_file)  # phrase/patterns to be matched
+
+    pipes = None if all_pipes else required_pipes(patterns, use_phrasematcher, phrase_attr)
+    content = {"pipes": None if pipes is None else sorted(pipes)}
+
+    if use_phrasematcher:
+        # process the keys and store their values in the patterns list
+        if pipes is not None and not pipes:
+            patterns = [nlp.make_doc(pattern) for pattern in patterns]  # tokenizer is enough
+            doc_bin = DocBin(attrs=['ORTH'], store_user_data=False)
+        else:
+            disabled_pipes = [] if pipes is None else [name for name in nlp.pipe_names if name not in pipes]
+            patterns = list(nlp.pipe(patterns, disable=disabled_pipes))
+            doc_bin = DocBin(
+                attrs=['ORTH', 'TAG', 'POS', 'LEMMA', 'HEAD', 'DEP', 'ENT_IOB', 'ENT_TYPE'],
+                store_user_data=False
+            )
+        for doc in patterns:
+            doc_bin.add(doc)
+        content["docs"] = doc_bin.to_bytes()  # contains also the strings of the docs
+    else:
+        content["patterns"] = patterns
+
+    if use_cache:
+        write_cached('matchers', key, content)
+
+    return patterns, pipes, False
+
+
+def build_matchers(nlp, pattern_sources: list, all_pipes: bool = False, use_cache: bool = True):
+    """Creates the matchers containing the rules of all given labels. Matcher
+    rules of all labels are registered in a single Matcher object and
+    PhraseMatcher phrases in one PhraseMatcher object per token attribute. The
+    patterns of a matcher are validated only if some of them have not been
+    validated in previous runs.
+
+    :type nlp: Language
+    :param nlp: The spaCy model used for text processing.
+    :type pattern_sources: list
+    :param pattern_sources: The list of (label, patterns_file_path,
+        use_phrasematcher, phrase_attr) tuples.
+    :type all_pipes: bool
+    :param all_pipes: A flag indicating that all the pipes of the model should
+        be run, even those which set the attributes not used by the patterns.
+    :type use_cache: bool
+    :param use_cache: A flag indicating whether the compiled patterns cache
+        should be used.
+
+    :return: The (matchers, disabled_pipes) tuple, where disabled_pipes is the
+        list of pipe names not needed by any of the patterns.
+    """
+    # the patterns are grouped by their matcher first, the validation is a matcher setting
+    matcher_patterns = {}
+    required = None if all_pipes else set()
+    for label, patterns_file_path, use_phrasematcher, phrase_attr in pattern_sources:
+        patterns, pipes, validated = compile_patterns(
+            nlp, patterns_file_path, use_phrasematcher, phrase_attr, all_pipes=all_pipes, use_cache=use_cache
+        )
+        required = None if (required is None or pipes is None) else required | pipes
+
+        matcher_key = ('phrase', phrase_attr) if use_phrasematcher else ('token', None)
+        matcher_patterns.setdefault(matcher_key, []).append((label, patterns, validated))
+
+    matchers = []
+    for (kind, phrase_attr), labels_patterns in matcher_patterns.items():
+        validate = not all(validated for label, patterns, validated in labels_patterns)
+        if kind == 'phrase':
+            # create PhraseMatcher object
+            matcher = PhraseMatcher(nlp.vocab, attr=phrase_attr, validate=validate)
+        else:
+            # create Matcher object
+            matcher = Matcher(nlp.vocab, validate=validate)
+        # add all patterns to the matcher
+        for label, patterns, validated in labels_patterns:
+            matcher.add(label, patterns)
+        matchers.append(matcher)
+
+    # only the pipes setting the attributes used by the patterns are run
+    disabled_pipes = [] if required is None else [name for name in nlp.pipe_names if name not in required]
+    logging.info(f'Disabled pipes: {disabled_pipes}')
+
+    return matchers, disabled_pipes
+
 
 def annotate_auto(patterns_file_path: Path, label_text: str,
                   training_src_file: [Path, str], model='en_core_web_md',
                   extract_texts: bool = False, use_phrasematcher: bool = False,
-                  save: bool = False, verbose: bool = False):
+                  save: bool = False, verbose: bool = False, phrase_attr: str = 'ORTH',
+                  all_pipes: bool = False, n_process: int = 1, manifest_path: Path = None,
+                  use_cache: bool = True):
     """Automatic annotation tool. The function takes a file which has to contain a
     JSON list of rules to be matched. The rules are in the format compatible
     with spaCy Matcher or PhraseMatcher objects. Rule recognition is done by
-    spaCy pattern matching in the given text.
+    spaCy pattern matching in the given text. Instead of a single patterns file
+    and label, a manifest mapping many labels to their pattern files may be
+    given, in which case all the labels are annotated in a single pass.
     
     :type patterns_file_path: Path
     :param patterns_file_path: String representing a path to the file with
@@ -50,8 +265,8 @@ def annotate_auto(patterns_file_path: Path, label_text: str,
     :param model: Model to be loaded to spaCy. Either a valid spaCy pre-trained
         model or a path to a local model.
     :type training_src_file: Path
-    :param training_src_file: Training data source file path. JSON file is supposed to
-        contain list of (text, annotations) tuples, where the text is the string
+    :param training_src_file: Training data source file path. JSON (JSONL or msgpack)
+        file is supposed to contain list of (text, annotations) tuples, where the text is the string
         and annotations represents a dictionary with list of (start, end, label)
         entity descriptors.
     :type extract_texts: bool
@@ -65,9 +280,24 @@ def annotate_auto(patterns_file_path: Path, label_text: str,
         tr_src_file.
     :type verbose: bool
     :param verbose: A flag indicating verbose stdout printing.
+    :type phrase_attr: str
+    :param phrase_attr: The token attribute PhraseMatcher matches on (e.g. ORTH
+        or LOWER).
+    :type all_pipes: bool
+    :param all_pipes: A flag indicating that all the pipes of the model should
+        be run, even those which set the attributes not used by the patterns.
+    :type n_process: int
+    :param n_process: The number of processes the texts are processed by.
+    :type manifest_path: Path
+    :param manifest_path: The path to the JSON manifest mapping the labels to
+        their pattern files. If given, patterns_file_path and label_text
+        arguments are ignored.
+    :type use_cache: bool
+    :param use_cache: A flag indicating whether the compiled patterns cache
+        should be used.
     """
 
-    from avisaf.util.data_extractor import get_narratives
+    from avisaf.util.data_extractor import get_narratives, get_training_data
 
     # TODO: Support also reading from a csv file
     if training_src_file is None:
@@ -75,82 +305,105 @@ def annotate_auto(patterns_file_path: Path, label_text: str,
         logging.error(msg)
         raise TypeError(msg)
 
-    if training_src_file is str:
+    if manifest_path is None and (patterns_file_path is None or label_text is None):
+        msg = 'Either the patterns file path and the label or the patterns manifest have to be given'
+        logging.error(msg)
+        raise TypeError(msg)
+
+    if isinstance(training_src_file, str):
         training_src_file = Path(training_src_file)
 
-    # almost result list - list containing all entities - including the overlaps
-    tr_data_overlaps = []
     if training_src_file is not None:
         training_src_file = training_src_file.resolve()
-    if patterns_file_path is not None:
-        patterns_file_path = patterns_file_path.resolve()
+
+    if manifest_path is not None:
+        pattern_sources = load_patterns_manifest(manifest_path)
+    else:
+        pattern_sources = [(label_text, Path(patterns_file_path).resolve(), use_phrasematcher, phrase_attr.upper())]
 
     if extract_texts:
         # get testing texts
-        texts = list(get_narratives(training_src_file))
-        entities = None
+        examples = ((text, {"entities": []}) for text in get_narratives(training_src_file))
     else:
-        with training_src_file.open(mode='r') as tr_data_file:
-            # load the file containing the list of training ('text string', entity dict) tuples
-            tr_data = json.load(tr_data_file)
-            texts = [text for text, _ in tr_data]
-            entities = [ents for _, ents in tr_data]
+        # load the file containing the list of training ('text string', entity dict) tuples (JSON, JSONL or msgpack)
+        examples = get_training_data(training_src_file)
 
     # create NLP analyzer object of the model
-    nlp = spacy.load(model)
-    with patterns_file_path.open(mode='r') as pttrns_file:
-        patterns = json.load(pttrns_file)  # phrase/patterns to be matched
+    nlp = load_model(model)
+    matchers, disabled_pipes = build_matchers(nlp, pattern_sources, all_pipes=all_pipes, use_cache=use_cache)
 
-    if use_phrasematcher:
-        # create PhraseMatcher object
-        matcher = PhraseMatcher(nlp.vocab, validate=True)
-        # process the keys and store their values in the patterns list
-        keywords = list(nlp.pipe(patterns))
-        # add all patterns to the matcher
-        matcher.add(label_text, keywords)
-    else:
-        # create Matcher object
-        matcher = Matcher(nlp.vocab, validate=True)
-        matcher.add(label_text, patterns)
-
-    print(f'Using {matcher}', flush=verbose)
-    logging.info(f'Using {matcher}')
-
-    for doc in nlp.pipe(texts, batch_size=100):
-        matches = matcher(doc)
-        matched_spans = [doc[start:end] for match_id, start, end in matches]
-        print(f'Doc index: {texts.index(doc.text)}', f'Matched spans: {matched_spans}', flush=verbose)
-        logging.info(f'Doc index: {texts.index(doc.text)}', f'Matched spans: {matched_spans}')
-        new_entities = [(span.start_char, span.end_char, label_text) for span in matched_spans]
-        # following line of code also resolves situation when the entities dictionary is None
-        tr_example = (doc.text, {"entities": new_entities})
-        if entities is not None:
-            doc_index = texts.index(doc.text)
-            old_entities = list(entities[doc_index]["entities"])
-            new_entities = new_entities + old_entities
-            tr_example = (doc.text, {"entities": new_entities})
-
-        tr_data_overlaps.append(tr_example)
-
-    training_data = []  # list will contain training data without overlaps
-
-    for text, annotations in tr_data_overlaps:
-        new_annotations = train.remove_overlaps_from_dict(annotations)
-        training_data.append((text, {"entities": new_annotations}))
+    print(f'Using {matchers}', flush=verbose)
+    logging.info(f'Using {matchers}')
 
-    if save and training_src_file is not None:
-        with training_src_file.open(mode='w') as file:
-            json.dump(training_data, file)
+    annotated = annotate_texts(
+        nlp, matchers, examples,
+        disable=disabled_pipes,
+        n_process=n_process,
+        verbose=verbose
+    )
 
-        train.remove_overlaps_from_file(training_src_file)
-        entity_trimmer(training_src_file)
-        train.pretty_print_training_data(training_src_file)
+    # sorting, overlap removal and trimming of the entities done in a single pass
+    training_data = list(train.postprocess_training_data(annotated))
+
+    if save and training_src_file is not None:
+        train.write_training_data(training_src_file, training_data)
     else:
         print(*training_data, sep='\n')
 
     return training_data
 
 
+def annotate_texts(nlp, matchers: list, examples, batch_size: int = 100,
+                   disable: list = None, n_process: int = 1, verbose: bool = False):
+    """Applies the matchers to the stream of (text, annotations) examples. The
+    position of each example is passed through the nlp.pipe along with its
+    text, so the texts are processed in a single linear pass and identical
+    texts are never confused. The label of a new entity is the key its rule
+    was added to the matcher under.
+
+    :type nlp: Language
+    :param nlp: The spaCy model used for text processing.
+    :type matchers: list
+    :param matchers: The Matcher and PhraseMatcher objects containing the rules
+        to be applied.
+    :type examples: iterable
+    :param examples: The (text, annotations) tuples, where annotations is the
+        dictionary containing the list of already existing entities under the
+        'entities' key.
+    :type batch_size: int
+    :param batch_size: The number of texts buffered by spaCy during processing.
+    :type disable: list
+    :param disable: The names of the pipes which are not run.
+    :type n_process: int
+    :param n_process: The number of processes the texts are processed by. The
+        matchers themselves are always applied in the current process.
+    :type verbose: bool
+    :param verbose: A flag indicating verbose stdout printing.
+
+    :return: Returns a python generator of (text, annotations) tuples, where the
+        new entities precede the existing ones. The entities may overlap.
+    """
+    indexed_texts = ((text, (doc_index, annotations)) for doc_index, (text, annotations) in enumerate(examples))
+
+    docs = nlp.pipe(
+        indexed_texts,
+        as_tuples=True,
+        batch_size=batch_size,
+        disable=[] if disable is None else disable,
+        n_process=n_process
+    )
+
+    for doc, (doc_index, annotations) in docs:
+        matches = [match for matcher in matchers for match in matcher(doc)]
+        matched_spans = [(doc[start:end], nlp.vocab.strings[match_id]) for match_id, start, end in matches]
+        print(f'Doc index: {doc_index}', f'Matched spans: {matched_spans}', flush=verbose)
+        logging.info(f'Doc index: {doc_index} Matched spans: {matched_spans}')
+        new_entities = [(span.start_char, span.end_char, label) for span, label in matched_spans]
+        old_entities = list(annotations["entities"]) if annotations is not None else []
+
+        yield doc.text, {"entities": new_entities + old_entities}
+
+
 def annotate_man(file_path: Path, lines: int = -1,
                  labels_path: Path = None, start_index: int = 0,
                  save: bool = True):
@@ -192,6 +445,10 @@ def annotate_man(file_path: Path, lines: int = -1,
             else:
                 with file_path.open(mode='r') as file:
                     texts = json.load(file)
+
+                # if we don't want to annotate all texts
+                if lines != -1:
+                    texts = texts[start_index:start_index + lines]
         else:
             # use given argument as the text to be annotated
             texts = [str(file_path)]
@@ -202,10 +459,6 @@ def annotate_man(file_path: Path, lines: int = -1,
 
     result = []
 
-    # if we don't want to annotate all texts
-    if lines != -1:
-        texts = texts[start_index:start_index + lines]
-
     for text in texts:
         ent_labels = []
         print(text, "", sep='\n')
@@ -238,31 +491,22 @@ def annotate_man(file_path: Path, lines: int = -1,
         print()  # print an empty line
 
         if save:
-            man_training_data_file = Path('data_files', 'training_data', 'man_annotated_data.json').resolve()
-            man_training_data_file.touch(exist_ok=True)
-
-            # if the file is not empty
-            if len(man_training_data_file.read_bytes()) != 0:
-                # rewrite the current content of the file
-                with open(os.path.expanduser(man_training_data_file), mode='r') as file:
-                    old_content = json.load(file)
-            else:
-                old_content = []
-
-            with open(os.path.expanduser(man_training_data_file), mode='w') as file:
-                old_content.append(new_entry)
-                json.dump(old_content, file)
-                print(f"Content in the {man_training_data_file.relative_to(SOURCES_ROOT_PATH.parent)} updated.\n")
-
-            train.pretty_print_training_data(man_training_data_file)
+            # constant cost per text - the journal is merged into the JSON file by the 'compact' command
+            man_journal_file = Path('data_files', 'training_data', 'man_annotated_data.jsonl').resolve()
+            train.append_to_journal(man_journal_file, new_entry)
+            print(f"Annotation appended to the {man_journal_file.relative_to(SOURCES_ROOT_PATH.parent)}.\n")
 
     return result
 
 
 class ASRSReportDataPreprocessor:
 
-    def __init__(self, vectorizer=None):
+    def __init__(self, vectorizer=None, csv_cache: bool = False):
+        # imported here, so that the annotation subcommands do not load gensim and sklearn
+        import avisaf.classification.vectorizers as vectorizers
+
         self._encoding = None
+        self._csv_cache = csv_cache  # whether the CSV files are read through their columnar cache
         self.vectorizer = vectorizers.TfIdfAsrsReportVectorizer() if vectorizer is None else vectorizer
         # self.vectorizer = vectorizers.Doc2VecAsrsReportVectorizer() if vectorizer is None else vectorizer
 
@@ -431,7 +675,7 @@ class ASRSReportDataPreprocessor:
     def vectorize_texts(self, texts_paths: list, label_to_extract: str, train: bool, label_values_filter: list, normalize: bool = False):
         narrative_label = 'Report 1_Narrative'
 
-        extractor = DataExtractor(texts_paths)
+        extractor = DataExtractor(texts_paths, use_cache=self._csv_cache)
         labels_to_extract = [label_to_extract, narrative_label] if label_to_extract is not None else [narrative_label]
         extracted_dict = extractor.extract_from_csv_columns(labels_to_extract)
 
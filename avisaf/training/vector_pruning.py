@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Vector pruning is the module responsible for shrinking the word vectors
+table of a model to the vocabulary of the ASRS domain. The words of the given
+corpus are counted, the vectors of the most frequent ones are kept and the
+other words are mapped to their nearest kept vector (by cosine similarity),
+the same way spaCy's Vocab.prune_vectors does it. The kept vectors may also
+be stored as float16, which halves their size on the disk (they are cast back
+to float32 when the model is loaded by avisaf.util.model_loading.load_model,
+which every part of the program loads the models with).
+"""
+
+import time
+import numpy as np
+from collections import Counter
+from pathlib import Path
+from spacy._ml import link_vectors_to_models
+from spacy.vectors import Vectors
+# importing own modules
+from avisaf.util.data_extractor import get_narratives, get_training_data
+
+
+def corpus_texts(corpus_paths: list):
+    """Reads the texts of the corpus files. CSV files are treated as ASRS
+    exports (their narratives are used), other files as training data.
+
+    :type corpus_paths: list
+    :param corpus_paths: The paths to the corpus files.
+
+    :return: A python generator of texts.
+    """
+    for corpus_path in corpus_paths:
+        corpus_path = Path(corpus_path).resolve()
+        if corpus_path.suffix == '.csv':
+            yield from get_narratives(corpus_path)
+        else:
+            yield from (text for text, annotations in get_training_data(corpus_path))
+
+
+def count_words(nlp, texts, batch_size: int = 1000):
+    """Counts the occurrences of the words (orth ids) in the texts.
+
+    :type nlp: Language
+    :param nlp: The model whose tokenizer is used.
+    :param texts: An iterable of texts.
+    :type batch_size: int
+    :param batch_size: The number of texts tokenized at once.
+
+    :return: The Counter of orth ids.
+    """
+    counts = Counter()
+    for doc in nlp.tokenizer.pipe(texts, batch_size=batch_size):
+        counts.update(token.orth for token in doc)
+    return counts
+
+
+def nearest_rows(data, keep_rows, toss_rows, batch_size: int = 1024):
+    """Finds the most similar kept row (by cosine similarity) for each of the
+    tossed rows.
+
+    :return: The array of positions in keep_rows and the array of the
+        similarities, both aligned with toss_rows.
+    """
+    def normalized(rows):
+        vectors = data[rows].astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    kept = normalized(keep_rows)
+    best = np.zeros(len(toss_rows), dtype=np.int64)
+    similarities = np.zeros(len(toss_rows), dtype=np.float32)
+    for start in range(0, len(toss_rows), batch_size):
+        scores = normalized(toss_rows[start:start + batch_size]) @ kept.T
+        best[start:start + batch_size] = scores.argmax(axis=1)
+        similarities[start:start + batch_size] = scores.max(axis=1)
+    return best, similarities
+
+
+def prune_vectors_by_frequency(nlp, counts: Counter, rows_count: int):
+    """Keeps the rows_count vector rows of the most frequent words of the
+    corpus. The rows of the words which do not occur in the corpus are kept
+    in their original order (spaCy models sort them by frequency as well).
+    The keys of the removed rows are mapped to the most similar kept rows.
+
+    :type nlp: Language
+    :param nlp: The model whose vectors are pruned in place.
+    :type counts: Counter
+    :param counts: The occurrences of the orth ids in the corpus.
+    :type rows_count: int
+    :param rows_count: The number of rows to be kept.
+
+    :return: The mean cosine similarity of the removed vectors to the kept
+        vectors they were mapped to.
+    """
+    vectors = nlp.vocab.vectors
+    data = vectors.data
+    row_frequencies = np.zeros(data.shape[0], dtype=np.int64)
+    for key, row in vectors.key2row.items():
+        row_frequencies[row] += counts.get(key, 0)
+
+    order = np.argsort(-row_frequencies, kind='stable')
+    keep_rows = order[:rows_count]
+    toss_rows = order[rows_count:]
+    nearest, similarities = nearest_rows(data, keep_rows, toss_rows)
+
+    new_rows = np.zeros(data.shape[0], dtype=np.int64)
+    new_rows[keep_rows] = np.arange(len(keep_rows))
+    new_rows[toss_rows] = nearest
+
+    pruned = Vectors(data=np.ascontiguousarray(data[keep_rows]), name=vectors.name)
+    for key, row in vectors.key2row.items():
+        pruned.add(key, row=int(new_rows[row]))
+
+    nlp.vocab.vectors = pruned
+    link_vectors_to_models(nlp.vocab)
+
+    return float(similarities.mean()) if len(similarities) else 1.0
+
+
+def prune_model_vectors(model: [str, Path], output_path: Path, rows_count: int, corpus_paths: list,
+                        dev_data_path: Path = None, float16: bool = False):
+    """Prunes the vectors of the model to the most frequent words of the
+    corpus and saves the model. The memory used by the vectors before and
+    after the pruning is reported along with the change of the held-out
+    F-score if the dev data are given. The model is loaded by load_ner_model,
+    so the saved model contains only the 'ner' pipe.
+
+    :type model: str, Path
+    :param model: The spaCy model whose vectors are pruned. Either an existing
+        pre-downloaded spaCy model or a path to a local directory.
+    :type output_path: Path
+    :param output_path: The directory the pruned model will be saved to.
+    :type rows_count: int
+    :param rows_count: The number of vector rows to be kept.
+    :type corpus_paths: list
+    :param corpus_paths: The paths to the training data or ASRS CSV files the
+        word frequencies are counted in.
+    :type dev_data_path: Path
+    :param dev_data_path: The path to the held-out data used to measure the
+        F-score of the model before and after the pruning.
+    :type float16: bool
+    :param float16: A flag indicating that the vectors should be stored as
+        float16.
+
+    :return: The pruned spaCy model.
+    """
+    # importing own modules
+    from avisaf.tagging.batch_tagger import load_ner_model
+    from avisaf.util.model_loading import restore_float32_vectors
+    from avisaf.training.evaluation import evaluate_ner
+    from avisaf.util.data_extractor import get_entities
+
+    output_path = Path(output_path).resolve()
+    nlp = load_ner_model(model)
+    vectors = nlp.vocab.vectors
+    if vectors.shape[0] == 0:
+        raise OSError(f'The model \'{model}\' does not contain any word vectors.')
+    if rows_count >= vectors.shape[0]:
+        raise OSError(f'The model has only {vectors.shape[0]} vector rows, nothing to prune.')
+
+    dev_data = get_training_data(Path(dev_data_path).resolve()) if dev_data_path is not None else None
+    labels = get_entities()
+    original_score = evaluate_ner(nlp, dev_data, labels)['ents_f'] if dev_data is not None else None
+
+    start_time = time.time()
+    counts = count_words(nlp, corpus_texts(corpus_paths))
+    original_bytes = vectors.data.nbytes
+    original_rows = vectors.shape[0]
+    similarity = prune_vectors_by_frequency(nlp, counts, rows_count)
+    if float16:
+        nlp.vocab.vectors.data = nlp.vocab.vectors.data.astype(np.float16)
+
+    print(f'{len(counts)} distinct words counted in the corpus, the vectors were pruned from {original_rows} to '
+          f'{rows_count} rows in {time.time() - start_time:.1f} s (mean similarity of the remapped vectors '
+          f'{similarity:.3f}).')
+    pruned_bytes = nlp.vocab.vectors.data.nbytes
+    print(f'Vectors memory: {original_bytes / (1 << 20):.1f} MiB -> {pruned_bytes / (1 << 20):.1f} MiB '
+          f'({(1 - pruned_bytes / original_bytes) * 100:.1f} % saved).')
+
+    nlp.to_disk(output_path)
+    restore_float32_vectors(nlp)
+    print(f'The model with pruned vectors was saved to {output_path}.')
+
+    if dev_data is not None:
+        # the saved model is evaluated the way it is going to be loaded
+        pruned_score = evaluate_ner(load_ner_model(output_path), dev_data, labels)['ents_f']
+        print(f'Held-out F-score: {original_score:.3f} -> {pruned_score:.3f} '
+              f'({pruned_score - original_score:+.3f}).')
+
+    return nlp
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Cache module provides the on-disk cache used by other modules to store the
+results of expensive preprocessing steps (compiled matcher patterns, parsed
+CSV files etc.). Each cache entry is identified by a key computed from the
+content or the state of all its inputs, so stale entries are never used.
+
+The cache is located in ~/.cache/avisaf unless AVISAF_CACHE_DIR environment
+variable says otherwise.
+"""
+
+import os
+import hashlib
+import logging
+import srsly
+from pathlib import Path
+
+CACHE_ROOT = Path(os.environ.get('AVISAF_CACHE_DIR', Path.home().joinpath('.cache', 'avisaf')))
+
+
+def get_cache_dir(name: str):
+    """Returns the directory of the given cache. The directory is created if
+    it does not exist yet.
+
+    :type name: str
+    :param name: The name of the cache (e.g. 'matchers').
+
+    :return: The path to the cache directory.
+    """
+    cache_dir = CACHE_ROOT.joinpath(name)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def file_digest(file_path: Path, chunk_size: int = 1 << 20):
+    """Computes the SHA-256 hash of the file content.
+
+    :type file_path: Path
+    :param file_path: The path to the file.
+    :type chunk_size: int
+    :param chunk_size: The number of bytes read at once.
+
+    :return: The hexadecimal digest string.
+    """
+    digest = hashlib.sha256()
+    with Path(file_path).open(mode='rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_fingerprint(nlp):
+    """Describes the spaCy model so that the results produced by different
+    models (or different versions of the same model) get different keys.
+
+    :type nlp: Language
+    :param nlp: The spaCy model.
+
+    :return: The string describing the model.
+    """
+    meta = nlp.meta
+    fingerprint = f'{meta.get("lang")}_{meta.get("name")}-{meta.get("version")}'
+    model_path = getattr(nlp, 'path', None)
+    if model_path is not None and Path(model_path, 'meta.json').exists():
+        # models saved by nlp.to_disk keep the name of the original one
+        fingerprint += f'@{Path(model_path).resolve()}:{Path(model_path, "meta.json").stat().st_mtime_ns}'
+    return fingerprint
+
+
+def cache_key(*parts):
+    """Computes the cache key from all given parts.
+
+    :return: The hexadecimal digest string.
+    """
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def read_cached(name: str, key: str):
+    """Reads the cache entry stored by write_cached function.
+
+    :type name: str
+    :param name: The name of the cache.
+    :type key: str
+    :param key: The key of the entry.
+
+    :return: The content of the entry or None if there is no such entry.
+    """
+    entry_path = get_cache_dir(name).joinpath(f'{key}.msgpack')
+    if not entry_path.exists():
+        return None
+
+    try:
+        return srsly.read_msgpack(entry_path)
+    except ValueError as ex:
+        logging.warning(f'Ignoring corrupted cache entry {entry_path}: {ex}')
+        return None
+
+
+def write_cached(name: str, key: str, content):
+    """Stores the msgpack serializable content in the cache. The entry is first
+    written into a temporary file, so that no other process can read it
+    incomplete.
+
+    :type name: str
+    :param name: The name of the cache.
+    :type key: str
+    :param key: The key of the entry.
+    :param content: The content of the entry.
+    """
+    entry_path = get_cache_dir(name).joinpath(f'{key}.msgpack')
+    tmp_path = entry_path.with_name(f'{entry_path.name}.{os.getpid()}.tmp')
+    srsly.write_msgpack(tmp_path, content)
+    os.replace(tmp_path, entry_path)
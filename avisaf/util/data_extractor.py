@@ -3,12 +3,16 @@
 training data used by other modules.
 """
 
+import os
 import pandas as pd
+import numpy as np
 import sys
 import json
+import shutil
+import srsly
 import logging
 from pathlib import Path
-import numpy as np
+from avisaf.util.cache import cache_key, get_cache_dir
 
 
 class JsonDataExtractor:
@@ -42,14 +46,17 @@ def get_entities(entities_file_path: Path = None):
 def get_training_data(training_data_file_path: Path):
     # Works with (text, annotations) list JSON file
     # Probably will be moved to JsonDataExtractor
-    """Function which reads given JSON file supposed to contain the training data.
-    The training data are supposed to be a list of (text, annotations) tuples.
+    """Function which reads given JSON, JSONL or msgpack file supposed to contain
+    the training data. The training data are supposed to be a list of
+    (text, annotations) tuples (one tuple per line in JSONL files with .jsonl
+    suffix). The format of other files is detected by is_msgpack_training_data
+    function.
 
     :type training_data_file_path: Path
-    :param training_data_file_path: The path to the JSON file containing the
-        training data.
+    :param training_data_file_path: The path to the JSON, JSONL or msgpack file
+        containing the training data.
 
-    :return: Returns the JSON list of (text, annotations) tuples.
+    :return: Returns the list of (text, annotations) tuples.
     """
     if not training_data_file_path:
         msg = 'Training data file path cannot be None'
@@ -59,15 +66,42 @@ def get_training_data(training_data_file_path: Path):
     if not training_data_file_path.is_absolute():
         training_data_file_path = training_data_file_path.resolve()
 
-    with training_data_file_path.open(mode='r') as tr_data_file:
-        return json.load(tr_data_file)
+    if training_data_file_path.suffix == '.jsonl':
+        return list(srsly.read_jsonl(training_data_file_path))
+
+    if is_msgpack_training_data(training_data_file_path):
+        return srsly.read_msgpack(training_data_file_path)
+
+    return srsly.read_json(training_data_file_path)
+
+
+def is_msgpack_training_data(file_path: Path):
+    """Decides whether the training data file is stored in the compact msgpack
+    format rather than in JSON. Files with .msgpack suffix are always treated as
+    msgpack, otherwise the file is treated as msgpack only if its first byte is
+    a msgpack array marker (fixarray, array 16 or array 32), which can never
+    start a JSON (or UTF-8 encoded) file.
+
+    :type file_path: Path
+    :param file_path: The path to the training data file.
+
+    :return: True if the file contains msgpack data.
+    """
+    file_path = Path(file_path)
+    if file_path.suffix == '.msgpack':
+        return True
+
+    with file_path.open(mode='rb') as file:
+        first_byte = file.read(1)
 
+    return first_byte != b'' and (0x90 <= first_byte[0] <= 0x9f or first_byte[0] in (0xdc, 0xdd))
 
-def get_narratives(file_path: Path, lines_count: int = -1, start_index: int = 0):
-    # TODO: This method should be replaced by CsvDataExtractor.extract_data_from_csv_columns
 
+def get_narratives(file_path: Path, lines_count: int = -1, start_index: int = 0, use_cache: bool = None):
     """Function responsible for reading raw csv file containing the original
-    safety reports from the ASRS database.
+    safety reports from the ASRS database. Only the narrative and callback
+    columns are parsed, the file is read in chunks (or from its columnar cache)
+    and the rows preceding start_index are never materialized.
 
     :type lines_count: int
     :param lines_count: Number of lines to be read.
@@ -76,6 +110,9 @@ def get_narratives(file_path: Path, lines_count: int = -1, start_index: int = 0)
     :type start_index: int
     :param start_index: Number indicating the index of the first text to be
         returned.
+    :type use_cache: bool
+    :param use_cache: True builds the columnar cache of the file if it does not
+        exist, False never uses it and None uses it only if it already exists.
 
     :return: Returns a python generator object of all texts.
     """
@@ -85,38 +122,22 @@ def get_narratives(file_path: Path, lines_count: int = -1, start_index: int = 0)
         logging.error(msg)
         raise TypeError(msg)
 
-    file_path = str(file_path) if file_path.is_absolute() else str(file_path.resolve())
-
-    report_df = pd.read_csv(
-        file_path,
-        skip_blank_lines=True,
-        index_col=0,
-        header=[0, 1]
-    )
-    report_df.columns = report_df.columns.map('_'.join)
-
-    try:
-        narratives1 = report_df['Report 1_Narrative'].values.tolist()
-        calls1 = report_df['Report 1_Callback'].values.tolist()
-        narratives2 = report_df['Report 2_Narrative'].values.tolist()
-        calls2 = report_df['Report 2_Callback'].values.tolist()
+    file_path = Path(file_path)
+    file_path = file_path if file_path.is_absolute() else file_path.resolve()
+    field_names = ['Report 1_Narrative', 'Report 1_Callback', 'Report 2_Narrative', 'Report 2_Callback']
 
-    except KeyError:
+    cache = CsvColumnCache(file_path)
+    if use_cache is None:
+        use_cache = cache.exists()
+    columns = cache.columns if use_cache and cache.exists() else get_csv_header(file_path)
+    if any(field_name not in columns for field_name in field_names):
         print('No such key was found', file=sys.stderr)
-        return None
-
-    length = len(narratives1)
-    lists = [narratives1, calls1, narratives2, calls2]
-
-    end_index = start_index + lines_count
-
-    result = []
-    for index in range(start_index, length):
-        if lines_count != -1 and index >= end_index:
-            break
-        result.append(' '.join([str(lst[index]) for lst in lists if str(lst[index]) != 'nan']))
+        return
 
-    return result
+    rows = iter_csv_rows(file_path, field_names, start_index=start_index, lines_count=lines_count,
+                         use_cache=use_cache, as_strings=True)
+    for row in rows:
+        yield ' '.join(value for value in row if value)
 
 
 def find_file_by_path(file_path: [Path, str], max_iterations: int = 5):
@@ -144,67 +165,454 @@ def find_file_by_path(file_path: [Path, str], max_iterations: int = 5):
     return None
 
 
-class DataExtractor:
+def get_csv_header(file_path: [Path, str]):
+    """Reads only the two-line header of an ASRS CSV file.
 
-    def __init__(self, file_paths: list):
-        self._file_paths = file_paths
+    :type file_path: Path, str
+    :param file_path: The path to the csv file.
 
-    def extract_from_csv_columns(self, field_name: [str, list], lines_count: int = -1,
-                                 start_index: int = 0, file_paths: [list, str] = None):
+    :return: The list of column names in format "FirstLineTitle_SecondLineTitle".
+    """
+    header = pd.read_csv(file_path, skip_blank_lines=True, header=[0, 1], nrows=0)
+    return list(header.columns.map('_'.join))
+
+
+# the order of column value kinds, a column has the most general kind of its values
+_VALUE_KINDS = ['int', 'float', 'str']
+# the dtypes the values of each kind are parsed as (the integer columns never have missing values)
+_KIND_DTYPES = {'int': 'int64', 'float': 'float64', 'str': str}
+
+
+def infer_value_kind(values: list):
+    """Infers the kind of the column values the same way pandas infers the
+    column dtype: 'int' if all the values are integers, 'float' if they are
+    numbers or some of them are missing and 'str' otherwise.
+
+    :type values: list
+    :param values: The string values of a column, missing values are empty
+        strings.
+
+    :return: One of 'int', 'float' and 'str'.
+    """
+    series = pd.Series(values, dtype=object)
+    present = series[series != '']
+    numbers = pd.to_numeric(present, errors='coerce')
+    if numbers.isna().any():
+        return 'str'
+    if len(present) < len(series) or not pd.api.types.is_integer_dtype(numbers):
+        return 'float'
+    return 'int'
+
+
+def merge_value_kinds(kind: str, other_kind: str):
+    """Returns the more general of the two column value kinds."""
+    return max(kind, other_kind, key=_VALUE_KINDS.index)
+
+
+def numbers_to_values(numbers: np.ndarray):
+    """Converts the array of a numeric column to the list of python numbers.
+    Missing values (NaN) are replaced by empty strings, the same way as the
+    missing values of the string columns.
+
+    :type numbers: numpy.ndarray
+    :param numbers: The int64 or float64 array of the column values.
+
+    :return: The list of the values.
+    """
+    if numbers.dtype.kind != 'f':
+        return numbers.tolist()
+
+    values = numbers.astype(object)
+    values[np.isnan(numbers)] = ''
+    return values.tolist()
+
+
+def infer_csv_kinds(file_path: [Path, str], positions: list, chunk_size: int = 10000):
+    """Infers the kinds of the values of the given columns from all the rows of
+    the ASRS CSV file, so that a column has a single kind for the whole file
+    (as in CsvColumnCache). The dtype pandas infers for each chunk gives the
+    kind of its values, the kinds of the chunks are then merged.
+
+    :type file_path: Path, str
+    :param file_path: The path to the csv file.
+    :type positions: list
+    :param positions: The indexes of the columns.
+    :type chunk_size: int
+    :param chunk_size: The number of rows parsed at once.
+
+    :return: The dictionary mapping the column indexes to their kinds.
+    """
+    kinds = {position: _VALUE_KINDS[0] for position in positions}
+    reader = pd.read_csv(
+        file_path, skip_blank_lines=True, header=None, skiprows=2, usecols=sorted(kinds), chunksize=chunk_size
+    )
+    for chunk in reader:
+        for position in kinds:
+            dtype_kind = chunk[position].dtype.kind
+            chunk_kind = 'int' if dtype_kind == 'i' else 'float' if dtype_kind == 'f' else 'str'
+            kinds[position] = merge_value_kinds(kinds[position], chunk_kind)
+
+    return kinds
+
+
+def iter_csv_rows(file_path: [Path, str], field_names: list, chunk_size: int = 10000,
+                  start_index: int = 0, lines_count: int = -1, use_cache: bool = False,
+                  as_strings: bool = False):
+    """Streams the values of the requested columns of an ASRS CSV file. Only the
+    requested columns are parsed and the file is read in chunks, so the memory
+    usage is bounded by the chunk size. Missing values are replaced by empty
+    strings. Numeric columns (e.g. ACN or date) are returned as numbers like
+    pandas would infer them from the whole file, unless as_strings is set.
+    Without the cache, the kinds of the numeric columns are inferred by an
+    extra pass over the requested columns of the file first.
+
+    :type file_path: Path, str
+    :param file_path: The path to the csv file.
+    :type field_names: list
+    :param field_names: The names of the columns in format
+        "FirstLineTitle_SecondLineTitle". All of them have to exist.
+    :type chunk_size: int
+    :param chunk_size: The number of rows parsed at once.
+    :type start_index: int
+    :param start_index: The index of the first row to be returned.
+    :type lines_count: int
+    :param lines_count: The number of rows to be returned, -1 means all rows.
+    :type use_cache: bool
+    :param use_cache: A flag indicating that the values should be read from the
+        columnar cache of the file (which is built if it does not exist yet).
+        Files which cannot be cached are read directly.
+    :type as_strings: bool
+    :param as_strings: A flag indicating that all the values should be
+        returned as the strings they are written as in the file.
+
+    :return: Returns a python generator of tuples containing the values of
+        requested columns in the order of field_names.
+    """
+    if use_cache:
+        cache = CsvColumnCache(file_path)
+        if cache.exists() or cache.build(chunk_size):
+            yield from cache.rows(field_names, start_index, lines_count, as_strings)
+            return
+
+    columns = get_csv_header(file_path)
+    positions = [columns.index(field_name) for field_name in field_names]
+
+    # the numeric columns are parsed by pandas directly as the kind of all their values
+    kinds = {position: 'str' for position in positions} if as_strings else infer_csv_kinds(file_path, positions, chunk_size)
+    reader = pd.read_csv(
+        file_path,
+        skip_blank_lines=True,
+        header=None,
+        skiprows=2,     # the two-line header
+        usecols=sorted(set(positions)),
+        dtype={position: _KIND_DTYPES[kind] for position, kind in kinds.items()},
+        chunksize=chunk_size,
+        nrows=None if lines_count == -1 else start_index + lines_count
+    )
+
+    row_index = 0
+    for chunk in reader:
+        chunk_start = row_index
+        row_index += chunk.shape[0]
+        if row_index <= start_index:
+            continue  # the whole chunk precedes the requested rows
+
+        chunk_columns = {}
+        for position, kind in kinds.items():
+            column = chunk[position]
+            chunk_columns[position] = column.fillna('').values.tolist() if kind == 'str' else numbers_to_values(column.to_numpy())
+
+        first_row = max(start_index - chunk_start, 0)
+        yield from zip(*(chunk_columns[position][first_row:] for position in positions))
+
+
+class CsvColumnCache:
+    """Columnar binary cache of a parsed ASRS CSV file. Each column is stored as
+    a single UTF-8 blob of all its values along with an array of the value
+    offsets, both memory-mapped when read. The kind of each column (inferred
+    from all its values) is stored in the metadata and the values of the
+    numeric columns are stored as an int64 or float64 array as well, so they
+    are read as numbers without parsing the strings again. The cache is keyed by the path,
+    modification time and size of the CSV file, so any change of the file
+    makes it build a new one.
+    """
+
+    # the number of values decoded from the blob at once
+    _BLOCK_SIZE = 10000
+    # changed whenever the layout of the cache changes
+    _FORMAT_VERSION = 3
+
+    def __init__(self, file_path: [Path, str]):
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        path_key = cache_key(file_path)[:16]
+        self._file_path = file_path
+        self._path_key = path_key
+        self._cache_dir = get_cache_dir('csv').joinpath(f'{path_key}-{cache_key(stat.st_mtime_ns, stat.st_size, self._FORMAT_VERSION)[:16]}')
+        self._meta = None
+
+    def exists(self):
+        return self._cache_dir.joinpath('meta.json').exists()
+
+    def build(self, chunk_size: int = 10000):
+        """Converts the CSV file into the cache. The file is parsed in chunks,
+        so the memory usage is bounded by the chunk size. The cache is written
+        into a temporary directory of this process first, so concurrent builds
+        of the same file do not interfere (the first one finished is used).
+        The cache entries of previous versions of the file are removed.
+
+        :type chunk_size: int
+        :param chunk_size: The number of rows parsed at once.
+
+        :return: True if the cache exists afterwards, False if the file could
+            not be cached because its rows do not match the header (the file
+            has to be read by the uncached reader then).
+        """
+        columns = get_csv_header(self._file_path)
+        tmp_dir = self._cache_dir.with_name(f'{self._cache_dir.name}.{os.getpid()}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        try:
+            rows, kinds = self._write_columns(tmp_dir, columns, chunk_size)
+            for index, kind in enumerate(kinds):
+                if kind != 'str':
+                    self._write_numbers(tmp_dir, index, kind, rows)
+        except (pd.errors.ParserError, ValueError) as ex:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            logging.warning(f'CSV cache of {self._file_path} was not created, the rows do not match the header: {ex}')
+            return False
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        with tmp_dir.joinpath('meta.json').open(mode='w') as meta_file:
+            json.dump({"source": str(self._file_path), "columns": columns, "kinds": kinds, "rows": rows}, meta_file)
+
+        # removing the caches of the previous versions of the file, the temporary directories of other
+        # processes are left alone
+        for old_dir in self._cache_dir.parent.glob(f'{self._path_key}-*'):
+            if old_dir != self._cache_dir and not old_dir.name.endswith('.tmp'):
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+        try:
+            os.replace(tmp_dir, self._cache_dir)
+        except OSError:
+            # a directory cannot replace a non-empty one, another process has built the cache meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not self.exists():
+                raise
+        else:
+            logging.info(f'CSV cache of {self._file_path} created in {self._cache_dir}')
+
+        return True
+
+    def _write_columns(self, target_dir: Path, columns: list, chunk_size: int):
+        """Writes the blobs and offsets of all the columns into the directory.
+
+        :return: The number of rows and the list of column value kinds.
+        """
+        blobs = [target_dir.joinpath(f'{index}.bin').open(mode='wb') for index in range(len(columns))]
+        offsets = [target_dir.joinpath(f'{index}.idx').open(mode='wb') for index in range(len(columns))]
+        try:
+            ends = [0] * len(columns)
+            kinds = [_VALUE_KINDS[0]] * len(columns)
+            for offsets_file in offsets:
+                offsets_file.write(np.zeros(1, dtype=np.int64).tobytes())
+
+            rows = 0
+            # the names make pandas reject the rows with more fields than the header, shorter rows are padded
+            reader = pd.read_csv(
+                self._file_path, skip_blank_lines=True, header=None, skiprows=2, names=list(range(len(columns))),
+                dtype=str, chunksize=chunk_size
+            )
+            for chunk in reader:
+                if chunk.shape[1] != len(columns):
+                    raise ValueError(f'{chunk.shape[1]} fields found, {len(columns)} expected')
+                chunk = chunk.fillna('')
+                rows += chunk.shape[0]
+                for index, values in enumerate(chunk.T.values.tolist()):
+                    kinds[index] = merge_value_kinds(kinds[index], infer_value_kind(values))
+                    encoded = [value.encode('utf-8') for value in values]
+                    value_ends = ends[index] + np.cumsum([len(value) for value in encoded], dtype=np.int64)
+                    blobs[index].write(b''.join(encoded))
+                    offsets[index].write(value_ends.tobytes())
+                    ends[index] = int(value_ends[-1]) if len(value_ends) else ends[index]
+        finally:
+            for file in blobs + offsets:
+                file.close()
+
+        return rows, kinds
+
+    def _write_numbers(self, target_dir: Path, index: int, kind: str, rows: int):
+        """Writes the values of a numeric column as an array of its kind. The
+        missing values of float columns are stored as NaN.
         """
+        with target_dir.joinpath(f'{index}.num').open(mode='wb') as numbers_file:
+            for block_start, values in self._blocks(target_dir, index, 0, rows):
+                series = pd.Series(values, dtype=object)
+                numbers = pd.to_numeric(series.mask(series == ''), errors='raise')
+                numbers_file.write(numbers.to_numpy(dtype=_KIND_DTYPES[kind]).tobytes())
+
+    def _blocks(self, cache_dir: Path, index: int, start_index: int, end_index: int):
+        """Decodes the string values of a column block by block.
 
-        :param file_paths:
-        :param field_name:
-        :param lines_count:
-        :param start_index:
-        :return:
+        :return: Returns a python generator of (block start, values) tuples.
+        """
+        blob_path = cache_dir.joinpath(f'{index}.bin')
+        offsets = np.memmap(cache_dir.joinpath(f'{index}.idx'), dtype=np.int64, mode='r')
+        blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if blob_path.stat().st_size else np.zeros(0, np.uint8)
+
+        for block_start in range(start_index, end_index, self._BLOCK_SIZE):
+            block_end = min(block_start + self._BLOCK_SIZE, end_index)
+            block_offsets = offsets[block_start:block_end + 1] - offsets[block_start]
+            block = blob[offsets[block_start]:offsets[block_end]].tobytes()
+            yield block_start, [
+                block[value_start:value_end].decode('utf-8')
+                for value_start, value_end in zip(block_offsets[:-1].tolist(), block_offsets[1:].tolist())
+            ]
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with self._cache_dir.joinpath('meta.json').open(mode='r') as meta_file:
+                self._meta = json.load(meta_file)
+        return self._meta
+
+    @property
+    def columns(self):
+        return self.meta['columns']
+
+    def column(self, field_name: str, start_index: int = 0, lines_count: int = -1, as_strings: bool = False):
+        """Reads the values of a single column from the cache.
+
+        :type field_name: str
+        :param field_name: The column name in format "FirstLineTitle_SecondLineTitle".
+        :type start_index: int
+        :param start_index: The index of the first value to be returned.
+        :type lines_count: int
+        :param lines_count: The number of values to be returned, -1 means all.
+        :type as_strings: bool
+        :param as_strings: A flag indicating that the values of numeric columns
+            should be returned as strings too.
+
+        :return: Returns a python generator of the values.
+        """
+        index = self.columns.index(field_name)
+        kind = 'str' if as_strings else self.meta['kinds'][index]
+        rows = self.meta['rows']
+        end_index = rows if lines_count == -1 else min(rows, start_index + lines_count)
+
+        if kind == 'str':
+            for block_start, values in self._blocks(self._cache_dir, index, start_index, end_index):
+                yield from values
+        elif start_index < end_index:
+            numbers = np.memmap(self._cache_dir.joinpath(f'{index}.num'), dtype=_KIND_DTYPES[kind], mode='r')
+            for block_start in range(start_index, end_index, self._BLOCK_SIZE):
+                yield from numbers_to_values(np.asarray(numbers[block_start:min(block_start + self._BLOCK_SIZE, end_index)]))
+
+    def rows(self, field_names: list, start_index: int = 0, lines_count: int = -1, as_strings: bool = False):
+        """Reads the values of given columns from the cache row by row.
+
+        :return: Returns a python generator of tuples containing the values of
+            requested columns in the order of field_names.
         """
+        return zip(*(self.column(field_name, start_index, lines_count, as_strings) for field_name in field_names))
 
-        # Normalizing the type of arguments to fit the rest of the method
-        field_names = field_name if type(field_name) is list else [field_name]
+
+class DataExtractor:
+
+    def __init__(self, file_paths: list, use_cache: bool = False):
+        self._file_paths = file_paths
+        self._use_cache = use_cache  # whether the files are read through CsvColumnCache
+
+    def iter_csv_columns(self, field_names: list, lines_count: int = -1, start_index: int = 0,
+                         file_paths: list = None, chunk_size: int = 10000):
+        """Streams the values of given columns from all the csv files. Each file
+        is read only once, in chunks and with only the requested columns
+        parsed.
+
+        :type field_names: list
+        :param field_names: The names of the columns in format
+            "FirstLineTitle_SecondLineTitle".
+        :type lines_count: int
+        :param lines_count: The number of rows to be read from each file, -1
+            means all rows.
+        :type start_index: int
+        :param start_index: The index of the first row to be read in each file.
+        :type file_paths: list
+        :param file_paths: Overrides the file paths given to the constructor.
+        :type chunk_size: int
+        :param chunk_size: The number of rows parsed at once.
+
+        :return: Returns a python generator of {field_name: value} dictionaries,
+            one for each row. The fields missing in a file are not present.
+        """
 
         # Overriding default instance file paths list by the passed parameter
-        file_paths = self._file_paths if file_paths is None else (file_paths if file_paths is list else [file_paths])
+        file_paths = self._file_paths if file_paths is None else (file_paths if isinstance(file_paths, list) else [file_paths])
         skipped_files = 0
 
-        label_data_dict = {}
-        for a_field_name in field_names:
-            extracted_values = []
-            for a_file_path in file_paths:
-                if not Path(a_file_path).exists():
-                    skipped_files += 1
-                    if skipped_files == len(file_paths):
-                        raise ValueError("No of the given files exists")
-
-                    continue
-
-                requested_file = find_file_by_path(a_file_path)
-                if requested_file is None:
-                    print(f'The file given by "{a_file_path}" path was not found in the given range.', file=sys.stderr)
-                    # Ignoring the file with current file path
-                    continue
-
-                csv_dataframe = pd.read_csv(
-                    requested_file,
-                    skip_blank_lines=True,
-                    header=[0, 1],
-                )
-                csv_dataframe.columns = csv_dataframe.columns.map('_'.join)
-                csv_dataframe = csv_dataframe.replace(np.nan, "", regex=True)
-
-                try:
-                    extracted_values_collection = csv_dataframe[a_field_name].values.tolist()
-                except KeyError:
+        for a_file_path in file_paths:
+            if not Path(a_file_path).exists():
+                skipped_files += 1
+                if skipped_files == len(file_paths):
+                    raise ValueError("No of the given files exists")
+
+                continue
+
+            requested_file = find_file_by_path(a_file_path)
+            if requested_file is None:
+                print(f'The file given by "{a_file_path}" path was not found in the given range.', file=sys.stderr)
+                # Ignoring the file with current file path
+                continue
+
+            cache = CsvColumnCache(requested_file) if self._use_cache else None
+            if cache is not None and not cache.exists() and not cache.build(chunk_size):
+                cache = None
+
+            columns = cache.columns if cache is not None else get_csv_header(requested_file)
+            present_fields = []
+            for a_field_name in field_names:
+                if a_field_name in columns:
+                    present_fields.append(a_field_name)
+                else:
                     print(
-                        f'"{field_name} is not a correct field name. Please make sure the column name is in format "FirstLineTitle_SecondLineTitle"',
+                        f'"{a_field_name} is not a correct field name. Please make sure the column name is in format "FirstLineTitle_SecondLineTitle"',
                         file=sys.stderr
                     )
-                    continue
 
-                length = len(extracted_values_collection)
-                end_index = start_index + lines_count if lines_count != -1 else length
-                extracted_values += extracted_values_collection[start_index: end_index]  # Getting only the desired subset of extracted data
+            if not present_fields:
+                continue
+
+            if cache is not None:
+                rows = cache.rows(present_fields, start_index, lines_count)
+            else:
+                rows = iter_csv_rows(requested_file, present_fields, chunk_size, start_index, lines_count)
+            for row in rows:
+                yield dict(zip(present_fields, row))
+
+    def extract_from_csv_columns(self, field_name: [str, list], lines_count: int = -1,
+                                 start_index: int = 0, file_paths: [list, str] = None,
+                                 chunk_size: int = 10000):
+        """Extracts the values of given columns from all the csv files.
+
+        :param file_paths: Overrides the file paths given to the constructor.
+        :param field_name: The name or the list of names of the columns in
+            format "FirstLineTitle_SecondLineTitle".
+        :param lines_count: The number of rows to be read from each file, -1
+            means all rows.
+        :param start_index: The index of the first row to be read in each file.
+        :param chunk_size: The number of rows parsed at once.
+        :return: The dictionary containing the list of values of each column.
+        """
+
+        # Normalizing the type of arguments to fit the rest of the method
+        field_names = field_name if type(field_name) is list else [field_name]
 
-            label_data_dict[a_field_name] = extracted_values
+        label_data_dict = {a_field_name: [] for a_field_name in field_names}
+        for row in self.iter_csv_columns(field_names, lines_count, start_index, file_paths, chunk_size):
+            for a_field_name, value in row.items():
+                label_data_dict[a_field_name].append(value)
 
         return label_data_dict
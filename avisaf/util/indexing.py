@@ -6,9 +6,92 @@ import json
 import os
 import sys
 import re
+from collections import deque
 from pathlib import Path
 
 
+def is_word_bounded(text: str, start_index: int, end_index: int):
+    """Checks that the text[start_index:end_index] span is not a part of another
+    word, i.e. it is neither preceded nor followed by an alphanumeric character.
+
+    :return: True if the span is bounded by non-alphanumeric characters or by
+        the beginning/end of the text.
+    """
+    if start_index > 0 and text[start_index - 1].isalnum():
+        return False
+    return end_index >= len(text) or not text[end_index].isalnum()
+
+
+class SpansAutomaton:
+    """Aho-Corasick automaton which finds all the occurrences of many spans in
+    a single linear scan of the text. Its run time depends on the length of
+    the text and the number of found occurrences, not on the number of spans.
+    """
+
+    def __init__(self, spans: list):
+        self._spans = list(dict.fromkeys(span for span in spans))  # unique spans, original order
+        self._goto = [{}]       # transitions of each state
+        self._fail = [0]        # the longest proper suffix of the state which is also a state
+        self._output = [[]]     # the spans ending in the state
+
+        for span in self._spans:
+            if not span:
+                continue
+            state = 0
+            for char in span:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(span)
+
+        # computing failure links in breadth-first order
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str):
+        """Finds all word-bounded, non-overlapping occurrences of each span in
+        the text (the occurrences of different spans may overlap).
+
+        :type text: str
+        :param text: The source text to be searched in for the spans.
+
+        :return: The dictionary containing the list of (start_index, end_index)
+            occurrences of each span.
+        """
+        text = str(text)
+        result = {span: [] for span in self._spans}
+        last_end = {}
+        state = 0
+
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+
+            for span in self._output[state]:
+                end_index = index + 1
+                start_index = end_index - len(span)
+                if start_index < last_end.get(span, 0) or not is_word_bounded(text, start_index, end_index):
+                    continue
+                result[span].append((start_index, end_index))
+                last_end[span] = end_index
+
+        return result
+
+
 def get_span_indexes(text: str, span: str):
     """Launches the search for a given span in given text. Allows also looking
     for more complex, token-composed spans.
@@ -22,13 +105,7 @@ def get_span_indexes(text: str, span: str):
         in the text.
     """
 
-    result = {}
-    positions = [pair for pair in find_indexes(text, span, start_offset=0) if pair != (-1, -1)]
-    if positions:               # if positions list contains something else apart (-1, -1) tuple -> a match was found
-        result[span] = positions
-    else:
-        result[span] = []
-    return result
+    return SpansAutomaton([span]).find(text)
 
 
 def find_indexes(text: str, span: str, start_offset: int):
@@ -42,38 +119,38 @@ def find_indexes(text: str, span: str, start_offset: int):
     :type start_offset: int
     :param start_offset: The index of the text where the search is started.
 
-    :return: (start_index, end_index) tuple or (-1, -1) if span is not in the text.
+    :return: The list of (start_index, end_index) tuples or [(-1, -1)] if span
+        is not in the text.
     """
-    try:
-        result = []
-        start_index = str(text).index(span, start_offset)   # find starting index of the span in the text
-        end_index = start_index + len(span)                 # get the end_index of the span
-        if not text[end_index].isalnum():                   # ensure, that the span is not the substring of another word
+    text = str(text)
+    result = []
+    start_index = text.find(span, start_offset) if span else -1   # find starting index of the span in the text
+    while start_index != -1:
+        end_index = start_index + len(span)                         # get the end_index of the span
+        if is_word_bounded(text, start_index, end_index):           # ensure, that the span is not the substring of another word
             result.append((start_index, end_index))
-            others = [pair for pair in find_indexes(text, span, end_index)]
-            result += others
-        return result
+            start_index = text.find(span, end_index)
+        else:
+            start_index = text.find(span, start_index + 1)
 
-    except ValueError:
-        return [(-1, -1)]
+    return result if result else [(-1, -1)]
 
 
 def get_spans_indexes(sentence: str, spans: list):
     """Same as get_span_indexes function, but takes a list of spans instead of
-    a single span.
+    a single span. All the spans are searched for in a single scan of the
+    sentence.
 
     :type sentence: str
     :param sentence: The sentence string.
     :type spans: list
     :param spans: List of substrings to be searched for.
 
-    :return: List of (start_index, end_index) pairs.
+    :return: List of {span: [(start_index, end_index), ...]} dictionaries, one
+        for each span.
     """
-    RESULT = []
-    for span in spans:
-        res = get_span_indexes(sentence, span)
-        RESULT.append(res)
-    return RESULT
+    found = SpansAutomaton(spans).find(sentence)
+    return [{span: found[span]} for span in spans]
 
 
 def print_matches(match_text: str, entities_dict: dict):
@@ -92,18 +169,43 @@ def print_matches(match_text: str, entities_dict: dict):
 
 
 def get_training_data(path: Path):
-    """Gets the training data from a given file.
+    """Gets the training data from a given JSON or msgpack file.
 
     :type path: Path
-    :param path: The file path to the training data JSON file.
+    :param path: The file path to the training data file.
 
     :return: The list of (text, annotations) tuples.
     """
+    from avisaf.util.data_extractor import get_training_data as read_training_data
+
     path = path if path.is_absolute() else path.resolve()
+    return read_training_data(path)
 
-    with path.open(mode='r') as tr_data_file:
-        TR_DATA = json.loads(tr_data_file.read())
-        return TR_DATA
+
+def trim_entities(text: str, entities: list):
+    """Removes leading and trailing white spaces from the entity spans of a
+    single text.
+
+    :type text: str
+    :param text: The text the entities belong to.
+    :type entities: list
+    :param entities: The list of (start_index, end_index, label) entities.
+
+    :return: The list of [start_index, end_index, label] entities without
+        leading/trailing whitespaces.
+    """
+    invalid_span_tokens = re.compile(r'\s')
+    correct_entities = []
+    for ent_start, ent_end, ent_label in entities:
+        correct_start = ent_start
+        correct_end = ent_end
+        while correct_start < len(text) and invalid_span_tokens.match(text[correct_start]):
+            correct_start += 1  # if a leading whitespace is detected, start position increases
+        while correct_end > 1 and invalid_span_tokens.match(text[correct_end - 1]):
+            correct_end -= 1    # if a trailing whitespace is detected, end position decreases
+        correct_entities.append([correct_start, correct_end, ent_label])
+
+    return correct_entities
 
 
 def entity_trimmer(data_file_path: Path):
@@ -111,33 +213,20 @@ def entity_trimmer(data_file_path: Path):
     entity spans.
 
     :type data_file_path: Path
-    :param data_file_path: Data in spaCy JSON format to have leading and trailing
-        whitespaces removed.
+    :param data_file_path: Data in spaCy JSON (or msgpack) format to have
+        leading and trailing whitespaces removed.
 
     :return: Returns the list without leading/trailing whitespaces.
     """
-    invalid_span_tokens = re.compile(r'\s')
-    clean_data = []
+    from avisaf.util.training_data_build import write_training_data
 
-    with data_file_path.open(mode='r') as data_file:
-        data = json.load(data_file)
+    clean_data = []
 
-    for text, annotations in data:
+    for text, annotations in get_training_data(data_file_path):
         entities = annotations['entities']  # get annotations list from dictionary
-        correct_entities = []
-        for ent_start, ent_end, ent_label in entities:
-            correct_start = ent_start
-            correct_end = ent_end
-            while correct_start < len(text) and invalid_span_tokens.match(text[correct_start]):
-                correct_start += 1  # if a leading whitespace is detected, start position increases
-            while correct_end > 1 and invalid_span_tokens.match(text[correct_end - 1]):
-                correct_end -= 1    # if a trailing whitespace is detected, end position decreases
-            correct_entities.append([correct_start, correct_end, ent_label])
-
-        clean_data.append([text, {"entities": correct_entities}])
-
-    with data_file_path.open(mode='w') as data_file:
-        json.dump(clean_data, data_file)
+        clean_data.append([text, {"entities": trim_entities(text, entities)}])
+
+    write_training_data(data_file_path, clean_data)  # keeps the format of the file
 
     return clean_data
 
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Model loading is the module responsible for loading the spaCy models in
+the form the rest of the program expects. Every model should be loaded by the
+load_model function, so that the models saved with float16 word vectors (see
+prune_vectors command) can be used for training and inference as well.
+"""
+
+import spacy
+from pathlib import Path
+
+
+def restore_float32_vectors(nlp):
+    """Casts the word vectors stored as float16 (see prune_vectors command)
+    back to float32 which the models require.
+
+    :type nlp: Language
+    :param nlp: The loaded spaCy model.
+    """
+    if nlp.vocab.vectors.data.dtype.itemsize != 4:
+        from spacy._ml import link_vectors_to_models
+
+        nlp.vocab.vectors.data = nlp.vocab.vectors.data.astype('float32')
+        link_vectors_to_models(nlp.vocab)
+
+
+def load_model(model: [str, Path], disable: list = ()):
+    """Loads the spaCy model and restores its float32 word vectors.
+
+    :type model: str, Path
+    :param model: The string representation of a spaCy model. Either an existing
+        pre-downloaded spaCy model or a path to a local directory.
+    :type disable: list
+    :param disable: The names of the pipes which should not be loaded.
+
+    :return: The loaded spaCy Language object.
+    """
+    nlp = spacy.load(model, disable=disable)
+    restore_float32_vectors(nlp)
+
+    return nlp
@@ -3,12 +3,21 @@
 Training data build is a module responsible mainly for training data
 manipulation. The module is used for sorting training annotations, removing
 overlaps from entity annotations as well as file content formatting.
+
+Training data are stored either as a JSON list of (text, annotations) tuples
+or, for large corpora, as the same list in the compact msgpack format (files
+with .msgpack suffix).
 """
 
+import os
 import json
+import bisect
 import sys
+import srsly
+import logging
 from pathlib import Path
-from avisaf.util.data_extractor import get_training_data
+from avisaf.util.data_extractor import get_training_data, is_msgpack_training_data
+from avisaf.util.indexing import trim_entities
 
 
 def sort_annotations(file_path: Path):
@@ -34,43 +43,52 @@ def sort_annotations(file_path: Path):
         sorted_list = sorted(annot_list, key=lambda tple: (tple[0], tple[1], tple[2]))  # sort entities
         sorted_training_data.append((text, {"entities": sorted_list}))  # recreate new, sorted dictionary
 
-    with file_path.open(mode='w') as file:     # write the result to the same file
-        json.dump(sorted_training_data, file)
-
-    pretty_print_training_data(file_path)       # pretty print the file
+    write_training_data(file_path, sorted_training_data)     # write the result to the same file
 
     return sorted_training_data
 
 
 def remove_overlaps_from_dict(annotations_dict: dict):
     """Removes overlapping annotations from the annotations_dict['entities'] list
-    of (start_index, end_index, label) tuples.
+    of (start_index, end_index, label) tuples. Of two overlapping entities, the
+    longer one is kept (the first one in case of the same length), so the
+    entities are accepted from the longest one and an entity is removed only if
+    it overlaps an already accepted one. An entity which overlapped only a
+    removed entity is therefore kept, e.g. of (0, 10), (1, 3) and (5, 30) the
+    entities (1, 3) and (5, 30) are kept. Duplicate entities are removed. The
+    given list is not modified.
 
     :type annotations_dict: dict
     :param annotations_dict: The dictionary containing the annotations list
         under 'entities' key.
 
-    :return: The list of new annotations without overlaps.
+    :return: The list of new annotations without overlaps sorted by their
+        position.
     """
 
     # get entities list from "entities" key in the annotation dictionary
-    entities_list = annotations_dict['entities']
-    remove_list = []
-    index = 0
-    while index < len(entities_list) - 1:
-        entity_triplet = entities_list[index]
-        next_triplet = entities_list[index + 1]
-        if entity_triplet == next_triplet:
-            entities_list.remove(next_triplet)
-            continue
-        triplet_to_remove = overlap_between(entity_triplet, next_triplet)
-        if triplet_to_remove is not None:  # an overlap detected and resolved
-            remove_list.append(triplet_to_remove)
-        index += 1
-
-    new_annotations = [entity for entity in entities_list if entity not in remove_list]
-
-    return new_annotations
+    entities_list = sorted(annotations_dict['entities'], key=lambda tple: (tple[0], tple[1], tple[2]))
+    unique_entities = [
+        entity_triplet for index, entity_triplet in enumerate(entities_list)
+        if not index or tuple(entities_list[index - 1]) != tuple(entity_triplet)
+    ]
+
+    # the accepted entities do not overlap, so both their starts and ends are sorted
+    accepted_starts = []
+    accepted_ends = []
+    new_annotations = []
+    for entity_triplet in sorted(unique_entities, key=lambda tple: (tple[0] - tple[1], tple[0], tple[1], tple[2])):
+        entity_start, entity_end = entity_triplet[0], entity_triplet[1]
+        if entity_start < entity_end:
+            # the last accepted entity starting before this one ends is the only one which may overlap it
+            index = bisect.bisect_left(accepted_starts, entity_end)
+            if index and accepted_ends[index - 1] > entity_start:
+                continue
+            accepted_starts.insert(index, entity_start)
+            accepted_ends.insert(index, entity_end)
+        new_annotations.append(entity_triplet)
+
+    return sorted(new_annotations, key=lambda tple: (tple[0], tple[1], tple[2]))
 
 
 def remove_overlaps_from_file(file_path: Path):
@@ -85,22 +103,99 @@ def remove_overlaps_from_file(file_path: Path):
         overlapping annotations.
     """
 
-    # sorting annotations list for simpler overlap detection
-    training_data = sort_annotations(file_path)
+    file_path = file_path.resolve()
     result = []
 
-    for text, annotations in training_data:
-        new_annotations = remove_overlaps_from_dict(annotations)
+    for text, annotations in get_training_data(file_path):
+        # sorting annotations list for simpler overlap detection
+        sorted_list = sorted(annotations["entities"], key=lambda tple: (tple[0], tple[1], tple[2]))
+        new_annotations = remove_overlaps_from_dict({"entities": sorted_list})
         result.append((text, {"entities": new_annotations}))  # recreate new (text, annotations) tuple
 
-    with file_path.open(mode='w') as file:  # update the file
-        json.dump(result, file)
-
-    pretty_print_training_data(file_path)
+    write_training_data(file_path, result)  # update the file
 
     return result
 
 
+def postprocess_training_data(training_data):
+    """Fused post-processing of the annotated data, which replaces successive
+    sort_annotations, remove_overlaps_from_file and entity_trimmer calls. The
+    entities of each text are sorted, duplicates and overlaps are removed and
+    leading/trailing whitespaces are trimmed, all in memory.
+
+    :type training_data: iterable
+    :param training_data: The (text, annotations) tuples.
+
+    :return: Returns a python generator of processed (text, annotations) tuples.
+    """
+    for text, annotations in training_data:
+        sorted_list = sorted(annotations["entities"], key=lambda tple: (tple[0], tple[1], tple[2]))
+        new_annotations = remove_overlaps_from_dict({"entities": sorted_list})
+        yield text, {"entities": trim_entities(text, new_annotations)}
+
+
+def write_training_data(file_path: Path, training_data, use_msgpack: bool = None):
+    """Writes the (text, annotations) tuples into the file either in the same
+    format as pretty_print_training_data function does (one tuple per line),
+    in JSONL format (files with .jsonl suffix, read back by get_training_data
+    line by line) or in msgpack format. The data are written into a temporary
+    file which replaces the target file only when everything has been written,
+    so the original file is never left incomplete.
+
+    :type file_path: Path
+    :param file_path: The path of the file to be (re)written.
+    :type training_data: iterable
+    :param training_data: The (text, annotations) tuples to be written.
+    :type use_msgpack: bool
+    :param use_msgpack: A flag indicating whether msgpack format should be used.
+        If None, msgpack is used for files with .msgpack suffix and for
+        existing files which already contain msgpack data. JSONL files cannot
+        be written in msgpack format.
+
+    :return: The number of written tuples.
+    """
+    file_path = Path(file_path).resolve()
+    tmp_path = file_path.with_name(f'.{file_path.name}.{os.getpid()}.tmp')
+    use_jsonl = file_path.suffix == '.jsonl'
+
+    if use_jsonl and use_msgpack:
+        raise ValueError(f'The training data cannot be written to {file_path} in msgpack format, use .msgpack suffix.')
+    if use_jsonl:
+        use_msgpack = False
+    elif use_msgpack is None:
+        use_msgpack = file_path.suffix == '.msgpack' or (
+            file_path.exists() and file_path.stat().st_size != 0 and is_msgpack_training_data(file_path)
+        )
+
+    count = 0
+    try:
+        with tmp_path.open(mode='wb' if use_msgpack else 'w') as file:
+            if use_msgpack:
+                training_data = list(training_data)
+                file.write(srsly.msgpack_dumps(training_data))
+                count = len(training_data)
+            elif use_jsonl:
+                for entry in training_data:
+                    file.write(srsly.json_dumps(entry) + '\n')
+                    count += 1
+            else:
+                file.write('[')
+                for entry in training_data:
+                    if count:
+                        file.write(',\n')
+                    file.write(srsly.json_dumps(entry))
+                    count += 1
+                file.write('\n]' if count else ']')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    return count
+
+
 def overlap_between(entity_triplet, next_triplet):
     """Detects whether there is an overlap between two triplets in the given text.
     If the two entities have the same label, shorter triplet is removed.
@@ -116,11 +211,8 @@ def overlap_between(entity_triplet, next_triplet):
     entity_start, entity_end, entity_label = entity_triplet  # first entity description
     next_start, next_end, next_label = next_triplet  # second entity description
 
-    x = set(range(entity_start, entity_end))
-    y = range(next_start, next_end)
-
     # if an overlap is detected between two tuples.
-    if x.intersection(y):
+    if max(entity_start, next_start) < min(entity_end, next_end):
         # return shorter of the triplets - usually the one which is less correct
         if (entity_end - entity_start) >= (next_end - next_start):
             return next_triplet
@@ -132,26 +224,181 @@ def overlap_between(entity_triplet, next_triplet):
 
 def pretty_print_training_data(file_path: Path):
     """Prints each tuple object of the document in a new line instead of a single
-    very long line.
+    very long line. JSONL files are rewritten as JSONL, msgpack files cannot be
+    pretty printed (see convert_training_data function).
 
     :type file_path: Path
     :param file_path: The path of the file to be rewritten.
     """
 
     file_path = file_path.resolve()
+    if is_msgpack_training_data(file_path):
+        raise ValueError(f'The training data in {file_path} are stored in msgpack format and cannot be pretty printed.')
 
-    with file_path.open(mode='r') as file:
-        content = json.load(file)
+    write_training_data(file_path, get_training_data(file_path), use_msgpack=False)
 
-    with file_path.open(mode='w') as file:
-        file.write('[')
-        for i, entry in enumerate(content):
-            json.dump(entry, file)
-            if i != len(content) - 1:
-                file.write(',\n')
-            else:
-                file.write('\n')
-        file.write(']')
+
+def convert_training_data(source_path: Path, target_path: Path):
+    """Converts the training data file between the JSON, JSONL and msgpack formats. The
+    format of the source file is detected automatically, the format of the
+    target file is given by its suffix (.msgpack, .jsonl or anything else for
+    JSON).
+
+    :type source_path: Path
+    :param source_path: The path to the training data file to be converted.
+    :type target_path: Path
+    :param target_path: The path to the new training data file.
+
+    :return: The number of converted (text, annotations) tuples.
+    """
+    source_path = Path(source_path).resolve()
+    target_path = Path(target_path).resolve()
+
+    use_msgpack = target_path.suffix == '.msgpack'
+    count = write_training_data(target_path, get_training_data(source_path), use_msgpack=use_msgpack)
+    print(f'{count} entries converted from {source_path} to {target_path}.')
+
+    return count
+
+
+def append_to_journal(journal_path: Path, entry):
+    """Appends a single (text, annotations) tuple to the JSONL journal file. The
+    entry is flushed and synced to the disk immediately, so the cost of saving
+    does not grow with the size of the journal and the already written entries
+    survive an interruption of the program.
+
+    :type journal_path: Path
+    :param journal_path: The path to the JSONL journal file. The file (and its
+        directory) is created if it does not exist.
+    :param entry: The (text, annotations) tuple to be appended.
+    """
+    journal_path = Path(journal_path)
+    journal_path.parent.mkdir(parents=True, exist_ok=True)
+
+    line_start = ''
+    if journal_path.exists() and journal_path.stat().st_size != 0:
+        with journal_path.open(mode='rb') as journal:
+            journal.seek(-1, os.SEEK_END)
+            if journal.read(1) != b'\n':
+                line_start = '\n'  # the previous write has been interrupted
+
+    with journal_path.open(mode='a') as journal:
+        journal.write(line_start + json.dumps(entry) + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def read_journal(journal_path: Path):
+    """Reads the (text, annotations) tuples from the JSONL journal file. The
+    lines which cannot be decoded (e.g. the last one written only partially
+    because of an interruption) are skipped.
+
+    :type journal_path: Path
+    :param journal_path: The path to the JSONL journal file.
+
+    :return: Returns a python generator of (text, annotations) tuples.
+    """
+    with Path(journal_path).open(mode='r') as journal:
+        for line_number, line in enumerate(journal, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning(f'Skipping corrupted line {line_number} of the journal {journal_path}')
+
+
+def _staged_path(training_data_path: Path):
+    """Returns the path of the merged training data waiting to replace the
+    training data file (with the same suffix, so its format is kept).
+    """
+    return training_data_path.with_name(f'.{training_data_path.stem}.merging{training_data_path.suffix}')
+
+
+def _merge_compacting(compacting_path: Path, training_data_path: Path):
+    """Merges the entries of the journal being compacted into the training
+    data file. The merged training data are written into a staged file first,
+    then the journal is renamed from .compacting to .merged, which marks the
+    merge as done, and finally the staged file replaces the training data and
+    the .merged journal is removed by _finish_merge function. A merge
+    interrupted before the rename is repeated from the start (the training data
+    file has not been changed yet), a merge interrupted after it is finished.
+
+    :return: The number of entries appended to the training data.
+    """
+    merged_path = compacting_path.with_suffix('.merged')
+    entries = list(read_journal(compacting_path))
+    if not entries:
+        compacting_path.unlink()
+        return 0
+
+    if training_data_path.exists() and training_data_path.stat().st_size != 0:
+        training_data = list(get_training_data(training_data_path))
+        use_msgpack = training_data_path.suffix != '.jsonl' and is_msgpack_training_data(training_data_path)
+    else:
+        training_data = []
+        use_msgpack = training_data_path.suffix == '.msgpack'
+
+    training_data.extend(entries)
+    write_training_data(_staged_path(training_data_path), training_data, use_msgpack=use_msgpack)
+    os.replace(compacting_path, merged_path)
+    _finish_merge(merged_path, training_data_path)
+
+    return len(entries)
+
+
+def _finish_merge(merged_path: Path, training_data_path: Path):
+    """Replaces the training data file by the staged merged training data (if
+    it has not been replaced yet) and removes the merged journal.
+    """
+    staged_path = _staged_path(training_data_path)
+    if staged_path.exists():
+        os.replace(staged_path, training_data_path)
+    merged_path.unlink()
+
+
+def compact_journal(journal_path: Path, training_data_path: Path):
+    """Merges the entries of the JSONL journal into the training data file and
+    removes the journal. The journal is first renamed to a .compacting file, so
+    the entries appended meanwhile go to a new journal. Each entry ends up in
+    the training data file exactly once: the state of the merge is recorded by
+    the name of the journal (see _merge_compacting function), so the .compacting
+    or .merged file left by an interrupted compaction is merged or finished by
+    the next run.
+
+    :type journal_path: Path
+    :param journal_path: The path to the JSONL journal file.
+    :type training_data_path: Path
+    :param training_data_path: The path to the file with the list of
+        (text, annotations) tuples. The file is created if it does not exist.
+
+    :return: The number of entries moved from the journal.
+    """
+    journal_path = Path(journal_path).resolve()
+    training_data_path = Path(training_data_path).resolve()
+    compacting_path = journal_path.with_name(f'{journal_path.name}.compacting')
+    merged_path = journal_path.with_name(f'{journal_path.name}.merged')
+
+    moved = 0
+    if merged_path.exists():
+        print(f'Finishing the interrupted compaction of {journal_path}.', file=sys.stderr)
+        moved += sum(1 for _ in read_journal(merged_path))
+        _finish_merge(merged_path, training_data_path)
+
+    if compacting_path.exists():
+        print(f'Repeating the interrupted compaction of {journal_path}.', file=sys.stderr)
+        moved += _merge_compacting(compacting_path, training_data_path)
+
+    if journal_path.exists():
+        os.replace(journal_path, compacting_path)
+        moved += _merge_compacting(compacting_path, training_data_path)
+    elif not moved:
+        print(f'The journal {journal_path} does not exist, nothing to compact.', file=sys.stderr)
+        return 0
+
+    print(f'{moved} entries moved from {journal_path} to {training_data_path}.')
+
+    return moved
 
 
 def write_sentences():
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Benchmark comparing the longest-first overlap resolution of
+training_data_build.remove_overlaps_from_dict with the original quadratic
+implementation on synthetic, entity-dense annotations (as produced by Matcher
+autobuild with many overlapping rules). Besides the time, the results are
+compared: the number of kept entities, the overlaps left and the entities
+removed needlessly (overlapping no kept entity at all).
+
+Example: python benchmarks/overlap_resolution.py --entities 500 1000 5000
+"""
+
+import sys
+import random
+import timeit
+from argparse import ArgumentParser
+# importing own modules
+from avisaf.util.training_data_build import remove_overlaps_from_dict
+
+
+def legacy_overlap_between(entity_triplet, next_triplet):
+    """The original implementation of training_data_build.overlap_between."""
+    entity_start, entity_end, entity_label = entity_triplet
+    next_start, next_end, next_label = next_triplet
+
+    x = set(range(entity_start, entity_end))
+    y = range(next_start, next_end)
+
+    if x.intersection(y):
+        if (entity_end - entity_start) >= (next_end - next_start):
+            return next_triplet
+        else:
+            return entity_triplet
+    else:
+        return None
+
+
+def legacy_remove_overlaps_from_dict(annotations_dict: dict):
+    """The original implementation of training_data_build.remove_overlaps_from_dict
+    which expects the entities to be sorted.
+    """
+    entities_list = annotations_dict['entities']
+    remove_list = []
+    index = 0
+    while index < len(entities_list) - 1:
+        entity_triplet = entities_list[index]
+        next_triplet = entities_list[index + 1]
+        if entity_triplet == next_triplet:
+            entities_list.remove(next_triplet)
+            continue
+        triplet_to_remove = legacy_overlap_between(entity_triplet, next_triplet)
+        if triplet_to_remove is not None:
+            remove_list.append(triplet_to_remove)
+        index += 1
+
+    return [entity for entity in entities_list if entity not in remove_list]
+
+
+def dense_annotations(entities_count: int, text_length: int, seed: int = 0):
+    """Creates sorted entities densely covering a text, many of them overlapping
+    or duplicated.
+    """
+    rnd = random.Random(seed)
+    labels = ['AIRPLANE', 'CREW', 'AIRPORT_TERM', 'FLIGHT_PHASE', 'AVIATION_TERM']
+    entities = []
+    for _ in range(entities_count):
+        start = rnd.randrange(text_length)
+        end = min(text_length, start + rnd.randint(1, 25))
+        entities.append([start, end, rnd.choice(labels)])
+        if rnd.random() < 0.1:
+            entities.append([start, end, entities[-1][2]])  # duplicate
+    return sorted(entities, key=lambda tple: (tple[0], tple[1], tple[2]))
+
+
+def remaining_overlaps(entities: list):
+    """Counts the overlapping pairs of neighbouring entities left after resolution."""
+    return sum(1 for first, second in zip(entities, entities[1:]) if first[1] > second[0])
+
+
+def needless_removals(entities: list, result: list):
+    """Counts the removed entities which do not overlap any of the kept ones."""
+    kept = {tuple(entity) for entity in result}
+    covered = [False] * (max((entity[1] for entity in entities), default=0) + 1)
+    for start, end, label in kept:
+        for position in range(start, end):
+            covered[position] = True
+    return sum(
+        1 for start, end, label in {tuple(entity) for entity in entities} - kept
+        if start < end and not any(covered[start:end])
+    )
+
+
+def main():
+    args = ArgumentParser(description='Benchmark of entity overlap resolution.')
+    args.add_argument('--entities', type=int, nargs='+', default=[100, 1000, 5000], help='Entities per text.')
+    args.add_argument('--density', type=float, default=2.0, help='Entities per 10 characters of the text.')
+    args.add_argument('--repeat', type=int, default=3, help='The number of measurements (the best one is used).')
+    parsed = args.parse_args()
+
+    print(f'{"entities":>10} {"legacy [ms]":>12} {"new [ms]":>12} {"speedup":>9} {"kept legacy/new":>16} '
+          f'{"overlaps left legacy/new":>25} {"needless removals legacy/new":>29}')
+    for entities_count in parsed.entities:
+        entities = dense_annotations(entities_count, int(entities_count * 10 / parsed.density))
+
+        legacy_time = min(timeit.repeat(
+            lambda: legacy_remove_overlaps_from_dict({"entities": list(entities)}), number=1, repeat=parsed.repeat
+        ))
+        new_time = min(timeit.repeat(
+            lambda: remove_overlaps_from_dict({"entities": entities}), number=1, repeat=parsed.repeat
+        ))
+
+        legacy_result = legacy_remove_overlaps_from_dict({"entities": list(entities)})
+        new_result = remove_overlaps_from_dict({"entities": entities})
+        kept = f'{len(legacy_result)}/{len(new_result)}'
+        overlaps = f'{remaining_overlaps(legacy_result)}/{remaining_overlaps(new_result)}'
+        removals = f'{needless_removals(entities, legacy_result)}/{needless_removals(entities, new_result)}'
+        print(
+            f'{entities_count:>10} {legacy_time * 1000:>12.2f} {new_time * 1000:>12.2f} '
+            f'{legacy_time / new_time:>8.1f}x {kept:>16} {overlaps:>25} {removals:>29}'
+        )
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Benchmark comparing the wall-clock time of the single process NER training
+loop with the data-parallel training (train_ner -j N) on the same data. Each
+configuration trains a model for the same number of iterations and the final
+models are evaluated on the same held-out data, so the speedup can be compared
+at the reached F-score.
+
+Example: python benchmarks/parallel_training.py -d train.json --dev-data dev.json -m en_core_web_md -j 1 8 32
+"""
+
+import sys
+import time
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+# importing own modules
+from avisaf.training.evaluation import evaluate_ner
+from avisaf.training.new_entity_trainer import train_spacy_model
+from avisaf.util.data_extractor import get_entities, get_training_data
+
+
+def main():
+    args = ArgumentParser(description='Benchmark of data-parallel NER training.')
+    args.add_argument('-d', '--data', required=True, help='The training data file.')
+    args.add_argument('--dev-data', required=True, help='The held-out data file used for the final evaluation.')
+    args.add_argument('-m', '--model', default=None, help='The spaCy model to be trained (a blank one by default).')
+    args.add_argument('-i', '--iterations', type=int, default=5, help='The number of training iterations.')
+    args.add_argument('-j', '--processes', type=int, nargs='+', default=[1, 4], help='The numbers of processes.')
+    args.add_argument('--sync-every', type=int, default=1000, help='Examples between weight averaging.')
+    args.add_argument('-b', '--batch-size', type=int, default=16, help='The size of the training batches.')
+    parsed = args.parse_args()
+
+    data_path = Path(parsed.data).resolve()
+    dev_data = get_training_data(Path(parsed.dev_data).resolve())
+    labels = get_entities()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for processes in parsed.processes:
+            start_time = time.time()
+            nlp = train_spacy_model(
+                iter_number=parsed.iterations,
+                model=parsed.model,
+                new_model_name=str(Path(work_dir, f'benchmark_{processes}')),  # an absolute path
+                tr_data_srcfile=data_path,
+                batch_size=parsed.batch_size,
+                checkpoint_every=0,
+                processes=processes,
+                sync_every=parsed.sync_every
+            )
+            elapsed = time.time() - start_time
+
+            with nlp.disable_pipes(*[pipe for pipe in nlp.pipe_names if pipe != 'ner']):
+                f_score = evaluate_ner(nlp, dev_data, labels)['ents_f']
+            results.append((processes, elapsed, f_score))
+
+    baseline = results[0][1]
+    print(f'{"processes":>10} {"time [s]":>10} {"speedup":>9} {"F-score":>9}')
+    for processes, elapsed, f_score in results:
+        print(f'{processes:>10} {elapsed:>10.1f} {baseline / elapsed:>8.2f}x {f_score:>9.3f}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
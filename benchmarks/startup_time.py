@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Cold-start import time check. Each subcommand is imported in a fresh python
+interpreter the same way as avisaf.main dispatches it and the script fails
+(non-zero exit code) if the import time exceeds the given budget or if any of
+the heavy modules which the subcommand does not need has been loaded.
+
+Example: python benchmarks/startup_time.py --budget 0.5
+"""
+
+import sys
+import json
+import subprocess
+from argparse import ArgumentParser
+
+# subcommand -> (modules imported by its dispatch, modules it must not load)
+SUBCOMMANDS = {
+    'main': (['avisaf.main'], ['spacy', 'pandas', 'sklearn', 'gensim', 'matplotlib']),
+    'test_ner': (['avisaf.main', 'avisaf.tagging.batch_tagger'], ['pandas', 'sklearn', 'gensim', 'matplotlib']),
+    'tag_ner': (['avisaf.main', 'avisaf.tagging.batch_tagger'], ['sklearn', 'gensim', 'matplotlib']),
+    'serve_ner': (['avisaf.main', 'avisaf.tagging.ner_server'], ['pandas', 'sklearn', 'gensim', 'matplotlib']),
+    'train_ner': (['avisaf.main', 'avisaf.training.new_entity_trainer'], ['sklearn', 'gensim', 'matplotlib']),
+    'autobuild': (['avisaf.main', 'avisaf.training.training_data_creator'], ['sklearn', 'gensim', 'matplotlib']),
+}
+
+PROBE = '''
+import sys, json, time, importlib
+start = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+'''
+
+
+def measure(modules: list, forbidden: list, repeat: int):
+    """Imports the modules in fresh interpreters and returns the best import
+    time along with the list of forbidden modules which have been loaded.
+    """
+    best, loaded = None, []
+    for _ in range(repeat):
+        probe = PROBE.format(modules=modules, forbidden=forbidden)
+        output = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True).stdout
+        result = json.loads(output)
+        best = result['seconds'] if best is None else min(best, result['seconds'])
+        loaded = result['loaded']
+    return best, loaded
+
+
+def main():
+    args = ArgumentParser(description='Checks the cold-start import time of avisaf subcommands.')
+    args.add_argument('--budget', type=float, default=0.5, help='Import time budget of "main" in seconds.')
+    args.add_argument(
+        '--subcommand-budget',
+        type=float,
+        default=5.0,
+        help='Import time budget of the subcommands in seconds (they load spaCy).'
+    )
+    args.add_argument('--repeat', type=int, default=3, help='The number of measurements (the best one is used).')
+    args.add_argument('subcommands', nargs='*', default=list(SUBCOMMANDS.keys()))
+    parsed = args.parse_args()
+
+    failed = False
+    for subcommand in parsed.subcommands:
+        modules, forbidden = SUBCOMMANDS[subcommand]
+        budget = parsed.budget if subcommand == 'main' else parsed.subcommand_budget
+        try:
+            seconds, loaded = measure(modules, forbidden, parsed.repeat)
+        except subprocess.CalledProcessError as ex:
+            print(f'{subcommand}: import failed\n{ex.stderr}', file=sys.stderr)
+            failed = True
+            continue
+
+        status = 'OK'
+        if seconds > budget or loaded:
+            status = 'FAILED'
+            failed = True
+        print(f'{subcommand:<10} {seconds:7.3f}s (budget {budget:.3f}s) {status}', end='')
+        print(f' - unexpectedly loaded: {", ".join(loaded)}' if loaded else '')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,6 +25,7 @@ setup(
     packages=[
         'avisaf',
         'avisaf.training',
+        'avisaf.tagging',
         'avisaf.classification',
         'avisaf.util'
     ],
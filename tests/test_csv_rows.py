@@ -0,0 +1,53 @@
+"""Values of the ASRS CSV columns read with and without the columnar cache."""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+
+from avisaf.util.data_extractor import iter_csv_rows  # noqa: E402
+
+FIELD_NAMES = ['Person_ACN', 'Time_Date', 'Place_Altitude', 'Report 1_Narrative', 'Place_Runway']
+
+
+@pytest.fixture
+def csv_path(tmp_path, monkeypatch):
+    monkeypatch.setenv('AVISAF_CACHE_DIR', str(tmp_path.joinpath('cache')))
+    path = tmp_path.joinpath('ASRS_export.csv')
+    with path.open(mode='w') as file:
+        file.write('Person,Time,Report 1,Report 1,Place,Place\n')
+        file.write('ACN,Date,Narrative,Callback,Altitude,Runway\n')
+        for index in range(25):
+            altitude = '' if index == 7 else index * 1.5
+            # an integer column missing a single value in the last chunk
+            runway = '' if index == 23 else index
+            file.write(f'{1000 + index},2019{index % 12 + 1:02d},"Narrative {index}",,{altitude},{runway}\n')
+    return path
+
+
+def read_with_pandas(path):
+    data = pd.read_csv(path, header=[0, 1])
+    data.columns = data.columns.map('_'.join)
+    data = data.replace(np.nan, '', regex=True)
+    return list(zip(*(data[field_name].values.tolist() for field_name in FIELD_NAMES)))
+
+
+@pytest.mark.parametrize('use_cache', [False, True])
+def test_column_kinds_are_inferred_from_the_whole_file(csv_path, use_cache):
+    expected = read_with_pandas(csv_path)
+    rows = list(iter_csv_rows(csv_path, FIELD_NAMES, chunk_size=10, use_cache=use_cache))
+
+    assert rows == expected
+    assert [type(value) for value in rows[0]] == [int, int, float, str, float]
+    assert rows[7][2] == '' and rows[23][4] == ''
+
+
+@pytest.mark.parametrize('use_cache', [False, True])
+def test_rows_range_and_strings(csv_path, use_cache):
+    expected = read_with_pandas(csv_path)
+    rows = list(iter_csv_rows(csv_path, FIELD_NAMES, chunk_size=10, start_index=8, lines_count=5, use_cache=use_cache))
+    assert rows == expected[8:13]
+
+    strings = list(iter_csv_rows(csv_path, FIELD_NAMES, chunk_size=10, use_cache=use_cache, as_strings=True))
+    assert strings[1] == ('1001', '201902', '1.5', 'Narrative 1', '1')
+    assert strings[7][2] == ''
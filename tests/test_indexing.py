@@ -0,0 +1,121 @@
+"""Span search of the automaton compared with the per-span search and with the
+original recursive implementation."""
+
+import random
+
+import pytest
+
+from avisaf.util.indexing import SpansAutomaton, find_indexes, get_span_indexes, get_spans_indexes
+
+WORDS = ['B737', 'B737 MAX', 'MAX', 'AX', 'ATC', 'ATCT', 'a', 'aa', 'FL350', 'climb', 'climbed', 'Tower']
+SEPARATORS = [' ', ', ', '. ', '-', '/', '(', ')', '\n']
+
+
+def baseline_find_indexes(text: str, span: str, start_offset: int):
+    """The original implementation of indexing.find_indexes."""
+    try:
+        result = []
+        start_index = str(text).index(span, start_offset)
+        end_index = start_index + len(span)
+        if not text[end_index].isalnum():
+            result.append((start_index, end_index))
+            others = [pair for pair in baseline_find_indexes(text, span, end_index)]
+            result += others
+        return result
+
+    except ValueError:
+        return [(-1, -1)]
+
+
+def baseline_get_spans_indexes(sentence: str, spans: list):
+    """The original implementation of indexing.get_spans_indexes."""
+    result = []
+    for span in spans:
+        positions = [pair for pair in baseline_find_indexes(sentence, span, 0) if pair != (-1, -1)]
+        result.append({span: positions})
+    return result
+
+
+def random_text(rnd: random.Random, words_count: int, end: str = '.'):
+    parts = []
+    for _ in range(words_count):
+        parts.append(rnd.choice(WORDS))
+        parts.append(rnd.choice(SEPARATORS))
+    return ''.join(parts[:-1]) + end
+
+
+def occurrences(text: str, span: str):
+    start_index = text.find(span)
+    while start_index != -1:
+        yield start_index, start_index + len(span)
+        start_index = text.find(span, start_index + 1)
+
+
+def baseline_is_exact(text: str, spans: list):
+    """The original implementation checks only the character following an
+    occurrence, fails on an occurrence at the end of the text and stops at
+    the first occurrence followed by an alphanumeric character."""
+    return all(
+        (start == 0 or not text[start - 1].isalnum()) and end < len(text) and not text[end].isalnum()
+        for span in spans for start, end in occurrences(text, span)
+    )
+
+
+def test_automaton_matches_per_span_search():
+    rnd = random.Random(0)
+    for _ in range(500):
+        text = random_text(rnd, rnd.randint(0, 15), end=rnd.choice(['', '.']))
+        spans = rnd.sample(WORDS, rnd.randint(1, 6))
+
+        found = SpansAutomaton(spans).find(text)
+        for span in spans:
+            expected = [pair for pair in find_indexes(text, span, 0) if pair != (-1, -1)]
+            assert found[span] == expected, (text, span)
+
+
+def test_same_result_as_baseline_where_it_is_exact():
+    rnd = random.Random(1)
+    compared = 0
+    for _ in range(2000):
+        text = random_text(rnd, rnd.randint(1, 12))
+        spans = rnd.sample(WORDS, rnd.randint(1, 5))
+        if not baseline_is_exact(text, spans):
+            continue
+        compared += 1
+        assert get_spans_indexes(text, spans) == baseline_get_spans_indexes(text, spans), (text, spans)
+
+    assert compared > 100
+
+
+def test_overlapping_spans():
+    text = 'The B737 MAX and the B737 climbed.'
+    spans = ['B737 MAX', 'B737', 'MAX']
+
+    expected = [{'B737 MAX': [(4, 12)]}, {'B737': [(4, 8), (21, 25)]}, {'MAX': [(9, 12)]}]
+    assert get_spans_indexes(text, spans) == expected
+    assert baseline_get_spans_indexes(text, spans) == expected
+
+
+def test_overlapping_occurrences_of_a_span():
+    # the occurrences of a single span do not overlap
+    assert get_span_indexes('a-a-a.', 'a-a') == {'a-a': [(0, 3)]}
+    assert get_span_indexes('a-a-a.', 'a-a') == baseline_get_spans_indexes('a-a-a.', ['a-a'])[0]
+
+
+@pytest.mark.parametrize('text, span, expected, baseline', [
+    # a span inside a longer word is skipped, the baseline stopped the search there
+    ('ATCT and ATC.', 'ATC', [(9, 12)], []),
+    # a span preceded by a part of a word is not matched, the baseline checked only the following character
+    ('B737 ', '737', [], [(1, 4)]),
+    ('The climbed climb ', 'climb', [(12, 17)], []),
+])
+def test_word_boundaries(text, span, expected, baseline):
+    assert get_span_indexes(text, span) == {span: expected}
+    assert find_indexes(text, span, 0) == (expected or [(-1, -1)])
+    assert baseline_get_spans_indexes(text, [span]) == [{span: baseline}]
+
+
+def test_span_at_the_end_of_the_text():
+    assert get_span_indexes('cleared by Tower', 'Tower') == {'Tower': [(11, 16)]}
+    with pytest.raises(IndexError):
+        baseline_find_indexes('cleared by Tower', 'Tower', 0)
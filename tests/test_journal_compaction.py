@@ -0,0 +1,104 @@
+"""Compaction of the annotation journal interrupted at each of its steps."""
+
+import os
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('srsly')
+pytest.importorskip('pandas')
+
+import avisaf.util.training_data_build as train  # noqa: E402
+from avisaf.util.data_extractor import get_training_data  # noqa: E402
+
+TRAINING_DATA = [
+    ['The B737 climbed to FL350.', {'entities': [[4, 8, 'AIRPLANE']]}],
+    ['Captain reported icing.', {'entities': [[0, 7, 'CREW']]}],
+]
+JOURNAL_ENTRIES = [
+    ['The A320 descended to FL240.', {'entities': [[4, 8, 'AIRPLANE']]}],
+    ['First officer reported icing.', {'entities': [[0, 13, 'CREW']]}],
+    ['The A320 descended to FL240.', {'entities': [[4, 8, 'AIRPLANE']]}],   # a repeated annotation is kept
+]
+
+
+class Crash(Exception):
+    pass
+
+
+class FileOperations:
+    """Counts the renames and removals of files and raises Crash at the given one."""
+
+    def __init__(self, monkeypatch, crash_at=None):
+        self.count = 0
+        self.crash_at = crash_at
+        replace, unlink = os.replace, Path.unlink
+
+        def crashing_replace(*args, **kwargs):
+            self._step()
+            return replace(*args, **kwargs)
+
+        def crashing_unlink(path, *args, **kwargs):
+            self._step()
+            return unlink(path, *args, **kwargs)
+
+        monkeypatch.setattr(train.os, 'replace', crashing_replace)
+        monkeypatch.setattr(Path, 'unlink', crashing_unlink)
+
+    def _step(self):
+        self.count += 1
+        if self.count == self.crash_at:
+            raise Crash()
+
+
+def prepare(directory: Path, suffix: str):
+    directory.mkdir(exist_ok=True)
+    training_data_path = directory.joinpath(f'train{suffix}')
+    journal_path = directory.joinpath('annotations.jsonl')
+    train.write_training_data(training_data_path, TRAINING_DATA)
+    for entry in JOURNAL_ENTRIES:
+        train.append_to_journal(journal_path, entry)
+    return journal_path, training_data_path
+
+
+def count_file_operations(tmp_path, monkeypatch, suffix):
+    journal_path, training_data_path = prepare(tmp_path.joinpath('count'), suffix)
+    with monkeypatch.context() as patch:
+        operations = FileOperations(patch)
+        train.compact_journal(journal_path, training_data_path)
+    return operations.count
+
+
+@pytest.mark.parametrize('suffix', ['.json', '.jsonl', '.msgpack'])
+def test_uninterrupted_compaction(tmp_path, suffix):
+    journal_path, training_data_path = prepare(tmp_path, suffix)
+
+    assert train.compact_journal(journal_path, training_data_path) == len(JOURNAL_ENTRIES)
+    assert list(get_training_data(training_data_path)) == TRAINING_DATA + JOURNAL_ENTRIES
+    assert sorted(path.name for path in tmp_path.iterdir()) == [training_data_path.name]
+
+
+@pytest.mark.parametrize('suffix', ['.json', '.jsonl', '.msgpack'])
+def test_interrupted_compaction_is_finished_exactly_once(tmp_path, monkeypatch, suffix):
+    steps = count_file_operations(tmp_path, monkeypatch, suffix)
+    assert steps >= 4
+
+    for crash_at in range(1, steps + 1):
+        directory = tmp_path.joinpath(f'crash_{crash_at}')
+        journal_path, training_data_path = prepare(directory, suffix)
+
+        with monkeypatch.context() as patch:
+            FileOperations(patch, crash_at)
+            with pytest.raises(Crash):
+                train.compact_journal(journal_path, training_data_path)
+
+        # the training data are either untouched or already contain all the entries
+        assert list(get_training_data(training_data_path)) in (TRAINING_DATA, TRAINING_DATA + JOURNAL_ENTRIES)
+
+        # new annotations may be appended before the next compaction
+        train.append_to_journal(journal_path, TRAINING_DATA[0])
+        train.compact_journal(journal_path, training_data_path)
+
+        assert list(get_training_data(training_data_path)) == TRAINING_DATA + JOURNAL_ENTRIES + TRAINING_DATA[:1], \
+            f'the compaction interrupted at file operation {crash_at}'
+        assert sorted(path.name for path in directory.iterdir()) == [training_data_path.name]
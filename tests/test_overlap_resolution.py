@@ -0,0 +1,93 @@
+"""Overlap resolution of the annotated entities compared with the original
+pairwise implementation."""
+
+import random
+
+import pytest
+
+pytest.importorskip('srsly')
+pytest.importorskip('pandas')
+
+from avisaf.util.training_data_build import remove_overlaps_from_dict  # noqa: E402
+
+
+def baseline_remove_overlaps(entities: list):
+    """The original pairwise implementation, which compares only the neighbouring
+    entities of the sorted list (and may therefore leave some overlaps)."""
+    entities_list = sorted(entities, key=lambda tple: (tple[0], tple[1], tple[2]))
+    remove_list = []
+    index = 0
+    while index < len(entities_list) - 1:
+        entity_triplet = entities_list[index]
+        next_triplet = entities_list[index + 1]
+        if entity_triplet == next_triplet:
+            entities_list.remove(next_triplet)
+            continue
+        entity_start, entity_end, _ = entity_triplet
+        next_start, next_end, _ = next_triplet
+        if set(range(entity_start, entity_end)).intersection(range(next_start, next_end)):
+            shorter = next_triplet if entity_end - entity_start >= next_end - next_start else entity_triplet
+            remove_list.append(shorter)
+        index += 1
+
+    return [entity for entity in entities_list if entity not in remove_list]
+
+
+def overlap(first, second):
+    return max(first[0], second[0]) < min(first[1], second[1])
+
+
+def random_entities(rnd: random.Random, count: int):
+    entities = []
+    for _ in range(count):
+        start = rnd.randrange(40)
+        entities.append([start, start + rnd.randint(1, 10), rnd.choice(['AIRPLANE', 'CREW'])])
+    return entities
+
+
+def test_entity_overlapping_only_a_removed_entity_is_kept():
+    entities = [[0, 10, 'L'], [1, 3, 'M'], [5, 30, 'E']]
+
+    assert remove_overlaps_from_dict({'entities': entities}) == [[1, 3, 'M'], [5, 30, 'E']]
+    # the pairwise baseline keeps two overlapping entities instead
+    assert baseline_remove_overlaps(entities) == [[0, 10, 'L'], [5, 30, 'E']]
+
+
+def test_duplicates_and_equal_lengths():
+    entities = [[4, 8, 'CREW'], [0, 4, 'AIRPLANE'], [4, 8, 'CREW'], [2, 6, 'CREW']]
+    original = [list(entity) for entity in entities]
+
+    assert remove_overlaps_from_dict({'entities': entities}) == [[0, 4, 'AIRPLANE'], [4, 8, 'CREW']]
+    assert entities == original
+
+
+def test_no_overlaps_are_left_and_only_shorter_entities_are_removed():
+    rnd = random.Random(0)
+    for _ in range(2000):
+        entities = random_entities(rnd, rnd.randint(0, 12))
+        result = remove_overlaps_from_dict({'entities': entities})
+
+        assert result == sorted(result)
+        assert not any(overlap(first, second) for index, first in enumerate(result) for second in result[index + 1:])
+        kept = {tuple(entity) for entity in result}
+        for removed in {tuple(entity) for entity in entities} - kept:
+            # a removed entity overlaps a kept one which is longer, or of the same length and earlier
+            assert any(
+                overlap(removed, entity) and (entity[1] - entity[0], -entity[0]) >= (removed[1] - removed[0], -removed[0])
+                for entity in kept
+            )
+
+
+def test_same_result_as_baseline_for_separate_overlapping_pairs():
+    rnd = random.Random(1)
+    compared = 0
+    for _ in range(2000):
+        entities = random_entities(rnd, rnd.randint(0, 8))
+        unique = {tuple(entity) for entity in entities}
+        # the baseline is exact only if no entity overlaps more than one other entity
+        if any(sum(overlap(entity, other) for other in unique if other != entity) > 1 for entity in unique):
+            continue
+        compared += 1
+        assert remove_overlaps_from_dict({'entities': entities}) == baseline_remove_overlaps(entities)
+
+    assert compared > 100
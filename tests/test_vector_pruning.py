@@ -0,0 +1,72 @@
+"""Round trip of a model whose word vectors were pruned and stored as float16."""
+
+import json
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip('numpy')
+spacy = pytest.importorskip('spacy')
+from spacy.gold import GoldParse  # noqa: E402
+
+from avisaf.tagging.batch_tagger import load_ner_model  # noqa: E402
+from avisaf.training.vector_pruning import prune_model_vectors  # noqa: E402
+from avisaf.util.model_loading import load_model  # noqa: E402
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+TRAINING_DATA = [
+    ['The B737 climbed to FL350.', {'entities': [[4, 8, 'AIRPLANE'], [20, 25, 'ALTITUDE']]}],
+    ['The A320 descended to FL240.', {'entities': [[4, 8, 'AIRPLANE'], [22, 27, 'ALTITUDE']]}],
+    ['Captain reported icing near WAVEY.', {'entities': [[0, 7, 'CREW'], [17, 22, 'WEATHER']]}],
+]
+
+
+@pytest.fixture
+def model_with_vectors(tmp_path):
+    nlp = spacy.blank('en')
+    words = sorted({token.text for text, _ in TRAINING_DATA for token in nlp.make_doc(text)} | {'unused', 'other'})
+    random_state = np.random.RandomState(0)
+    for word in words:
+        nlp.vocab.set_vector(word, random_state.uniform(-1, 1, (8,)).astype('float32'))
+    nlp.vocab.vectors.name = 'test_vectors'
+
+    ner = nlp.create_pipe('ner')
+    nlp.add_pipe(ner)
+    for _, annotations in TRAINING_DATA:
+        for _, _, label in annotations['entities']:
+            ner.add_label(label)
+    optimizer = nlp.begin_training()
+    for _ in range(3):
+        for text, annotations in TRAINING_DATA:
+            doc = nlp.make_doc(text)
+            nlp.update([doc], [GoldParse(doc, entities=annotations['entities'])], sgd=optimizer)
+
+    model_path = tmp_path.joinpath('model')
+    nlp.to_disk(model_path)
+    return model_path
+
+
+def test_pruned_float16_model_round_trip(model_with_vectors, tmp_path, monkeypatch):
+    monkeypatch.chdir(PROJECT_ROOT)  # entities_labels.json
+    corpus_path = tmp_path.joinpath('corpus.json')
+    corpus_path.write_text(json.dumps(TRAINING_DATA))
+    output_path = tmp_path.joinpath('pruned')
+
+    prune_model_vectors(model_with_vectors, output_path, 5, [corpus_path], dev_data_path=corpus_path, float16=True)
+
+    assert spacy.load(output_path).vocab.vectors.data.dtype == np.float16  # stored as float16
+    for nlp in (load_model(output_path), load_ner_model(output_path)):
+        vectors = nlp.vocab.vectors
+        assert vectors.data.dtype == np.float32
+        assert vectors.shape[0] == 5
+        assert nlp.vocab.has_vector('B737')
+
+        doc = nlp('The B737 climbed to FL350.')
+        assert doc.vector.dtype == np.float32
+
+        # the loaded model can be trained further
+        doc = nlp.make_doc(TRAINING_DATA[0][0])
+        losses = {}
+        nlp.update([doc], [GoldParse(doc, entities=TRAINING_DATA[0][1]['entities'])], sgd=nlp.resume_training(),
+                   losses=losses)
+        assert np.isfinite(losses['ner'])